@@ -0,0 +1,178 @@
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+from app.api.clients import batch_client
+from app.services.image_difficulty import normalize_thinking_mode
+from app.services.zhipuai_service import ZhipuAIService, get_zhipuai_service
+from app.utils.image_validation import (
+    MAX_IMAGE_SIZE,
+    ImageValidationError,
+    ValidatedImage,
+    validate_upload,
+)
+from app.utils.metrics import stage_timer
+from app.utils.stats import latency_summary
+import asyncio
+import json
+import logging
+import os
+import time
+import zipfile
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 批量识别默认并发数和单批最大图片数
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 16))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+
+ZIP_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+BatchItem = Tuple[str, Callable[[], Awaitable[ValidatedImage]]]
+
+
+def sse_event(payload: Dict[str, Any]) -> str:
+    with stage_timer("serialize"):
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def is_zip_upload(file: UploadFile) -> bool:
+    return (
+        file.content_type in ('application/zip', 'application/x-zip-compressed')
+        or (file.filename or '').lower().endswith('.zip')
+    )
+
+
+def zip_items(file: UploadFile) -> List[BatchItem]:
+    """列出压缩包中的图片条目，按需读取（读取前按解压后大小拒绝超限文件）"""
+    try:
+        archive = zipfile.ZipFile(file.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail=f"无法解析压缩包: {file.filename}")
+
+    items: List[BatchItem] = []
+    for info in archive.infolist():
+        if info.is_dir() or not info.filename.lower().endswith(ZIP_IMAGE_EXTENSIONS):
+            continue
+
+        async def load(info: zipfile.ZipInfo = info) -> ValidatedImage:
+            if info.file_size > MAX_IMAGE_SIZE:
+                raise ImageValidationError(f"文件大小不能超过 {MAX_IMAGE_SIZE // (1024 * 1024)}MB")
+            data = await asyncio.to_thread(archive.read, info)
+            return ValidatedImage.from_bytes(data)
+
+        items.append((info.filename, load))
+    return items
+
+
+def collect_items(files: List[UploadFile]) -> List[BatchItem]:
+    """展开上传文件和压缩包为待识别条目"""
+    items: List[BatchItem] = []
+    for file in files:
+        if is_zip_upload(file):
+            items.extend(zip_items(file))
+        else:
+            items.append((file.filename or 'image', lambda file=file: validate_upload(file)))
+    return items
+
+
+async def recognize_item(
+    zhipuai_service: ZhipuAIService,
+    index: int,
+    filename: str,
+    load: Callable[[], Awaitable[ValidatedImage]],
+    semaphore: asyncio.Semaphore,
+    custom_prompt: Optional[str],
+    thinking: Optional[str] = None,
+) -> Dict[str, Any]:
+    """在并发限制内识别单张图片，失败时返回错误信息而不抛出"""
+    async with semaphore:
+        start_time = time.time()
+        result: Dict[str, Any] = {'type': 'item', 'index': index, 'filename': filename}
+        try:
+            image = await load()
+            recognition = await zhipuai_service.recognize(image=image, custom_prompt=custom_prompt, thinking=thinking)
+            result.update(
+                success=True,
+                recognized_text=recognition.text,
+                cached=recognition.cached,
+            )
+        except ImageValidationError as e:
+            result.update(success=False, message=str(e))
+        except Exception as e:
+            logger.error(f"Batch item {filename} recognition failed: {e}")
+            result.update(success=False, message=f'识别失败: {str(e)}')
+        result['processing_time'] = round(time.time() - start_time, 2)
+        return result
+
+
+@router.post("/upload-batch", dependencies=[Depends(batch_client)])
+async def upload_and_recognize_batch(
+    files: List[UploadFile] = File(...),
+    custom_prompt: Optional[str] = Form(None),
+    concurrency: Optional[int] = Form(None),
+    thinking: Optional[str] = Form(None, description="思考模式：auto / enabled / disabled"),
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
+):
+    """批量上传图片（或 zip 压缩包）并识别文字，按完成顺序流式返回每张图片的结果"""
+    try:
+        thinking = normalize_thinking_mode(thinking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items = collect_items(files)
+    if not items:
+        raise HTTPException(status_code=400, detail="未找到可识别的图片")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"单次最多识别 {BATCH_MAX_ITEMS} 张图片")
+
+    limit = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    logger.info(f"开始批量识别，共 {len(items)} 张图片，并发数: {limit}")
+
+    async def generate_stream():
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(limit)
+        tasks = [
+            asyncio.ensure_future(recognize_item(zhipuai_service, index, filename, load, semaphore, custom_prompt, thinking))
+            for index, (filename, load) in enumerate(items)
+        ]
+        latencies: List[float] = []
+        succeeded = cached = 0
+
+        try:
+            yield sse_event({'type': 'start', 'total': len(items), 'concurrency': limit})
+
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                latencies.append(result['processing_time'])
+                if result['success']:
+                    succeeded += 1
+                    cached += int(result['cached'])
+                yield sse_event(result)
+
+            yield sse_event({
+                'type': 'summary',
+                'total': len(items),
+                'succeeded': succeeded,
+                'failed': len(items) - succeeded,
+                'cached': cached,
+                'elapsed': round(time.time() - start_time, 2),
+                'latency': latency_summary(latencies),
+            })
+            yield sse_event({'type': 'end'})
+        finally:
+            # 客户端断开时取消尚未完成的识别
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*"
+        }
+    )
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, Header, HTTPException, Request
+from app.services.client_quota import (
+    BATCH,
+    INTERACTIVE,
+    ClientAuthError,
+    ClientContext,
+    QuotaExceededError,
+    current_client,
+    get_client_quotas,
+)
+import math
+from typing import Optional
+
+router = APIRouter()
+
+
+def client_quota(traffic_class: str):
+    """创建识别、微调接口的依赖：识别客户端、检查请求配额，并设置上游公平调度使用的客户端上下文
+
+    请求头 X-Client-Class: batch 可将交互接口的请求降级为批量流量（不能升级）。
+    """
+
+    async def dependency(
+        request: Request,
+        x_api_key: Optional[str] = Header(None),
+        x_client_id: Optional[str] = Header(None),
+        x_client_class: Optional[str] = Header(None),
+    ) -> ClientContext:
+        quotas = get_client_quotas()
+        requested = BATCH if traffic_class == BATCH or (x_client_class or "").lower() == BATCH else INTERACTIVE
+        try:
+            client = quotas.identify(x_api_key, x_client_id, request.client.host if request.client else None, requested)
+        except ClientAuthError as e:
+            raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "ApiKey"})
+        try:
+            quotas.acquire(client)
+        except QuotaExceededError as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+        # 依赖与接口运行在同一请求上下文中，之后的上游调用（包括流式响应）都能读取到
+        current_client.set(client)
+        return client
+
+    return dependency
+
+
+interactive_client = client_quota(INTERACTIVE)
+batch_client = client_quota(BATCH)
+
+
+@router.get("/clients/stats")
+async def client_usage_stats():
+    """各客户端的请求数、被限流次数、上游调用次数、排队时间和 token 用量"""
+    return get_client_quotas().stats()
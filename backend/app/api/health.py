@@ -1,6 +1,8 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, Request, Response
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Any, Dict, List
+from app.services.zhipuai_service import ZhipuAIService, get_zhipuai_service
 
 router = APIRouter()
 
@@ -9,6 +11,13 @@ class HealthResponse(BaseModel):
     timestamp: str
     message: str
 
+class ReadinessResponse(BaseModel):
+    status: str
+    timestamp: str
+    reasons: List[str] = []
+    upstream: Dict[str, Any]
+    limiter: Dict[str, Any]
+
 @router.get("/health", response_model=HealthResponse)
 async def health_check():
     """健康检查接口"""
@@ -16,4 +25,37 @@ async def health_check():
         status="healthy",
         timestamp=datetime.now().isoformat(),
         message="UnblurAI API is running normally"
-    )
\ No newline at end of file
+    )
+
+@router.get("/ready", response_model=ReadinessResponse, responses={503: {"model": ReadinessResponse}})
+async def readiness_check(
+    request: Request,
+    response: Response,
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
+):
+    """就绪检查接口：进程正在退出、上游熔断（或所有后端被摘除）或限流队列已满时返回 503，负载均衡应暂停向该实例分发请求"""
+    breaker = zhipuai_service.resilience.breaker
+    pool = zhipuai_service.pool
+    reasons = []
+    if getattr(request.app.state, "draining", False):
+        reasons.append("draining")
+    # 全局熔断打开，或默认分组的所有后端均已被摘除
+    if breaker.open_remaining() > 0 or not pool.available():
+        reasons.append("upstream_circuit_open")
+    if pool.saturated():
+        reasons.append("limiter_saturated")
+
+    if reasons:
+        response.status_code = 503
+    return ReadinessResponse(
+        status="not_ready" if reasons else "ready",
+        timestamp=datetime.now().isoformat(),
+        reasons=reasons,
+        upstream={
+            "circuit_state": breaker.state,
+            "circuit_retry_after": round(breaker.open_remaining(), 1),
+            "consecutive_failures": breaker.consecutive_failures,
+            "backends": {backend.name: backend.state for backend in pool.backends},
+        },
+        limiter=pool.limiter_stats()
+    )
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from fastapi.responses import StreamingResponse
+from app.api.clients import batch_client
+from app.models.models import JobResponse
+from app.services.client_quota import ClientContext
+from app.services.job_queue import JobQueue, JobQueueFullError, get_job_queue
+from app.utils.image_validation import ImageValidationError, validate_upload
+import json
+import logging
+import os
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# API 进程内的工作协程数，设为 0 时只接收任务，由独立的 job_worker.py 进程处理
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# 订阅接口的最长轮询间隔（秒），用于感知其他进程中工作协程的更新
+JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", 1.0))
+
+
+@router.post("/jobs", response_model=JobResponse, status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    custom_prompt: Optional[str] = Form(None),
+    priority: int = Form(0),
+    client: ClientContext = Depends(batch_client),
+    job_queue: JobQueue = Depends(get_job_queue)
+):
+    """提交异步识别任务，立即返回任务ID"""
+    try:
+        image = await validate_upload(file)
+    except ImageValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        job = await job_queue.submit(
+            image=image,
+            custom_prompt=custom_prompt,
+            client_id=client.key,
+            priority=max(-10, min(priority, 10))
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    logger.info(f"已提交识别任务 {job.job_id}，优先级: {job.priority}")
+    return job.to_dict()
+
+
+@router.get("/jobs/stats")
+async def job_queue_stats(job_queue: JobQueue = Depends(get_job_queue)):
+    """任务队列统计（需注册在 /jobs/{job_id} 之前）"""
+    return job_queue.stats()
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, job_queue: JobQueue = Depends(get_job_queue)):
+    """查询任务状态和识别结果"""
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/events")
+async def subscribe_job(job_id: str, job_queue: JobQueue = Depends(get_job_queue)):
+    """以 SSE 推送任务状态变化，任务完成后结束"""
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    async def generate_stream():
+        last_state = None
+        while True:
+            job = await job_queue.get(job_id)
+            if job is None:
+                yield f"data: {json.dumps({'type': 'error', 'message': '任务不存在或已过期'}, ensure_ascii=False)}\n\n"
+                return
+
+            state = (job.status, job.position, job.attempts)
+            if state != last_state:
+                last_state = state
+                yield f"data: {json.dumps({'type': 'status', **job.to_dict()}, ensure_ascii=False)}\n\n"
+            if job.finished:
+                yield f"data: {json.dumps({'type': 'end'}, ensure_ascii=False)}\n\n"
+                return
+
+            await job_queue.wait_for_update(job_id, timeout=JOB_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(
+        generate_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "*"
+        }
+    )
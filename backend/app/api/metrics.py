@@ -0,0 +1,57 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.api.refine import refine_sessions
+from app.services.client_quota import get_client_quotas
+from app.services.job_queue import get_job_queue
+from app.services.zhipuai_service import get_zhipuai_service
+from app.utils.logging_setup import get_logging_state
+from app.utils.metrics import registry
+from app.utils.traffic_recorder import get_traffic_recorder
+
+router = APIRouter()
+
+# 将各组件的运行统计导出为 gauge（导出时才获取共享服务，不在导入时创建）
+registry.register_stats(
+    "unblurai_cache", "Recognition cache",
+    lambda: get_zhipuai_service().cache.stats() if get_zhipuai_service().cache else None,
+)
+registry.register_stats(
+    "unblurai_near_duplicate", "Near-duplicate image index",
+    lambda: get_zhipuai_service().near_duplicates.stats() if get_zhipuai_service().near_duplicates else None,
+)
+registry.register_stats("unblurai_dedup", "In-flight request coalescing", lambda: get_zhipuai_service().inflight.stats())
+registry.register_stats("unblurai_preprocess", "Image preprocessing", lambda: get_zhipuai_service().preprocess_stats.stats())
+registry.register_stats("unblurai_limiter", "GLM upstream limiters (sum over backends)", lambda: get_zhipuai_service().pool.limiter_stats())
+registry.register_stats("unblurai_upstream", "GLM upstream backend pool", lambda: get_zhipuai_service().pool.summary())
+registry.register_stats(
+    "unblurai_thinking", "Thinking-mode selection and upstream latency by mode",
+    lambda: get_zhipuai_service().thinking_stats.stats(),
+)
+registry.register_stats(
+    "unblurai_logging", "Log queue (dropped when full, sampled out by LOG_SAMPLE_RATE)",
+    lambda: get_logging_state().stats() if get_logging_state() else None,
+)
+registry.register_stats(
+    "unblurai_clients", "Per-client quotas (usage by client in unblurai_client_*_total)",
+    lambda: get_client_quotas().summary(),
+)
+registry.register_stats(
+    "unblurai_prompts", "Prompt templates, token estimation and output caps",
+    lambda: get_zhipuai_service().prompts.stats(),
+)
+registry.register_stats(
+    "unblurai_traffic_recorder", "Request shape recording (TRAFFIC_RECORD_FILE)",
+    lambda: get_traffic_recorder().stats() if get_traffic_recorder() else None,
+)
+registry.register_stats("unblurai_jobs", "Asynchronous job queue", lambda: get_job_queue().stats())
+registry.register_stats("unblurai_refine", "Refine sessions", refine_sessions.stats)
+registry.register_stats(
+    "unblurai_resilience", "GLM retries, hedging and circuit breaker",
+    lambda: get_zhipuai_service().resilience.stats(),
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
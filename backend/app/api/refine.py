@@ -0,0 +1,154 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app.api.clients import interactive_client
+from app.models.models import (
+    RefineSessionCreateRequest,
+    RefineSessionResponse,
+    RefineStepRequest,
+    RefineStepResponse,
+)
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.services.refine_session import (
+    create_refine_session_store,
+    diff_lines,
+    resolve_line_range,
+    split_lines,
+)
+from app.services.structured_output import lines_to_text, select_region
+from app.services.zhipuai_service import ZhipuAIService, get_zhipuai_service
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# 局部微调时附带的上下文行数，以及发送给模型的历史指令条数
+REFINE_CONTEXT_LINES = int(os.getenv("REFINE_CONTEXT_LINES", 3))
+REFINE_HISTORY_LIMIT = int(os.getenv("REFINE_HISTORY_LIMIT", 5))
+
+refine_sessions = create_refine_session_store()
+
+
+async def get_session_or_404(session_id: str):
+    session = await refine_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="微调会话不存在或已过期")
+    return session
+
+
+@router.post("/refine/sessions", response_model=RefineSessionResponse, dependencies=[Depends(interactive_client)])
+async def create_refine_session(
+    request: RefineSessionCreateRequest,
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
+):
+    """创建微调会话，识别结果保存在服务端，后续只需发送微调指令
+
+    传入 result_id 时直接使用已缓存的结构化识别结果（region 指定时只取该区域内的行），无需重新识别图片。
+    """
+    if request.result_id is not None:
+        lines = await zhipuai_service.get_result(request.result_id)
+        if lines is None:
+            raise HTTPException(status_code=404, detail="识别结果不存在或已过期")
+        if request.region is not None:
+            lines = select_region(lines, request.region)
+        if not lines:
+            raise HTTPException(status_code=400, detail="所选区域内没有识别到文字")
+        text = lines_to_text(lines)
+    elif request.text is not None:
+        text = request.text
+    else:
+        raise HTTPException(status_code=400, detail="需要提供 text 或 result_id")
+    session = await refine_sessions.create(text)
+    return RefineSessionResponse(
+        session_id=session.session_id,
+        version=session.version,
+        line_count=len(session.lines)
+    )
+
+
+@router.get("/refine/sessions/{session_id}", response_model=RefineSessionResponse)
+async def get_refine_session(session_id: str):
+    """获取会话当前的完整文本和历史指令"""
+    session = await get_session_or_404(session_id)
+    return RefineSessionResponse(
+        session_id=session.session_id,
+        version=session.version,
+        line_count=len(session.lines),
+        text=session.text,
+        instructions=session.instructions
+    )
+
+
+@router.delete("/refine/sessions/{session_id}")
+async def delete_refine_session(session_id: str):
+    """结束微调会话"""
+    if not await refine_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="微调会话不存在或已过期")
+    return {"success": True}
+
+
+@router.post("/refine/sessions/{session_id}", response_model=RefineStepResponse, dependencies=[Depends(interactive_client)])
+async def refine_in_session(
+    session_id: str,
+    request: RefineStepRequest,
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
+):
+    """按指令微调全文或指定行范围，只返回变更部分的行级差异"""
+    start_time = time.time()
+
+    # 同一会话的微调按顺序执行，保证差异基于最新版本（其他工作进程的并发修改在保存时检测）
+    async with refine_sessions.lock(session_id):
+        session = await get_session_or_404(session_id)
+        if request.base_version is not None and request.base_version != session.version:
+            raise HTTPException(status_code=409, detail=f"会话版本已更新为 {session.version}，请先同步最新文本")
+        try:
+            start, end = resolve_line_range(len(session.lines), request.start_line, request.end_line)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        region = session.lines[start:end]
+        try:
+            result = await zhipuai_service.refine_region(
+                text="\n".join(region),
+                instruction=request.instruction,
+                previous_instructions=session.instructions[-REFINE_HISTORY_LIMIT:] if REFINE_HISTORY_LIMIT else [],
+                context_before=session.lines[max(start - REFINE_CONTEXT_LINES, 0):start],
+                context_after=session.lines[end:end + REFINE_CONTEXT_LINES],
+                thinking=request.thinking
+            )
+        except UpstreamOverloadedError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+        except Exception as e:
+            logger.error(f"Session refinement failed: {e}")
+            return RefineStepResponse(
+                success=False,
+                message=f"微调失败: {str(e)}",
+                session_id=session.session_id,
+                version=session.version,
+                line_count=len(session.lines),
+                processing_time=round(time.time() - start_time, 2)
+            )
+
+        refined = split_lines(result.text)
+        diff = diff_lines(region, refined, offset=start)
+        if not await refine_sessions.update(session, session.lines[:start] + refined + session.lines[end:], request.instruction):
+            raise HTTPException(status_code=409, detail="会话已被其他请求更新或已结束，请先同步最新文本")
+
+    return RefineStepResponse(
+        success=True,
+        message="文字微调成功",
+        session_id=session.session_id,
+        version=session.version,
+        line_count=len(session.lines),
+        diff=diff,
+        processing_time=round(time.time() - start_time, 2),
+        cached=result.cached,
+        usage=result.usage
+    )
+
+
+@router.get("/refine/stats")
+async def refine_session_stats():
+    """微调会话统计"""
+    return refine_sessions.stats()
@@ -1,59 +1,38 @@
-from fastapi import APIRouter, Form, HTTPException
-from zhipuai import ZhipuAI
-import os
-from typing import Optional
+from fastapi import APIRouter, Depends, Form, HTTPException
+from app.api.clients import interactive_client
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.services.zhipuai_service import ZhipuAIService, get_zhipuai_service
+from app.utils.traffic_recorder import record_request_shape, record_request_text
+from typing import Literal, Optional
 
 router = APIRouter()
 
-# 初始化ZhipuAI客户端
-client = ZhipuAI(api_key=os.getenv("ZHIPUAI_API_KEY"))
-
-@router.post("/tune")
+@router.post("/tune", dependencies=[Depends(interactive_client)])
 async def tune_text(
     text: str = Form(..., description="需要微调的文字内容"),
-    instruction: str = Form(..., description="微调指令")
+    instruction: str = Form(..., description="微调指令"),
+    thinking: Optional[Literal["enabled", "disabled"]] = Form(None, description="思考模式，不指定时按 REFINE_THINKING_MODE"),
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
 ):
     """
     文字微调接口
     根据用户指令对识别出的文字进行优化调整
     """
+    record_request_text(text, instruction)
+    record_request_shape(thinking=thinking)
     try:
-        # 检查API密钥
-        if not os.getenv("ZHIPUAI_API_KEY"):
-            raise HTTPException(status_code=500, detail="ZHIPUAI_API_KEY未配置")
-        
-        # 构建微调提示词
-        prompt = f"""请根据以下指令对文字内容进行优化调整：
-
-指令：{instruction}
-
-原始文字内容：
-{text}
-
-请直接输出优化后的文字内容，不要添加任何解释或说明。"""
-        
-        # 调用GLM-4.5V进行文字微调
-        response = client.chat.completions.create(
-            model="glm-4.5v",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        # 提取微调后的文字
-        tuned_text = response.choices[0].message.content.strip()
+        # 调用GLM-4.5V进行文字微调（长文本分段并发处理，输出上限按输入长度设置）
+        result = await zhipuai_service.tune_text(text, instruction, thinking)
         
         return {
             "success": True,
-            "tuned_text": tuned_text,
-            "original_instruction": instruction
+            "tuned_text": result.text.strip(),
+            "original_instruction": instruction,
+            "usage": result.usage
         }
         
+    except UpstreamOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         print(f"文字微调失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"文字微调失败: {str(e)}")
\ No newline at end of file
@@ -1,62 +1,88 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
-from app.models.models import UploadResponse, RefineRequest, RefineResponse
-from app.services.zhipuai_service import ZhipuAIService
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from app.api.clients import interactive_client
+from app.models.models import UploadResponse, RefineRequest, RefineResponse, ResultResponse
+from app.services.image_difficulty import normalize_thinking_mode
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.services.structured_output import lines_to_text, parse_region, select_region
+from app.services.zhipuai_service import ZhipuAIService, get_zhipuai_service
+from app.utils.image_validation import MAX_IMAGE_SIZE, ImageValidationError, check_content_type, validate_upload
+from app.utils.metrics import stage_timer
+from app.utils.traffic_recorder import record_request_shape, record_request_text
 import time
 import logging
 import json
-import asyncio
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# 初始化ZhipuAI服务
-zhipuai_service = ZhipuAIService()
-
-@router.post("/upload", response_model=UploadResponse)
+@router.post("/upload", response_model=UploadResponse, dependencies=[Depends(interactive_client)])
 async def upload_and_recognize(
     file: UploadFile = File(...),
-    custom_prompt: Optional[str] = Form(None)
+    custom_prompt: Optional[str] = Form(None),
+    tiled: Optional[bool] = Form(None),
+    thinking: Optional[str] = Form(None, description="思考模式：auto / enabled / disabled"),
+    structured: bool = Form(False, description="逐行返回文字、位置和置信度"),
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
 ):
-    """上传图片并识别文字"""
+    """上传图片并识别文字（大图自动分块识别，tiled 可显式开启或关闭；结构化输出不分块）"""
     start_time = time.time()
     
     try:
-        # 验证文件类型
-        if not file.content_type or not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="只支持图片文件")
-        
-        # 验证文件格式
-        allowed_formats = ['image/jpeg', 'image/jpg', 'image/png']
-        if file.content_type not in allowed_formats:
-            raise HTTPException(status_code=400, detail="只支持 JPG、JPEG、PNG 格式的图片")
-        
-        # 读取文件内容
-        file_content = await file.read()
+        try:
+            thinking = normalize_thinking_mode(thinking)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        record_request_shape(prompt=len(custom_prompt) if custom_prompt else None, thinking=thinking, structured=structured, tiled=tiled)
+        # 分块结果的行坐标无法可靠合并，结构化输出只支持整图识别
+        if structured:
+            tiled = False
         
-        # 验证文件大小 (5MB)
-        if len(file_content) > 5 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="文件大小不能超过 5MB")
+        # 验证文件类型、格式和大小（分块读取，超限立即拒绝）；分块模式允许更大的图片
+        tiling = zhipuai_service.tiling_config
+        max_size = tiling.max_image_size if tiling.enabled and tiled is not False else MAX_IMAGE_SIZE
+        try:
+            image = await validate_upload(file, max_size)
+        except ImageValidationError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
         # 调用ZhipuAI服务识别文字
-        recognized_text = await zhipuai_service.recognize_text(
-            image_bytes=file_content,
-            custom_prompt=custom_prompt
-        )
+        if zhipuai_service.should_tile(image, tiled):
+            result = await zhipuai_service.recognize_tiled(
+                image=image,
+                custom_prompt=custom_prompt,
+                thinking=thinking
+            )
+        else:
+            result = await zhipuai_service.recognize(
+                image=image,
+                custom_prompt=custom_prompt,
+                thinking=thinking,
+                structured=structured
+            )
         
         processing_time = time.time() - start_time
         
-        return UploadResponse(
-            success=True,
-            message="文字识别成功",
-            recognized_text=recognized_text,
-            processing_time=round(processing_time, 2)
-        )
+        # 直接序列化响应模型，以便单独统计序列化耗时
+        with stage_timer("serialize"):
+            body = UploadResponse(
+                success=True,
+                message="文字识别成功",
+                recognized_text=result.text,
+                processing_time=round(processing_time, 2),
+                cached=result.cached,
+                lines=[line.to_dict() for line in result.lines] if result.lines is not None else None,
+                result_id=result.result_id,
+                usage=result.usage
+            ).model_dump_json()
+        return Response(content=body, media_type="application/json")
         
     except HTTPException:
         raise
+    except UpstreamOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         logger.error(f"Upload and recognition failed: {e}")
         processing_time = time.time() - start_time
@@ -66,12 +92,20 @@ async def upload_and_recognize(
             processing_time=round(processing_time, 2)
         )
 
-@router.post("/upload-stream")
+@router.post("/upload-stream", dependencies=[Depends(interactive_client)])
 async def upload_and_recognize_stream(
     file: UploadFile = File(...),
-    custom_prompt: Optional[str] = Form(None)
+    custom_prompt: Optional[str] = Form(None),
+    thinking: Optional[str] = Form(None, description="思考模式：auto / enabled / disabled"),
+    structured: bool = Form(False, description="逐行返回文字、位置和置信度"),
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
 ):
-    """上传图片并流式识别文字"""
+    """上传图片并流式识别文字（structured 时以 line 事件逐行推送）"""
+    try:
+        thinking = normalize_thinking_mode(thinking)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    record_request_shape(prompt=len(custom_prompt) if custom_prompt else None, thinking=thinking, structured=structured)
     
     async def generate_stream():
         start_time = time.time()
@@ -79,57 +113,54 @@ async def upload_and_recognize_stream(
         try:
             # 发送开始事件
             yield f"data: {json.dumps({'type': 'start', 'message': '开始处理图片...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.1)
             
-            # 验证文件类型
-            if not file.content_type or not file.content_type.startswith('image/'):
-                yield f"data: {json.dumps({'type': 'error', 'message': '只支持图片文件'}, ensure_ascii=False)}\n\n"
+            # 验证文件类型和格式
+            try:
+                check_content_type(file.content_type)
+            except ImageValidationError as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
                 return
             
-            # 验证文件格式
-            allowed_formats = ['image/jpeg', 'image/jpg', 'image/png']
-            if file.content_type not in allowed_formats:
-                yield f"data: {json.dumps({'type': 'error', 'message': '只支持 JPG、JPEG、PNG 格式的图片'}, ensure_ascii=False)}\n\n"
-                return
-            
-            yield f"data: {json.dumps({'type': 'progress', 'message': '正在读取图片文件...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.2)
-            
-            # 读取文件内容
-            file_content = await file.read()
-            
-            # 验证文件大小 (5MB)
-            if len(file_content) > 5 * 1024 * 1024:
-                yield f"data: {json.dumps({'type': 'error', 'message': '文件大小不能超过 5MB'}, ensure_ascii=False)}\n\n"
+            # 分块读取并验证文件大小和图片内容
+            try:
+                image = await validate_upload(file)
+            except ImageValidationError as e:
+                yield f"data: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
                 return
             
             yield f"data: {json.dumps({'type': 'progress', 'message': '正在调用GLM-4.5V模型识别...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.3)
-            
-            yield f"data: {json.dumps({'type': 'progress', 'message': '模型正在分析图片内容...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.5)
             
-            yield f"data: {json.dumps({'type': 'progress', 'message': '正在识别文字内容...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.3)
-            
-            # 调用ZhipuAI服务识别文字
-            recognized_text = await zhipuai_service.recognize_text(
-                image_bytes=file_content,
-                custom_prompt=custom_prompt
-            )
-            
-            yield f"data: {json.dumps({'type': 'progress', 'message': '文字识别完成，正在处理结果...'}, ensure_ascii=False)}\n\n"
-            await asyncio.sleep(0.2)
+            # 转发模型的流式输出：reasoning 为思考过程，delta 为已清理的识别文字
+            async for event in zhipuai_service.recognize_stream(
+                image=image,
+                custom_prompt=custom_prompt,
+                thinking=thinking,
+                structured=structured
+            ):
+                if event['type'] == 'reasoning':
+                    yield f"data: {json.dumps({'type': 'reasoning', 'content': event['delta']}, ensure_ascii=False)}\n\n"
+                elif event['type'] == 'content':
+                    yield f"data: {json.dumps({'type': 'delta', 'content': event['delta']}, ensure_ascii=False)}\n\n"
+                elif event['type'] == 'line':
+                    yield f"data: {json.dumps({'type': 'line', **event['line'].to_dict()}, ensure_ascii=False)}\n\n"
+                else:
+                    result = event
             
             processing_time = time.time() - start_time
             
             # 发送成功结果
-            yield f"data: {json.dumps({
+            success = {
                 'type': 'success',
                 'message': '文字识别成功',
-                'recognized_text': recognized_text,
-                'processing_time': round(processing_time, 2)
-            }, ensure_ascii=False)}\n\n"
+                'recognized_text': result['text'],
+                'processing_time': round(processing_time, 2),
+                'cached': result['cached'],
+                'usage': result['usage']
+            }
+            if structured:
+                success['lines'] = [line.to_dict() for line in result['lines']]
+                success['result_id'] = result['result_id']
+            yield f"data: {json.dumps(success, ensure_ascii=False)}\n\n"
             
         except Exception as e:
             logger.error(f"Stream upload and recognition failed: {e}")
@@ -151,16 +182,83 @@ async def upload_and_recognize_stream(
         }
     )
 
-@router.post("/refine", response_model=RefineResponse)
-async def refine_text(request: RefineRequest):
+@router.get("/results/{result_id}", response_model=ResultResponse)
+async def get_structured_result(
+    result_id: str,
+    region: Optional[str] = Query(None, description="只返回中心点在该区域内的行：x1,y1,x2,y2（0-1000 归一化坐标）"),
+    zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)
+):
+    """查询已缓存的结构化识别结果，无需重新调用模型"""
+    lines = await zhipuai_service.get_result(result_id)
+    if lines is None:
+        raise HTTPException(status_code=404, detail="识别结果不存在或已过期")
+    if region is not None:
+        try:
+            lines = select_region(lines, parse_region(region))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return ResultResponse(result_id=result_id, text=lines_to_text(lines), lines=[line.to_dict() for line in lines])
+
+@router.get("/cache/stats")
+async def recognition_cache_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """识别结果缓存统计（命中/未命中/淘汰）"""
+    if zhipuai_service.cache is None:
+        return {"enabled": False}
+    near_duplicates = zhipuai_service.near_duplicates
+    return {
+        "enabled": True,
+        **zhipuai_service.cache.stats(),
+        "near_duplicates": near_duplicates.stats() if near_duplicates is not None else {"enabled": False}
+    }
+
+@router.get("/dedup/stats")
+async def recognition_dedup_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """并发识别请求合并统计（节省的上游调用次数）"""
+    return zhipuai_service.inflight.stats()
+
+@router.get("/preprocess/stats")
+async def image_preprocess_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """图片预处理统计（节省字节数与耗时）"""
+    return zhipuai_service.preprocess_stats.stats()
+
+@router.get("/limiter/stats")
+async def upstream_limiter_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """GLM调用限流器状态（并发上限、排队数、拒绝数），多个后端时为各后端之和"""
+    return zhipuai_service.pool.limiter_stats()
+
+@router.get("/upstream/stats")
+async def upstream_pool_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """GLM后端池状态（各后端的健康状态、未完成请求数、平均耗时和限流器）"""
+    return zhipuai_service.pool.stats()
+
+@router.get("/thinking/stats")
+async def thinking_mode_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """思考模式选择统计（按难度关闭 / 保留的次数，以及两种模式的上游耗时）"""
+    return zhipuai_service.thinking_stats.stats()
+
+@router.get("/prompts/stats")
+async def prompt_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """提示词版本、token 估计校准、输出上限截断和长文本分段统计"""
+    return zhipuai_service.prompts.stats()
+
+@router.get("/resilience/stats")
+async def upstream_resilience_stats(zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
+    """GLM调用重试、对冲和熔断状态"""
+    return zhipuai_service.resilience.stats()
+
+@router.post("/refine", response_model=RefineResponse, dependencies=[Depends(interactive_client)])
+async def refine_text(request: RefineRequest, zhipuai_service: ZhipuAIService = Depends(get_zhipuai_service)):
     """使用自然语言指令微调识别结果"""
     start_time = time.time()
+    record_request_text(request.original_text, request.refinement_instruction)
+    record_request_shape(thinking=request.thinking)
     
     try:
         # 调用ZhipuAI服务进行文字微调
-        refined_text = await zhipuai_service.refine_text(
+        result = await zhipuai_service.refine_text(
             original_text=request.original_text,
-            refinement_instruction=request.refinement_instruction
+            refinement_instruction=request.refinement_instruction,
+            thinking=request.thinking
         )
         
         processing_time = time.time() - start_time
@@ -168,10 +266,14 @@ async def refine_text(request: RefineRequest):
         return RefineResponse(
             success=True,
             message="文字微调成功",
-            refined_text=refined_text,
-            processing_time=round(processing_time, 2)
+            refined_text=result.text,
+            processing_time=round(processing_time, 2),
+            cached=result.cached,
+            usage=result.usage
         )
         
+    except UpstreamOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
     except Exception as e:
         logger.error(f"Text refinement failed: {e}")
         processing_time = time.time() - start_time
@@ -1,5 +1,24 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+class RecognizedLine(BaseModel):
+    """结构化识别结果中的一行：box 为 0-1000 归一化的 [x1, y1, x2, y2]，confidence 为模型给出的 0-1 估计"""
+    text: str
+    box: Optional[List[int]] = None
+    confidence: Optional[float] = None
+
+class TokenUsage(BaseModel):
+    """一次接口调用的上游 token 用量（分块识别、分段微调时为各次上游调用之和）"""
+    upstream_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    # 发送前估计的输入 token 数（仅文字微调）
+    estimated_prompt_tokens: int = 0
+    # 各次上游调用设置的输出上限之和
+    max_tokens: int = 0
+    chunks: int = 0
+    truncated: int = 0
 
 class UploadResponse(BaseModel):
     """图片上传和识别响应模型"""
@@ -7,15 +26,86 @@ class UploadResponse(BaseModel):
     message: str
     recognized_text: Optional[str] = None
     processing_time: Optional[float] = None
+    cached: bool = False
+    # 结构化输出模式下的逐行结果，result_id 可用于查询结果或创建微调会话
+    lines: Optional[List[RecognizedLine]] = None
+    result_id: Optional[str] = None
+    usage: Optional[TokenUsage] = None
+
+class ResultResponse(BaseModel):
+    """已缓存的结构化识别结果（可按区域筛选）"""
+    result_id: str
+    text: str
+    lines: List[RecognizedLine]
 
 class RefineRequest(BaseModel):
     """文字微调请求模型"""
     original_text: str
     refinement_instruction: str
+    # 是否开启思考模式，不指定时按 REFINE_THINKING_MODE
+    thinking: Optional[Literal["enabled", "disabled"]] = None
 
 class RefineResponse(BaseModel):
     """文字微调响应模型"""
     success: bool
     message: str
     refined_text: Optional[str] = None
-    processing_time: Optional[float] = None
\ No newline at end of file
+    processing_time: Optional[float] = None
+    cached: bool = False
+    usage: Optional[TokenUsage] = None
+
+class JobResponse(BaseModel):
+    """异步识别任务状态响应模型"""
+    job_id: str
+    status: str
+    priority: int = 0
+    attempts: int = 0
+    position: Optional[int] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    recognized_text: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+
+class RefineSessionCreateRequest(BaseModel):
+    """创建微调会话请求模型：传入文本，或传入结构化识别结果的 result_id（可用 region 只取其中一个区域）"""
+    text: Optional[str] = Field(None, min_length=1)
+    result_id: Optional[str] = None
+    # 0-1000 归一化坐标 [x1, y1, x2, y2]
+    region: Optional[List[int]] = Field(None, min_length=4, max_length=4)
+
+class RefineSessionResponse(BaseModel):
+    """微调会话状态响应模型"""
+    session_id: str
+    version: int
+    line_count: int
+    text: Optional[str] = None
+    instructions: List[str] = []
+
+class RefineStepRequest(BaseModel):
+    """会话内微调请求模型（行号从 1 开始，闭区间，不指定时微调全文）"""
+    instruction: str = Field(..., min_length=1)
+    start_line: Optional[int] = None
+    end_line: Optional[int] = None
+    # 客户端持有的版本号，与服务端不一致时返回 409
+    base_version: Optional[int] = None
+    thinking: Optional[Literal["enabled", "disabled"]] = None
+
+class DiffHunk(BaseModel):
+    """行级变更块：用 lines 替换变更前文本的 [start, end) 行（0 起始）"""
+    start: int
+    end: int
+    lines: List[str]
+
+class RefineStepResponse(BaseModel):
+    """会话内微调响应模型"""
+    success: bool
+    message: str
+    session_id: str
+    version: int
+    line_count: int
+    diff: List[DiffHunk] = []
+    processing_time: Optional[float] = None
+    cached: bool = False
+    usage: Optional[TokenUsage] = None
@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, Optional, Set
+
+from app.utils.metrics import CLIENT_QUEUE_WAIT, CLIENT_REQUESTS, CLIENT_TOKENS, CLIENT_UPSTREAM_CALLS
+
+logger = logging.getLogger(__name__)
+
+# 流量类型：交互请求（单张识别、微调）优先获得上游名额，批量请求（批量识别、异步任务）使用剩余容量
+INTERACTIVE = "interactive"
+BATCH = "batch"
+TRAFFIC_CLASSES = (INTERACTIVE, BATCH)
+
+
+class ClientAuthError(Exception):
+    """API Key 无效或缺失（应返回 401）"""
+
+
+class QuotaExceededError(Exception):
+    """客户端超出请求配额（应返回 429）"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class ClientPolicy:
+    """CLIENT_API_KEYS 中单个 API Key 对应的客户端配置"""
+    name: str
+    qps: float
+    burst: int
+    weight: float = 1.0
+    # 为 batch 时该客户端的所有请求都按批量流量调度，否则按接口决定
+    traffic_class: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ClientContext:
+    """当前请求所属的客户端，经 current_client 传递给 GLM 限流器的公平等待队列"""
+    # 配额和公平队列使用的内部标识（key:名称 或 id:来源地址），避免未认证客户端冒用已配置的名称
+    key: str
+    # 日志中显示的名称（API Key 客户端附带 X-Client-ID 子标签时为 名称/子标签）
+    name: str
+    # 指标标签（未配置 API Key 的客户端超过标签上限后为 other）
+    label: str
+    traffic_class: str
+    # 公平队列中该流的权重（批量流量已乘以 CLIENT_BATCH_WEIGHT）
+    weight: float
+    qps: float
+    burst: int
+
+    @property
+    def batch(self) -> bool:
+        return self.traffic_class == BATCH
+
+    @property
+    def flow(self) -> str:
+        return f"{self.key}:{self.traffic_class}"
+
+
+current_client: ContextVar[Optional[ClientContext]] = ContextVar("current_client", default=None)
+
+
+@dataclass
+class ClientUsage:
+    """单个客户端的令牌桶和用量"""
+    client: str
+    label: str
+    tokens: float
+    last_refill: float
+    requests: int = 0
+    throttled: int = 0
+    upstream_calls: int = 0
+    queue_wait: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        usage = asdict(self)
+        del usage["tokens"], usage["last_refill"]
+        usage["queue_wait"] = round(self.queue_wait, 3)
+        return usage
+
+
+class ClientQuotas:
+    """按客户端的请求配额和用量统计
+
+    - 客户端标识：X-API-Key（CLIENT_API_KEYS 中配置的客户端）> 来源地址（经 FORWARDED_ALLOW_IPS 中的代理时取 X-Forwarded-For）
+    - X-Client-ID 由客户端自行填写，不能作为配额依据，只在携带有效 API Key 时作为日志中的子标签
+    - 每个客户端一个令牌桶（请求数/秒 + 突发），超出时返回 429 和 Retry-After
+    - 配额按工作进程分别计算；跟踪的客户端数量有上限，最久未出现的客户端被淘汰（其令牌桶重置）
+    """
+
+    def __init__(
+        self,
+        api_keys: Optional[Dict[str, ClientPolicy]] = None,
+        default_qps: float = 0.0,
+        default_burst: int = 20,
+        default_weight: float = 1.0,
+        batch_weight: float = 0.25,
+        require_api_key: bool = False,
+        max_tracked: int = 1000,
+        max_labels: int = 50,
+    ):
+        self.api_keys = api_keys or {}
+        self.default_qps = default_qps
+        self.default_burst = default_burst
+        self.default_weight = default_weight
+        self.batch_weight = batch_weight
+        self.require_api_key = require_api_key
+        self.max_tracked = max_tracked
+        self.max_labels = max_labels
+        self._policies = {policy.name: policy for policy in self.api_keys.values()}
+        self._usage: "OrderedDict[str, ClientUsage]" = OrderedDict()
+        self._labels: Set[str] = set()
+        self.rejected_keys = 0
+        self.evicted = 0
+
+    def identify(
+        self,
+        api_key: Optional[str],
+        client_id: Optional[str],
+        address: Optional[str],
+        traffic_class: str = INTERACTIVE,
+    ) -> ClientContext:
+        """根据请求头识别客户端；API Key 无效，或要求 API Key 但未提供时抛出 ClientAuthError
+
+        未认证的请求按来源地址区分，忽略 X-Client-ID，否则每次更换该请求头即可绕过配额和公平调度。
+        """
+        if api_key:
+            policy = self.api_keys.get(api_key)
+            if policy is None:
+                self.rejected_keys += 1
+                raise ClientAuthError("API Key 无效")
+            context = self._context(f"key:{policy.name}", policy, traffic_class)
+            if client_id:
+                # 子标签只用于日志，配额、公平调度和指标仍按 API Key 计算
+                context = replace(context, name=f"{policy.name}/{client_id[:64]}")
+            return context
+        if self.require_api_key:
+            self.rejected_keys += 1
+            raise ClientAuthError("缺少 API Key（X-API-Key 请求头）")
+        return self._context(f"id:{(address or 'anonymous')[:64]}", None, traffic_class)
+
+    def job_client(self, key: str) -> ClientContext:
+        """异步任务所属的客户端（提交时记录的内部标识），任务始终按批量流量调度"""
+        kind, _, name = key.partition(":")
+        if kind not in ("key", "id"):
+            key = f"id:{key}"
+        policy = self._policies.get(name) if kind == "key" else None
+        return self._context(key, policy, BATCH)
+
+    def acquire(self, client: ClientContext) -> None:
+        """按客户端令牌桶放行一个请求，超出配额时抛出 QuotaExceededError"""
+        usage = self._usage_for(client)
+        if client.qps > 0:
+            now = time.monotonic()
+            usage.tokens = min(client.burst, usage.tokens + (now - usage.last_refill) * client.qps)
+            usage.last_refill = now
+            if usage.tokens < 1:
+                usage.throttled += 1
+                CLIENT_REQUESTS.inc(client=client.label, outcome="throttled", **{"class": client.traffic_class})
+                retry_after = (1 - usage.tokens) / client.qps
+                logger.warning(f"客户端 {client.name} 超出请求配额（{client.qps}/s），拒绝请求")
+                raise QuotaExceededError(f"请求过于频繁（上限 {client.qps:g} 次/秒），请稍后重试", retry_after=retry_after)
+            usage.tokens -= 1
+        usage.requests += 1
+        CLIENT_REQUESTS.inc(client=client.label, outcome="admitted", **{"class": client.traffic_class})
+
+    def record_upstream(self, client: ClientContext, wait: float) -> None:
+        """记录一次代表该客户端发起的上游调用及其排队时间"""
+        usage = self._usage_for(client)
+        usage.upstream_calls += 1
+        usage.queue_wait += wait
+        CLIENT_UPSTREAM_CALLS.inc(client=client.label, **{"class": client.traffic_class})
+        CLIENT_QUEUE_WAIT.observe(wait, **{"class": client.traffic_class})
+
+    def record_tokens(self, client: ClientContext, usage: Dict[str, Any]) -> None:
+        record = self._usage_for(client)
+        for kind in ("prompt_tokens", "completion_tokens"):
+            value = usage.get(kind)
+            if value:
+                setattr(record, kind, getattr(record, kind) + value)
+                CLIENT_TOKENS.inc(value, client=client.label, kind=kind.replace("_tokens", ""))
+
+    def summary(self) -> Dict[str, Any]:
+        """用于导出指标的汇总统计（各客户端的用量见 unblurai_client_* 指标）"""
+        records = self._usage.values()
+        return {
+            "tracked": len(self._usage),
+            "configured": len(self.api_keys),
+            "requests": sum(record.requests for record in records),
+            "throttled": sum(record.throttled for record in records),
+            "upstream_calls": sum(record.upstream_calls for record in records),
+            "rejected_keys": self.rejected_keys,
+            "evicted": self.evicted,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.summary(),
+            "default_qps": self.default_qps,
+            "batch_weight": self.batch_weight,
+            "items": sorted((record.to_dict() for record in self._usage.values()), key=lambda item: -item["requests"]),
+        }
+
+    def _context(self, key: str, policy: Optional[ClientPolicy], traffic_class: str) -> ClientContext:
+        # 配置为 batch 的客户端所有请求都按批量流量调度；交互流量只能由客户端自行降级，不能升级
+        if policy is not None and policy.traffic_class == BATCH:
+            traffic_class = BATCH
+        weight = policy.weight if policy is not None else self.default_weight
+        if traffic_class == BATCH:
+            weight *= self.batch_weight
+        name = key.partition(":")[2]
+        return ClientContext(
+            key=key,
+            name=name,
+            label=self._label(name, policy is not None),
+            traffic_class=traffic_class,
+            weight=weight,
+            qps=policy.qps if policy is not None else self.default_qps,
+            burst=policy.burst if policy is not None else self.default_burst,
+        )
+
+    def _label(self, name: str, configured: bool) -> str:
+        if configured or name in self._labels:
+            return name
+        if len(self._labels) < self.max_labels:
+            self._labels.add(name)
+            return name
+        return "other"
+
+    def _usage_for(self, client: ClientContext) -> ClientUsage:
+        usage = self._usage.get(client.key)
+        if usage is None:
+            usage = ClientUsage(client.key, client.label, tokens=float(client.burst), last_refill=time.monotonic())
+            self._usage[client.key] = usage
+            if len(self._usage) > self.max_tracked:
+                self._usage.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._usage.move_to_end(client.key)
+        return usage
+
+
+def _api_key_policies() -> Dict[str, ClientPolicy]:
+    """读取 CLIENT_API_KEYS（JSON 对象：API Key -> {name, qps, burst, weight, class}）"""
+    raw = os.getenv("CLIENT_API_KEYS", "").strip()
+    if not raw:
+        return {}
+    configs = json.loads(raw)
+    if not isinstance(configs, dict):
+        raise ValueError("CLIENT_API_KEYS must be a JSON object mapping API keys to client settings")
+    policies = {}
+    for index, (api_key, config) in enumerate(configs.items()):
+        traffic_class = config.get("class")
+        if traffic_class is not None and traffic_class not in TRAFFIC_CLASSES:
+            raise ValueError(f"client class must be one of {TRAFFIC_CLASSES}, got {traffic_class!r}")
+        policies[api_key] = ClientPolicy(
+            name=config.get("name", f"client-{index + 1}"),
+            qps=float(config.get("qps", os.getenv("CLIENT_RATE_LIMIT_QPS", 0))),
+            burst=int(config.get("burst", os.getenv("CLIENT_RATE_LIMIT_BURST", 20))),
+            weight=float(config.get("weight", 1)),
+            traffic_class=traffic_class,
+        )
+    return policies
+
+
+def create_client_quotas() -> ClientQuotas:
+    """根据环境变量创建客户端配额"""
+    return ClientQuotas(
+        api_keys=_api_key_policies(),
+        default_qps=float(os.getenv("CLIENT_RATE_LIMIT_QPS", 0)),
+        default_burst=int(os.getenv("CLIENT_RATE_LIMIT_BURST", 20)),
+        default_weight=float(os.getenv("CLIENT_DEFAULT_WEIGHT", 1)),
+        batch_weight=float(os.getenv("CLIENT_BATCH_WEIGHT", 0.25)),
+        require_api_key=os.getenv("CLIENT_REQUIRE_API_KEY", "false").lower() == "true",
+        max_tracked=int(os.getenv("CLIENT_MAX_TRACKED", 1000)),
+        max_labels=int(os.getenv("CLIENT_METRICS_MAX_LABELS", 50)),
+    )
+
+
+_quotas: Optional[ClientQuotas] = None
+
+
+def get_client_quotas() -> ClientQuotas:
+    """获取进程内共享的客户端配额（首次调用时读取配置）"""
+    global _quotas
+    if _quotas is None:
+        _quotas = create_client_quotas()
+    return _quotas
+
+
+def record_client_upstream(wait: float) -> None:
+    """记录当前请求所属客户端的一次上游调用（不在客户端上下文中时忽略）"""
+    client = current_client.get()
+    if client is not None:
+        get_client_quotas().record_upstream(client, wait)
+
+
+def record_client_tokens(usage: Optional[Dict[str, Any]]) -> None:
+    client = current_client.get()
+    if client is not None and usage:
+        get_client_quotas().record_tokens(client, usage)
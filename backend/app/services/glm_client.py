@@ -0,0 +1,206 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://open.bigmodel.cn/api/paas/v4"
+
+
+class GLMAPIError(Exception):
+    """GLM 接口调用失败（携带上游 HTTP 状态码）"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, timeout: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.timeout = timeout
+
+    @property
+    def overloaded(self) -> bool:
+        """上游限流（429/503）或超时，说明需要降低并发"""
+        return self.timeout or self.status_code in (429, 503)
+
+
+class AsyncGLMClient:
+    """基于连接池 httpx.AsyncClient 的 GLM 异步客户端，调用期间不阻塞事件循环"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        timeout: float = 300.0,
+        connect_timeout: float = 10.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+    ):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip('/')
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+        )
+
+    async def create_chat_completion(self, **payload: Any) -> Dict[str, Any]:
+        """调用 chat/completions 接口并返回解析后的 JSON"""
+        try:
+            response = await self._client.post("/chat/completions", json=payload)
+        except httpx.HTTPError as e:
+            raise GLMAPIError(
+                f"GLM request failed: {e!r}",
+                timeout=isinstance(e, httpx.TimeoutException),
+            ) from e
+
+        if response.status_code >= 400:
+            raise GLMAPIError(
+                f"GLM API error {response.status_code}: {response.text[:500]}",
+                status_code=response.status_code,
+            )
+        return response.json()
+
+    async def stream_chat_completion(self, **payload: Any) -> AsyncIterator[Dict[str, Any]]:
+        """以流式模式调用 chat/completions 接口，逐个产出 SSE 数据块"""
+        payload = {**payload, "stream": True}
+        try:
+            async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode('utf-8', errors='replace')
+                    raise GLMAPIError(
+                        f"GLM API error {response.status_code}: {body[:500]}",
+                        status_code=response.status_code,
+                    )
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    yield json.loads(data)
+        except httpx.HTTPError as e:
+            raise GLMAPIError(
+                f"GLM request failed: {e!r}",
+                timeout=isinstance(e, httpx.TimeoutException),
+            ) from e
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class ThreadPoolGLMClient:
+    """同步 SDK 的降级方案：在有界线程池中执行调用，避免阻塞事件循环"""
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: Optional[str] = None,
+        timeout: float = 300.0,
+        connect_timeout: float = 10.0,
+        max_workers: int = 16,
+    ):
+        from zai import ZhipuAiClient
+
+        # 重试由 ResilientCaller 统一处理，关闭 SDK 内置重试
+        self._client = ZhipuAiClient(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            max_retries=0,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="glm")
+
+    async def create_chat_completion(self, **payload: Any) -> Dict[str, Any]:
+        """在线程池中调用 SDK，并将结果转换为与 HTTP 接口一致的字典"""
+        loop = asyncio.get_running_loop()
+        try:
+            response = await loop.run_in_executor(
+                self._executor,
+                partial(self._client.chat.completions.create, **payload),
+            )
+        except Exception as e:
+            raise GLMAPIError(
+                f"GLM request failed: {e}",
+                status_code=getattr(e, "status_code", None),
+                timeout=isinstance(e, TimeoutError) or "timeout" in type(e).__name__.lower(),
+            ) from e
+        return response.model_dump()
+
+    async def stream_chat_completion(self, **payload: Any) -> AsyncIterator[Dict[str, Any]]:
+        """在线程池中迭代 SDK 的流式响应，通过队列转发到事件循环"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        finished = object()
+
+        def produce() -> None:
+            try:
+                stream = self._client.chat.completions.create(stream=True, **payload)
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk.model_dump())
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+        loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is finished:
+                    break
+                if isinstance(item, Exception):
+                    raise GLMAPIError(
+                        f"GLM request failed: {item}",
+                        status_code=getattr(item, "status_code", None),
+                        timeout=isinstance(item, TimeoutError) or "timeout" in type(item).__name__.lower(),
+                    ) from item
+                yield item
+        finally:
+            # 调用方提前结束时通知生产线程停止读取
+            stop.set()
+
+    async def aclose(self) -> None:
+        self._executor.shutdown(wait=False)
+
+
+def create_glm_client(api_key: str, base_url: Optional[str] = None):
+    """根据环境变量 GLM_TRANSPORT 创建 GLM 客户端（httpx 或 threadpool）；未指定 base_url 时读取 ZHIPUAI_BASE_URL"""
+    transport = os.getenv("GLM_TRANSPORT", "httpx").lower()
+    base_url = base_url or os.getenv("ZHIPUAI_BASE_URL") or None
+    timeout = float(os.getenv("GLM_TIMEOUT", 300))
+    connect_timeout = float(os.getenv("GLM_CONNECT_TIMEOUT", 10))
+
+    if transport == "threadpool":
+        max_workers = int(os.getenv("GLM_THREADPOOL_SIZE", 16))
+        logger.info(f"GLM transport: threadpool (max_workers={max_workers})")
+        return ThreadPoolGLMClient(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            connect_timeout=connect_timeout,
+            max_workers=max_workers,
+        )
+
+    max_connections = int(os.getenv("GLM_MAX_CONNECTIONS", 100))
+    logger.info(f"GLM transport: httpx (max_connections={max_connections})")
+    return AsyncGLMClient(
+        api_key=api_key,
+        base_url=base_url,
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        max_connections=max_connections,
+    )
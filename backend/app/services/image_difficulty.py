@@ -0,0 +1,146 @@
+import os
+import time
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from PIL import Image, ImageFilter, ImageStat
+
+from app.utils.stats import latency_summary
+
+logger = logging.getLogger(__name__)
+
+# auto：按图片难度决定；enabled / disabled：强制开启或关闭思考模式
+THINKING_MODES = ("auto", "enabled", "disabled")
+
+LAPLACIAN = ImageFilter.Kernel((3, 3), [0, 1, 0, 1, -4, 1, 0, 1, 0], scale=1, offset=128)
+# 拉普拉斯响应超过该值（0-255，已放大 2 倍）的像素视为文字边缘
+EDGE_THRESHOLD = 32
+
+
+def normalize_thinking_mode(value: Optional[str]) -> Optional[str]:
+    """校验请求中的思考模式参数，未指定时返回 None"""
+    if value is None or value == "":
+        return None
+    value = value.lower()
+    if value not in THINKING_MODES:
+        raise ValueError(f"thinking 只能是 {' / '.join(THINKING_MODES)}")
+    return value
+
+
+@dataclass(frozen=True)
+class ImageDifficulty:
+    """图片识别难度指标"""
+    # 拉普拉斯方差 / 边缘密度：文字边缘的锐利程度，模糊或放大过的图片明显偏低
+    sharpness: float
+    # 文字边缘附近像素的第 5 和第 95 百分位灰度之差（近似文字与背景的灰度差）
+    contrast: int
+    # 边缘像素占比，近似文字密度
+    text_density: float
+    elapsed: float
+
+
+def _percentile(histogram, q: float) -> int:
+    target = sum(histogram) * q
+    count = 0
+    for value, frequency in enumerate(histogram):
+        count += frequency
+        if count >= target:
+            return value
+    return len(histogram) - 1
+
+
+def estimate_difficulty(gray: Image.Image) -> ImageDifficulty:
+    """在缩小的灰度图（ValidatedImage.grayscale()，与预处理共用同一次解码）上计算清晰度、对比度和文字密度
+
+    1080p 截图约需 25ms（不含解码），主要是拉普拉斯卷积。
+    对比度只统计文字边缘附近的像素：稀疏文字（如大片空白的截图）的文字像素不到 1%，
+    按全图百分位计算时两端都会落在背景色上。
+    """
+    start = time.perf_counter()
+    laplacian = gray.filter(LAPLACIAN)
+    # 方差和边缘密度都由拉普拉斯响应的直方图得到，只需遍历一次像素
+    histogram = laplacian.histogram()
+    variance = ImageStat.Stat(histogram).var[0]
+    edge_pixels = sum(count for value, count in enumerate(histogram) if abs(value - 128) * 2 > EDGE_THRESHOLD)
+    density = edge_pixels / max(sum(histogram), 1)
+
+    # 拉普拉斯响应在笔画两侧符号相反，边缘像素同时包含文字和紧邻的背景；没有边缘时对比度为 0
+    contrast = 0
+    if edge_pixels:
+        edges = laplacian.point(lambda p: 255 if abs(p - 128) * 2 > EDGE_THRESHOLD else 0)
+        edge_histogram = gray.histogram(mask=edges)
+        contrast = _percentile(edge_histogram, 0.95) - _percentile(edge_histogram, 0.05)
+    return ImageDifficulty(
+        sharpness=variance / max(density, 0.01),
+        contrast=contrast,
+        text_density=density,
+        elapsed=time.perf_counter() - start,
+    )
+
+
+@dataclass
+class ThinkingConfig:
+    """思考模式选择配置"""
+    mode: str = "auto"
+    # 文字微调没有图片可供评估，只支持 enabled / disabled
+    refine_mode: str = "enabled"
+    min_sharpness: float = 6000.0
+    # 文字边缘处的灰度差：清晰的深色文字约 200 以上，模糊会拉低笔画中心的峰值（约 140）
+    min_contrast: int = 150
+    # 边缘过少（几乎没有文字）和过多（照片、噪点）都视为困难；稀疏文字的清晰截图边缘占比通常不到 1%，
+    # 模糊图片由清晰度和对比度排除，下限不宜过高
+    min_text_density: float = 0.002
+    max_text_density: float = 0.3
+
+    @classmethod
+    def from_env(cls) -> "ThinkingConfig":
+        return cls(
+            mode=normalize_thinking_mode(os.getenv("THINKING_MODE", "auto")) or "auto",
+            refine_mode=os.getenv("REFINE_THINKING_MODE", "enabled").lower(),
+            min_sharpness=float(os.getenv("THINKING_MIN_SHARPNESS", 6000)),
+            min_contrast=int(os.getenv("THINKING_MIN_CONTRAST", 150)),
+            min_text_density=float(os.getenv("THINKING_MIN_TEXT_DENSITY", 0.002)),
+            max_text_density=float(os.getenv("THINKING_MAX_TEXT_DENSITY", 0.3)),
+        )
+
+    def is_easy(self, difficulty: ImageDifficulty) -> bool:
+        """清晰、对比度足够且文字密度适中的图片不需要思考模式"""
+        return (
+            difficulty.sharpness >= self.min_sharpness
+            and difficulty.contrast >= self.min_contrast
+            and self.min_text_density <= difficulty.text_density <= self.max_text_density
+        )
+
+
+class ThinkingStats:
+    """思考模式选择统计：各来源的决策次数，以及开启 / 关闭思考时的上游耗时"""
+
+    def __init__(self, window: int = 1000):
+        self.decisions: Counter = Counter()
+        self.estimate_time = 0.0
+        self._latencies: Dict[str, Deque[float]] = {
+            "enabled": deque(maxlen=window),
+            "disabled": deque(maxlen=window),
+        }
+
+    def record_decision(self, source: str, thinking: str, difficulty: Optional[ImageDifficulty] = None) -> None:
+        """source：auto（按难度）、override（请求指定）或 default（配置 / 分组默认）"""
+        self.decisions[f"{source}_{thinking}"] += 1
+        if difficulty is not None:
+            self.estimate_time += difficulty.elapsed
+
+    def record_latency(self, thinking: str, seconds: float) -> None:
+        if thinking in self._latencies:
+            self._latencies[thinking].append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        estimated = self.decisions["auto_enabled"] + self.decisions["auto_disabled"]
+        result: Dict[str, Any] = {f"decisions_{key}": value for key, value in sorted(self.decisions.items())}
+        result["avg_estimate_ms"] = round(self.estimate_time / estimated * 1000, 2) if estimated else 0.0
+        for thinking, values in self._latencies.items():
+            result[f"{thinking}_calls"] = len(values)
+            for key, value in latency_summary(values, (50, 95)).items():
+                result[f"{thinking}_latency_{key}"] = value
+        return result
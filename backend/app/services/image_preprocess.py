@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from PIL import Image, ImageChops
+
+from app.utils.image_validation import ValidatedImage
+
+logger = logging.getLogger(__name__)
+
+FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+@dataclass
+class PreprocessConfig:
+    """图片预处理配置"""
+    enabled: bool = True
+    max_edge: int = 2048
+    grayscale: bool = False
+    crop_to_content: bool = False
+    # auto / JPEG / PNG / WEBP
+    output_format: str = "auto"
+    jpeg_quality: int = 90
+
+    @classmethod
+    def from_env(cls) -> "PreprocessConfig":
+        return cls(
+            enabled=os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() not in ("0", "false", "no"),
+            max_edge=int(os.getenv("IMAGE_MAX_EDGE", 2048)),
+            grayscale=os.getenv("IMAGE_GRAYSCALE", "false").lower() in ("1", "true", "yes"),
+            crop_to_content=os.getenv("IMAGE_CROP_TO_CONTENT", "false").lower() in ("1", "true", "yes"),
+            output_format=os.getenv("IMAGE_OUTPUT_FORMAT", "auto"),
+            jpeg_quality=int(os.getenv("IMAGE_JPEG_QUALITY", 90)),
+        )
+
+
+@dataclass
+class PreprocessedImage:
+    """预处理后的图片数据"""
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_size: int
+    elapsed: float
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_size - len(self.data)
+
+
+class PreprocessStats:
+    """预处理累计统计"""
+
+    def __init__(self):
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_time = 0.0
+
+    def record(self, result: PreprocessedImage) -> None:
+        self.images += 1
+        self.bytes_in += result.original_size
+        self.bytes_out += len(result.data)
+        self.total_time += result.elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "images": self.images,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "avg_time_ms": round(self.total_time / self.images * 1000, 2) if self.images else 0.0,
+        }
+
+
+def crop_to_content(image: Image.Image, threshold: int = 24, margin: int = 8) -> Image.Image:
+    """裁剪到内容区域：以左上角像素作为背景色，去除四周的空白边"""
+    gray = image.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    diff = ImageChops.difference(gray, background).point(lambda p: 255 if p > threshold else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - margin, 0),
+        max(top - margin, 0),
+        min(right + margin, image.width),
+        min(bottom + margin, image.height),
+    ))
+
+
+def preprocess_image(source: ValidatedImage, config: Optional[PreprocessConfig] = None) -> PreprocessedImage:
+    """使用已解码的图片（与难度评估等共用）缩放、可选灰度化与裁剪，并重新编码为体积更小的格式"""
+    config = config or PreprocessConfig()
+    start = time.perf_counter()
+
+    image_bytes = source.data
+    source_format = source.format
+    image = source.decoded()
+    changed = False
+
+    if config.crop_to_content:
+        cropped = crop_to_content(image)
+        changed = changed or cropped.size != image.size
+        image = cropped
+
+    if config.max_edge and max(image.size) > config.max_edge:
+        # 解码结果由多个阶段共用，不能像 thumbnail 那样原地缩放；reducing_gap 与 thumbnail 相同，先整数倍缩小再精确缩放
+        scale = config.max_edge / max(image.size)
+        size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        changed = True
+
+    if config.grayscale and image.mode not in ("L", "LA"):
+        image = image.convert("LA" if "A" in image.getbands() else "L")
+        changed = True
+
+    output_format = config.output_format.upper()
+    has_alpha = "A" in image.getbands() or "transparency" in image.info
+    if output_format == "AUTO":
+        # 无透明通道时 JPEG 体积最小；带透明通道时保留 PNG
+        output_format = "PNG" if has_alpha else "JPEG"
+    if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB" if image.mode not in ("LA", "L") else "L")
+
+    buffer = BytesIO()
+    save_kwargs: Dict[str, Any] = {"optimize": True}
+    if output_format in ("JPEG", "WEBP"):
+        save_kwargs["quality"] = config.jpeg_quality
+    image.save(buffer, format=output_format, **save_kwargs)
+    data = buffer.getvalue()
+
+    # 未做变换且重新编码反而更大时保留原图
+    if not changed and len(data) >= len(image_bytes) and source_format in FORMAT_MIME_TYPES:
+        data = image_bytes
+        output_format = source_format
+
+    return PreprocessedImage(
+        data=data,
+        mime_type=FORMAT_MIME_TYPES[output_format],
+        width=image.width,
+        height=image.height,
+        original_size=len(image_bytes),
+        elapsed=time.perf_counter() - start,
+    )
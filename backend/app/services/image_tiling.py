@@ -0,0 +1,273 @@
+import os
+import math
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from app.models.models import RecognizedLine
+from app.utils.image_validation import ValidatedImage
+
+logger = logging.getLogger(__name__)
+
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class TilingConfig:
+    """分块识别配置"""
+    enabled: bool = True
+    # bands：按文字行间空白切分为横向条带；grid：固定网格
+    mode: str = "bands"
+    # 条带目标高度 / 网格边长（像素）
+    tile_size: int = 1536
+    # 相邻分块的重叠像素（条带模式在空白行处切分时不重叠）
+    overlap: int = 64
+    # 长边超过该值时自动分块
+    min_edge: int = 3000
+    max_tiles: int = 16
+    # 分块模式下允许的上传大小上限
+    max_image_size: int = 20 * 1024 * 1024
+    # 单张图片的分块并发识别数
+    concurrency: int = 4
+
+    @classmethod
+    def from_env(cls) -> "TilingConfig":
+        return cls(
+            enabled=os.getenv("IMAGE_TILING_ENABLED", "true").lower() not in ("0", "false", "no"),
+            mode=os.getenv("IMAGE_TILING_MODE", "bands").lower(),
+            tile_size=int(os.getenv("IMAGE_TILE_SIZE", 1536)),
+            overlap=int(os.getenv("IMAGE_TILE_OVERLAP", 64)),
+            min_edge=int(os.getenv("IMAGE_TILING_MIN_EDGE", 3000)),
+            max_tiles=int(os.getenv("IMAGE_MAX_TILES", 16)),
+            max_image_size=int(os.getenv("IMAGE_TILING_MAX_SIZE", 20 * 1024 * 1024)),
+            concurrency=int(os.getenv("IMAGE_TILING_CONCURRENCY", 4)),
+        )
+
+
+def _spans(length: int, tile: int, overlap: int) -> List[Tuple[int, int]]:
+    """将一条边均匀切分为互相重叠的区间"""
+    if length <= tile:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [(round(index * step), round(index * step) + tile) for index in range(count)]
+
+
+def grid_boxes(width: int, height: int, tile_size: int, overlap: int) -> List[List[Box]]:
+    """固定网格分块，按行返回（阅读顺序）"""
+    overlap = min(overlap, tile_size // 2)
+    return [
+        [(left, top, right, bottom) for left, right in _spans(width, tile_size, overlap)]
+        for top, bottom in _spans(height, tile_size, overlap)
+    ]
+
+
+def band_boxes(image: Image.Image, target_height: int, overlap: int, threshold: float = 2.0) -> List[List[Box]]:
+    """按水平投影轮廓在文字行之间的空白处切分为全宽条带，找不到空白时退化为带重叠的硬切分"""
+    width, height = image.size
+    if height <= target_height:
+        return [[(0, 0, width, height)]]
+    overlap = min(overlap, target_height // 2)
+
+    # 缩放为 1 像素宽即得到每一行的平均灰度（投影轮廓），出现最多的灰度视为背景
+    profile = list(image.convert("L").resize((1, height), Image.Resampling.BOX).getdata())
+    background = Counter(round(value) for value in profile).most_common(1)[0][0]
+    blank = [abs(value - background) <= threshold for value in profile]
+
+    boxes: List[List[Box]] = []
+    top = 0
+    while height - top > target_height:
+        limit = top + target_height
+        # 在条带后半段中寻找离目标高度最近的空白行
+        cut = next((row for row in range(limit, top + target_height // 2, -1) if blank[row]), None)
+        if cut is not None:
+            boxes.append([(0, top, width, cut)])
+            top = cut
+        else:
+            boxes.append([(0, top, width, limit)])
+            top = limit - overlap
+    boxes.append([(0, top, width, height)])
+    return boxes
+
+
+def plan_tiles(image: Image.Image, config: TilingConfig) -> List[List[Box]]:
+    """按配置规划分块，超过 max_tiles 时逐步增大分块尺寸"""
+    tile_size = config.tile_size
+    while True:
+        if config.mode == "grid":
+            rows = grid_boxes(image.width, image.height, tile_size, config.overlap)
+        else:
+            rows = band_boxes(image, tile_size, config.overlap)
+        count = sum(len(row) for row in rows)
+        if count <= config.max_tiles:
+            return rows
+        tile_size = int(tile_size * 1.25)
+
+
+def split_image(source: ValidatedImage, config: TilingConfig) -> Tuple[List[List[Box]], List[List[ValidatedImage]]]:
+    """使用已解码的图片裁剪出所有分块，按行返回分块区域和分块图片
+
+    分块图片带有裁剪出的像素数据，后续的难度评估和预处理不再解码编码后的分块。
+    """
+    image = source.decoded()
+    rows = plan_tiles(image, config)
+
+    # PNG 保持无损，其余按高质量 JPEG 编码
+    output_format = "PNG" if source.format == "PNG" else "JPEG"
+    if output_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    tiles: List[List[ValidatedImage]] = []
+    for row in rows:
+        encoded = []
+        for box in row:
+            buffer = BytesIO()
+            save_kwargs = {"quality": 95} if output_format == "JPEG" else {}
+            crop = image.crop(box)
+            crop.save(buffer, format=output_format, **save_kwargs)
+            tile = ValidatedImage(data=buffer.getvalue(), format=output_format, width=crop.width, height=crop.height)
+            encoded.append(tile.with_decoded(crop))
+        tiles.append(encoded)
+    logger.info(f"图片 {image.width}x{image.height} 切分为 {sum(len(row) for row in rows)} 个分块 ({config.mode})")
+    return rows, tiles
+
+
+def _same_line(a: str, b: str, min_ratio: float = 0.85) -> bool:
+    a, b = "".join(a.split()), "".join(b.split())
+    if a == b:
+        return True
+    return bool(a and b) and SequenceMatcher(None, a, b).ratio() >= min_ratio
+
+
+def _overlap_lines(previous: List[str], following: List[str], max_lines: int = 8) -> int:
+    """返回前一块末尾与后一块开头重复的行数"""
+    for count in range(min(len(previous), len(following), max_lines), 0, -1):
+        if all(_same_line(a, b) for a, b in zip(previous[-count:], following[:count])):
+            return count
+    return 0
+
+
+def merge_tile_texts(rows: List[List[str]], overlapping: Optional[List[bool]] = None) -> str:
+    """按阅读顺序合并条带分块（每行一个全宽分块）的识别结果，网格分块使用 merge_grid_lines
+
+    overlapping[i] 表示第 i 行分块与上一行在图像上有重叠，只在有重叠时去除重复识别的行，
+    避免误删文档中本来就相邻重复的内容。
+    """
+    merged: List[str] = []
+    for index, row in enumerate(rows):
+        lines = [line for text in row for line in text.split("\n") if line.strip()]
+        dedupe = overlapping is None or overlapping[index]
+        overlap = _overlap_lines(merged, lines) if dedupe else 0
+        for offset in range(overlap):
+            # 重复行保留更完整的版本（被分块边缘截断的行通常较短）
+            position = len(merged) - overlap + offset
+            if len(lines[offset]) > len(merged[position]):
+                merged[position] = lines[offset]
+        merged.extend(lines[overlap:])
+    return "\n".join(merged)
+
+
+@dataclass
+class _Fragment:
+    """网格分块中识别出的一行在整页上的位置"""
+    text: str
+    box: Tuple[float, float, float, float]
+    tile: int
+
+
+def _tile_fragments(tile: int, box: Box, lines: Sequence[RecognizedLine]) -> List[_Fragment]:
+    """把分块内 0-1000 归一化的行坐标换算为整页像素坐标；没有坐标的行按顺序均匀分布在分块高度内"""
+    left, top, right, bottom = box
+    width, height = right - left, bottom - top
+    fragments = []
+    for index, line in enumerate(lines):
+        if line.box is not None:
+            x1, y1, x2, y2 = line.box
+            page_box = (left + x1 * width / 1000, top + y1 * height / 1000, left + x2 * width / 1000, top + y2 * height / 1000)
+        else:
+            row_height = height / len(lines)
+            page_box = (left, top + index * row_height, right, top + (index + 1) * row_height)
+        fragments.append(_Fragment(line.text, page_box, tile))
+    return fragments
+
+
+def _join_text(left: str, right: str) -> str:
+    """拼接同一行中相邻分块的文字，去掉两块在水平重叠区重复识别的部分（两块坐标已确认重叠，单个字符的重复也去掉）"""
+    for count in range(min(len(left), len(right)), 0, -1):
+        if left.endswith(right[:count]):
+            return left + right[count:]
+    # 两侧都是西文字符时以空格分隔，中文等直接相连
+    separator = " " if left[-1:].isascii() and right[:1].isascii() else ""
+    return left.rstrip() + separator + right.lstrip()
+
+
+def _merge_same_line(fragments: List[_Fragment]) -> str:
+    """从左到右合并整页上同一行的片段
+
+    不同分块中水平位置重叠的片段：文字相同或互相包含时视为重叠区的重复识别（保留较完整的一个），
+    否则视为被分块边界截断的同一行，拼接并去掉重复部分。
+    """
+    fragments = sorted(fragments, key=lambda fragment: fragment.box[0])
+    merged: List[_Fragment] = [fragments[0]]
+    for fragment in fragments[1:]:
+        previous = merged[-1]
+        if fragment.tile == previous.tile or fragment.box[0] >= previous.box[2]:
+            merged.append(fragment)
+            continue
+        box = (previous.box[0], min(previous.box[1], fragment.box[1]), max(previous.box[2], fragment.box[2]), max(previous.box[3], fragment.box[3]))
+        a, b = "".join(previous.text.split()), "".join(fragment.text.split())
+        if a in b or b in a or _same_line(previous.text, fragment.text):
+            text = max(previous.text, fragment.text, key=len)
+        else:
+            text = _join_text(previous.text, fragment.text)
+        merged[-1] = _Fragment(text, box, fragment.tile)
+    return " ".join(fragment.text for fragment in merged)
+
+
+def merge_grid_lines(boxes: List[List[Box]], tile_lines: List[List[Sequence[RecognizedLine]]]) -> str:
+    """按行坐标合并网格分块的结构化识别结果
+
+    网格模式下同一行文字可能横跨左右相邻的分块，按分块顺序拼接会把一行拆开并打乱顺序。
+    这里把每个分块识别出的行换算到整页坐标，按垂直中心把属于同一行的片段归为一组，
+    组内从左到右拼接，同时去掉水平和垂直重叠区中重复识别的内容。
+    """
+    fragments: List[_Fragment] = []
+    tiles = [(box, lines) for row_boxes, row_lines in zip(boxes, tile_lines) for box, lines in zip(row_boxes, row_lines)]
+    for tile, (box, lines) in enumerate(tiles):
+        fragments.extend(_tile_fragments(tile, box, lines))
+    if not fragments:
+        return ""
+
+    heights = sorted(fragment.box[3] - fragment.box[1] for fragment in fragments)
+    tolerance = max(heights[len(heights) // 2] / 2, 1.0)
+    fragments.sort(key=lambda fragment: (fragment.box[1] + fragment.box[3]) / 2)
+    groups: List[List[_Fragment]] = []
+    center = 0.0
+    for fragment in fragments:
+        middle = (fragment.box[1] + fragment.box[3]) / 2
+        if groups and middle - center <= tolerance:
+            groups[-1].append(fragment)
+            center = sum((item.box[1] + item.box[3]) / 2 for item in groups[-1]) / len(groups[-1])
+        else:
+            groups.append([fragment])
+            center = middle
+    return "\n".join(_merge_same_line(group) for group in groups)
+
+
+def row_overlaps(rows: List[List[Box]]) -> List[bool]:
+    """每一行分块是否与上一行在垂直方向重叠"""
+    return [index > 0 and row[0][1] < rows[index - 1][0][3] for index, row in enumerate(rows)]
+
+
+def should_tile(width: int, height: int, size: int, config: TilingConfig, requested: Optional[bool], max_single_size: int) -> bool:
+    """判断是否使用分块识别：显式指定优先，超过单次上传大小上限时必须分块，否则按长边自动判断"""
+    if not config.enabled or requested is False:
+        return False
+    if requested or size > max_single_size:
+        return True
+    return max(width, height) >= config.min_edge
@@ -0,0 +1,426 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.services.client_quota import current_client, get_client_quotas
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.utils.image_validation import ImageValidationError, ValidatedImage
+from app.utils.logging_setup import request_id_var
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+# 识别处理函数：接收图片和自定义提示词，返回带 text / cached 属性的识别结果
+JobHandler = Callable[[ValidatedImage, Optional[str]], Awaitable[Any]]
+
+
+class JobQueueFullError(Exception):
+    """客户端排队任务过多，应返回 429"""
+
+
+@dataclass
+class Job:
+    """识别任务状态"""
+    job_id: str
+    client_id: str
+    priority: int
+    status: str
+    attempts: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    recognized_text: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    # 排队中任务前面的任务数（近似值，不考虑客户端轮转）
+    position: Optional[int] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class JobQueue:
+    """基于 SQLite 的持久化识别任务队列
+
+    - 任务按优先级出队，同优先级下在客户端之间轮转（最久未被服务的客户端优先），避免单个客户端占满工作协程
+    - 工作协程可运行在 API 进程内，也可通过 job_worker.py 在独立进程中运行（共享同一个数据库文件）
+    - 完成的任务在 result_ttl 秒后过期删除；工作进程崩溃后，超过租约时间的运行中任务会重新入队，
+      每次领取计为一次尝试，达到 max_attempts 的超时任务标记为失败，避免反复导致崩溃的任务无限重试
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        result_ttl: float = 3600.0,
+        max_queued_per_client: int = 20,
+        max_attempts: int = 5,
+        lease_timeout: float = 600.0,
+        poll_interval: float = 0.5,
+    ):
+        self.db_path = db_path
+        self.result_ttl = result_ttl
+        self.max_queued_per_client = max_queued_per_client
+        self.max_attempts = max_attempts
+        self.lease_timeout = lease_timeout
+        self.poll_interval = poll_interval
+
+        self._db_lock = threading.Lock()
+        self._db = self._open_db(db_path)
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._updated: Dict[str, asyncio.Event] = {}
+        self._last_purge = 0.0
+        self._last_lease_check = 0.0
+        self._stopping = False
+
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+        self.expired = 0
+        self.busy_workers = 0
+
+    async def submit(
+        self,
+        image: ValidatedImage,
+        custom_prompt: Optional[str] = None,
+        client_id: str = "anonymous",
+        priority: int = 0,
+    ) -> Job:
+        """写入新任务并唤醒空闲工作协程"""
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self._insert, job_id, image.data, custom_prompt, client_id, priority)
+        self.submitted += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._load, job_id)
+
+    async def wait_for_update(self, job_id: str, timeout: float) -> None:
+        """等待任务状态变化；独立工作进程的更新无法通知，依靠超时后重新查询"""
+        event = self._updated.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def start(self, handler: JobHandler, workers: int) -> None:
+        """启动工作协程"""
+        if workers <= 0 or self._workers:
+            return
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        with self._db_lock:
+            self._expire_leases(time.time())
+        self._workers = [
+            asyncio.create_task(self._worker(handler), name=f"job-worker-{index}")
+            for index in range(workers)
+        ]
+        logger.info(f"任务队列已启动，工作协程数: {workers}，数据库: {self.db_path}")
+
+    async def stop(self, drain_timeout: float = 0.0) -> None:
+        """停止工作协程：不再领取新任务，最多等待 drain_timeout 秒让进行中的任务完成，其余任务取消后重新入队"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._workers and drain_timeout > 0:
+            _, pending = await asyncio.wait(self._workers, timeout=drain_timeout)
+            if pending:
+                logger.warning(f"{len(pending)} 个任务未在 {drain_timeout}s 内完成，将重新入队")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def close(self) -> None:
+        with self._db_lock:
+            self._db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "busy_workers": self.busy_workers,
+            "submitted": self.submitted,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "requeued": self.requeued,
+            # 超过租约时间仍未完成的任务数（重新入队或达到尝试上限后失败）
+            "expired": self.expired,
+        }
+
+    async def _worker(self, handler: JobHandler) -> None:
+        while not self._stopping:
+            try:
+                claimed = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                claimed = None
+            if claimed is None:
+                if self._stopping:
+                    break
+                await self._idle()
+                continue
+
+            job_id, client_id, data, custom_prompt, attempts = claimed
+            self._notify(job_id)
+            self.busy_workers += 1
+            # 任务处理期间的日志以任务 ID 作为请求标识，上游调用按提交任务的客户端的批量流量调度和计量
+            token = request_id_var.set(job_id)
+            client_token = current_client.set(get_client_quotas().job_client(client_id))
+            try:
+                await self._run(handler, job_id, data, custom_prompt, attempts)
+            finally:
+                current_client.reset(client_token)
+                request_id_var.reset(token)
+                self.busy_workers -= 1
+                self._notify(job_id)
+
+    async def _run(
+        self,
+        handler: JobHandler,
+        job_id: str,
+        data: bytes,
+        custom_prompt: Optional[str],
+        attempts: int,
+    ) -> None:
+        try:
+            image = ValidatedImage.from_bytes(data)
+            result = await handler(image, custom_prompt)
+        except asyncio.CancelledError:
+            # 进程退出时将任务放回队列，由下一个工作协程继续处理（不计入尝试次数）
+            await asyncio.shield(asyncio.to_thread(self._requeue, job_id, 0.0, True))
+            raise
+        except UpstreamOverloadedError as e:
+            if attempts < self.max_attempts:
+                # 上游繁忙不算失败，延迟后重新排队
+                self.requeued += 1
+                logger.warning(f"任务 {job_id} 上游繁忙，{e.retry_after:.1f}s 后重试")
+                await asyncio.to_thread(self._requeue, job_id, e.retry_after)
+                return
+            await self._finish(job_id, error=str(e))
+        except ImageValidationError as e:
+            await self._finish(job_id, error=str(e))
+        except Exception as e:
+            logger.error(f"任务 {job_id} 识别失败: {e}")
+            await self._finish(job_id, error=f"识别失败: {str(e)}")
+        else:
+            await self._finish(job_id, text=result.text, cached=result.cached)
+
+    async def _finish(
+        self,
+        job_id: str,
+        text: Optional[str] = None,
+        cached: bool = False,
+        error: Optional[str] = None,
+    ) -> None:
+        await asyncio.to_thread(self._store_result, job_id, text, cached, error)
+        if error is None:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    async def _idle(self) -> None:
+        """没有可领取的任务时等待新任务或轮询间隔，并顺带清理过期任务"""
+        now = time.time()
+        if now - self._last_purge > 60:
+            self._last_purge = now
+            purged = await asyncio.to_thread(self._purge_expired, now)
+            if purged:
+                logger.info(f"清理过期任务 {purged} 个")
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _notify(self, job_id: str) -> None:
+        event = self._updated.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    def _open_db(self, db_path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 自动提交模式，领取任务时显式使用 BEGIN IMMEDIATE 保证多进程下不会重复领取
+        db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, client_id TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "image BLOB, custom_prompt TEXT, "
+            "created_at REAL NOT NULL, available_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, expires_at REAL, "
+            "result TEXT, cached INTEGER NOT NULL DEFAULT 0, error TEXT)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, priority, created_at)")
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client_id, started_at)")
+        return db
+
+    def _insert(self, job_id: str, data: bytes, custom_prompt: Optional[str], client_id: str, priority: int) -> None:
+        now = time.time()
+        with self._db_lock:
+            (queued,) = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE client_id = ? AND status IN ('queued', 'running')",
+                (client_id,),
+            ).fetchone()
+            if queued >= self.max_queued_per_client:
+                raise JobQueueFullError(f"排队中的任务过多（上限 {self.max_queued_per_client}），请稍后再提交")
+            self._db.execute(
+                "INSERT INTO jobs (id, client_id, priority, status, image, custom_prompt, created_at, available_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, client_id, priority, data, custom_prompt, now, now),
+            )
+
+    def _claim(self) -> Optional[tuple]:
+        """领取下一个任务：优先级最高者优先，同优先级下最久未被服务的客户端优先
+
+        同时定期检查租约，将崩溃的工作进程遗留的运行中任务重新入队。
+        """
+        now = time.time()
+        with self._db_lock:
+            if now - self._last_lease_check >= min(60.0, self.lease_timeout / 2):
+                self._expire_leases(now)
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id FROM jobs AS j WHERE status = 'queued' AND available_at <= ? "
+                    "ORDER BY priority DESC, "
+                    "COALESCE((SELECT MAX(started_at) FROM jobs AS r WHERE r.client_id = j.client_id), 0) ASC, "
+                    "created_at ASC LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ?, attempts = attempts + 1 WHERE id = ?",
+                    (now, row[0]),
+                )
+                claimed = self._db.execute(
+                    "SELECT id, client_id, image, custom_prompt, attempts FROM jobs WHERE id = ?", (row[0],)
+                ).fetchone()
+                self._db.execute("COMMIT")
+                return claimed
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _requeue(self, job_id: str, delay: float, refund: bool = False) -> None:
+        """将运行中的任务放回队列；refund 为 True 时退还本次领取计入的尝试次数"""
+        with self._db_lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, attempts = attempts - ? "
+                "WHERE id = ? AND status = 'running'",
+                (time.time() + delay, int(refund), job_id),
+            )
+
+    def _expire_leases(self, now: float) -> None:
+        """处理超过租约时间的运行中任务：已达到尝试上限的标记为失败，其余重新入队（调用方需持有 _db_lock）"""
+        self._last_lease_check = now
+        deadline = now - self.lease_timeout
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            failed = self._db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, expires_at = ?, image = NULL "
+                "WHERE status = 'running' AND started_at < ? AND attempts >= ?",
+                (f"任务 {self.max_attempts} 次运行均超时未完成", now, now + self.result_ttl, deadline, self.max_attempts),
+            ).rowcount
+            requeued = self._db.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ? WHERE status = 'running' AND started_at < ?",
+                (now, deadline),
+            ).rowcount
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        if requeued:
+            logger.warning(f"{requeued} 个运行超时的任务已重新入队")
+        if failed:
+            logger.error(f"{failed} 个任务多次运行超时，已标记为失败")
+        self.expired += requeued + failed
+        self.failed += failed
+
+    def _store_result(self, job_id: str, text: Optional[str], cached: bool, error: Optional[str]) -> None:
+        now = time.time()
+        with self._db_lock:
+            # 完成后删除图片数据，只保留结果直到过期
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, cached = ?, error = ?, "
+                "finished_at = ?, expires_at = ?, image = NULL WHERE id = ?",
+                ("failed" if error is not None else "succeeded", text, int(cached), error,
+                 now, now + self.result_ttl, job_id),
+            )
+
+    def _purge_expired(self, now: float) -> int:
+        with self._db_lock:
+            cursor = self._db.execute("DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        return cursor.rowcount
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT id, client_id, priority, status, attempts, created_at, started_at, finished_at, "
+                "result, cached, error, expires_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None or (row[11] is not None and row[11] <= time.time()):
+                return None
+            job = Job(
+                job_id=row[0], client_id=row[1], priority=row[2], status=row[3], attempts=row[4],
+                created_at=row[5], started_at=row[6], finished_at=row[7],
+                recognized_text=row[8], cached=bool(row[9]), error=row[10],
+            )
+            if job.status == "queued":
+                (job.position,) = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' "
+                    "AND (priority > ? OR (priority = ? AND created_at < ?))",
+                    (job.priority, job.priority, job.created_at),
+                ).fetchone()
+        return job
+
+
+def create_job_queue() -> JobQueue:
+    """根据环境变量创建任务队列"""
+    return JobQueue(
+        db_path=os.getenv("JOB_QUEUE_DB", "data/jobs.db"),
+        result_ttl=float(os.getenv("JOB_RESULT_TTL", 3600)),
+        max_queued_per_client=int(os.getenv("JOB_MAX_QUEUED_PER_CLIENT", 20)),
+        max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", 5)),
+        lease_timeout=float(os.getenv("JOB_LEASE_TIMEOUT", 600)),
+        poll_interval=float(os.getenv("JOB_POLL_INTERVAL", 0.5)),
+    )
+
+
+_queue: Optional[JobQueue] = None
+
+
+def get_job_queue() -> JobQueue:
+    """获取进程内共享的任务队列（首次调用时打开数据库），也用作 FastAPI 依赖"""
+    global _queue
+    if _queue is None:
+        _queue = create_job_queue()
+    return _queue
+
+
+async def close_job_queue(drain_timeout: float = 0.0) -> None:
+    """停止工作协程并关闭数据库"""
+    global _queue
+    if _queue is not None:
+        await _queue.stop(drain_timeout)
+        _queue.close()
+        _queue = None
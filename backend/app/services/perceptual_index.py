@@ -0,0 +1,258 @@
+import os
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+# 校验图的长边上限：按整数倍缩小后再等比缩放到不超过该值，正文文字仍清晰可辨
+# （手机截图约为原图的 1/2~1/4，较小的图片保持原尺寸），单个数字的改动也能区分
+CONFIRM_MAX_EDGE = 768
+# 统计不一致像素的滑动窗口半径（窗口为 13x13 像素，约一个字符大小）
+CONFIRM_WINDOW_RADIUS = 6
+# 灰度差超过该值的像素视为不一致
+CONFIRM_PIXEL_DIFF = 48
+# 校验时允许的平移（像素），吸收裁边和取整带来的轻微错位
+CONFIRM_MAX_SHIFT = 1
+
+
+@dataclass(frozen=True)
+class ImageFingerprint:
+    """图片感知指纹：差值哈希（dHash）、宽高比和用于二次校验的灰度校验图（zlib 压缩，16 级灰度）"""
+    hash: int
+    aspect: float
+    confirm: bytes
+    confirm_size: Tuple[int, int]
+
+    def confirm_image(self) -> Image.Image:
+        return Image.frombytes("L", self.confirm_size, zlib.decompress(self.confirm))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _trim_borders(image: Image.Image, threshold: int = 48, min_fraction: float = 0.002) -> Image.Image:
+    """去除与左上角颜色相同的四周边框；只有足够多像素不同的行/列才算内容，避免 JPEG 噪点影响边界"""
+    background = Image.new("L", image.size, image.getpixel((0, 0)))
+    mask = ImageChops.difference(image, background).point(lambda p: 255 if p > threshold else 0)
+    limit = 255 * min_fraction
+    rows = [i for i, value in enumerate(mask.resize((1, image.height), Image.Resampling.BOX).tobytes()) if value > limit]
+    cols = [i for i, value in enumerate(mask.resize((image.width, 1), Image.Resampling.BOX).tobytes()) if value > limit]
+    if not rows or not cols:
+        return image
+    return image.crop((cols[0], rows[0], cols[-1] + 1, rows[-1] + 1))
+
+
+def image_fingerprint(gray: Image.Image, hash_size: int = 16) -> ImageFingerprint:
+    """由缩小的灰度图（ValidatedImage.grayscale()）计算 hash_size² 位的 dHash 和校验图
+
+    先去除四周的纯色边，再缩放为 (hash_size + 1) x hash_size 的灰度图，比较水平相邻像素的明暗。
+    重新编码（JPEG/PNG）、等比缩放和少量裁边后哈希基本不变。
+    """
+    # 先按整数倍缩小到校验图的 1~2 倍，去边和缩放只处理少量像素
+    factor = max(gray.size) // CONFIRM_MAX_EDGE
+    image = _trim_borders(gray.reduce(factor) if factor > 1 else gray)
+    pixels = image.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS).tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    scale = min(1.0, CONFIRM_MAX_EDGE / max(image.size))
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.Resampling.BOX)
+    # 量化为 16 级灰度，背景中的 JPEG 噪点被抹平，压缩后通常为 5~15KB
+    confirm = ImageOps.autocontrast(image).point(lambda p: p & 0xF0)
+    return ImageFingerprint(
+        hash=value,
+        aspect=image.width / image.height,
+        confirm=zlib.compress(confirm.tobytes()),
+        confirm_size=confirm.size,
+    )
+
+
+def confirm_distance(a: ImageFingerprint, b: ImageFingerprint) -> int:
+    """两张校验图的差异：在小范围平移对齐后，任一字符大小的窗口内灰度差超过 CONFIRM_PIXEL_DIFF 的像素数的最大值
+
+    dHash 反映整体版式，同一截图只改动一个数字时距离可能为 0；校验图保留了可辨认的文字，
+    逐像素比较可以发现单个字符的变化。每个位置分别取各平移下的最小值，用滑动窗口而非固定分块统计，
+    避免改动的字符恰好被分块边界分开。尺寸不同时在较小的尺寸下比较，缩放引入的笔画边缘差异
+    同样会计入，因此被明显缩放过的图片通常不会通过校验（宁可不复用，也不返回别的图片的结果）。
+    """
+    first, second = a.confirm_image(), b.confirm_image()
+    if first.width * first.height > second.width * second.height:
+        first, second = second, first
+    if second.size != first.size:
+        second = second.resize(first.size, Image.Resampling.BOX)
+    best: Optional[Image.Image] = None
+    for dx in range(-CONFIRM_MAX_SHIFT, CONFIRM_MAX_SHIFT + 1):
+        for dy in range(-CONFIRM_MAX_SHIFT, CONFIRM_MAX_SHIFT + 1):
+            diff = ImageChops.difference(first, ImageChops.offset(second, dx, dy))
+            mask = diff.point(lambda p: 255 if p > CONFIRM_PIXEL_DIFF else 0)
+            # 窗口内的平均值，即不一致像素占窗口的比例
+            density = mask.filter(ImageFilter.BoxBlur(CONFIRM_WINDOW_RADIUS))
+            best = density if best is None else ImageChops.darker(best, density)
+    window = (CONFIRM_WINDOW_RADIUS * 2 + 1) ** 2
+    return round(best.getextrema()[1] * window / 255)
+
+
+class BKTree(Generic[T]):
+    """按汉明距离组织的 BK 树，支持查找距离不超过阈值的所有条目"""
+
+    def __init__(self):
+        # 节点：[哈希, 值列表, {距离: 子节点}]
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, key: int, value: T) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [key, [value], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [value], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, T]]:
+        """返回 (距离, 值) 列表；利用三角不等式只访问距离区间 [d - r, d + r] 内的子树"""
+        results: List[Tuple[int, T]] = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node = pending.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        return results
+
+
+class PerceptualIndex:
+    """近似重复图片索引：感知指纹 -> 已缓存识别结果的缓存键
+
+    先在 BK 树中查找 dHash 汉明距离不超过 max_distance 的候选，再逐像素比对校验图
+    （字符大小的窗口内不一致的像素数不超过 max_block_diff），排除版式相同但文字或数字不同的图片。
+    按上下文（提示词、模型、思考模式）分开建树，只有识别条件相同的图片才会互相复用。
+    容量超限时按 LRU 淘汰，BK 树不支持删除，被淘汰的条目在查询时跳过，累积过多时重建。
+    """
+
+    def __init__(
+        self,
+        hash_size: int = 16,
+        max_distance: int = 12,
+        max_block_diff: int = 10,
+        max_aspect_delta: float = 0.05,
+        max_entries: int = 2048,
+        max_candidates: int = 3,
+    ):
+        self.hash_size = hash_size
+        self.max_distance = max_distance
+        self.max_block_diff = max_block_diff
+        self.max_aspect_delta = max_aspect_delta
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self._trees: Dict[str, BKTree[str]] = {}
+        # 缓存键 -> (上下文, 指纹)
+        self._entries: "OrderedDict[str, Tuple[str, ImageFingerprint]]" = OrderedDict()
+        self._stale = 0
+        # find 在线程中运行，与事件循环中的 add 共用条目和 BK 树
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.rejected = 0
+        self.rebuilds = 0
+
+    def find(self, fingerprint: ImageFingerprint, context: str) -> Optional[str]:
+        """按 dHash 距离从近到远校验候选条目，返回第一个通过校验图比对的缓存键
+
+        校验图比对每个候选约需数毫秒，应在线程中调用；比对时不持有锁。
+        """
+        with self._lock:
+            self.lookups += 1
+            tree = self._trees.get(context)
+            if tree is None:
+                return None
+            candidates = []
+            for distance, cache_key in tree.search(fingerprint.hash, self.max_distance):
+                entry = self._entries.get(cache_key)
+                if entry is None or entry[0] != context:
+                    continue
+                if abs(entry[1].aspect - fingerprint.aspect) > self.max_aspect_delta * fingerprint.aspect:
+                    continue
+                candidates.append((distance, cache_key, entry[1]))
+        # 只校验最近的几个候选
+        for distance, cache_key, candidate in sorted(candidates, key=lambda item: item[0])[:self.max_candidates]:
+            block_diff = confirm_distance(fingerprint, candidate)
+            with self._lock:
+                if block_diff > self.max_block_diff:
+                    self.rejected += 1
+                    continue
+                self.hits += 1
+                if cache_key in self._entries:
+                    self._entries.move_to_end(cache_key)
+            logger.info(f"命中近似重复图片，汉明距离: {distance}，校验差异: {block_diff}")
+            return cache_key
+        return None
+
+    def add(self, fingerprint: ImageFingerprint, context: str, cache_key: str) -> None:
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return
+            self._entries[cache_key] = (context, fingerprint)
+            self._trees.setdefault(context, BKTree()).add(fingerprint.hash, cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stale += 1
+            if self._stale > len(self._entries):
+                self._rebuild()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            # dHash 相近但校验图比对未通过的候选数
+            "rejected": self.rejected,
+            "rebuilds": self.rebuilds,
+        }
+
+    def _rebuild(self) -> None:
+        self._trees = {}
+        for cache_key, (context, fingerprint) in self._entries.items():
+            self._trees.setdefault(context, BKTree()).add(fingerprint.hash, cache_key)
+        self._stale = 0
+        self.rebuilds += 1
+
+
+def create_perceptual_index() -> Optional[PerceptualIndex]:
+    """根据环境变量创建近似重复图片索引，默认关闭"""
+    if os.getenv("NEAR_DUPLICATE_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    return PerceptualIndex(
+        hash_size=int(os.getenv("NEAR_DUPLICATE_HASH_SIZE", 16)),
+        max_distance=int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", 12)),
+        max_block_diff=int(os.getenv("NEAR_DUPLICATE_MAX_BLOCK_DIFF", 10)),
+        max_aspect_delta=float(os.getenv("NEAR_DUPLICATE_MAX_ASPECT_DELTA", 0.05)),
+        max_entries=int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", 2048)),
+    )
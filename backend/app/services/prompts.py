@@ -0,0 +1,326 @@
+import os
+import re
+import math
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PromptSet:
+    """一个版本的全部提示词模板（{text}、{instruction}、{lines}、{history} 为占位符）"""
+    version: int
+    recognition: str
+    # 分块识别时附加在识别提示词之后
+    tile_suffix: str
+    refine: str
+    tune: str
+    # 局部微调（及长文本分段微调）的各部分，按顺序拼接，空的部分省略
+    region_history: str
+    region_before: str
+    region_target: str
+    region_after: str
+    region_instruction: str
+    region_closing: str
+
+
+PROMPT_SETS: Dict[int, PromptSet] = {
+    1: PromptSet(
+        version=1,
+        recognition="""请仔细识别这张图片中的所有文字内容，特别注意以下要求：
+1. 识别所有可见的文字，包括模糊、不清晰或部分遮挡的文字
+2. 尽可能准确地还原文字的原始内容和含义
+3. 保持原有的文本格式、段落结构和排版布局
+4. 对于模糊或不确定的文字，请根据上下文进行合理推测
+5. 使用简体中文输出结果
+6. 如果图片中包含英文或其他语言，请保持原语言不变
+7. 按照从上到下、从左到右的顺序输出文字内容
+
+请直接输出识别到的文字内容，不需要添加额外的说明或解释。""",
+        tile_suffix="""
+
+注意：这张图片是整页文档中的一个局部区域，只输出该区域内可见的文字，不要补全区域之外的内容。""",
+        refine="""请根据以下指令对文字内容进行微调：
+
+原始文字内容：
+{text}
+
+微调指令：
+{instruction}
+
+请输出微调后的文字内容：""",
+        tune="""请根据以下指令对文字内容进行优化调整：
+
+指令：{instruction}
+
+原始文字内容：
+{text}
+
+请直接输出优化后的文字内容，不要添加任何解释或说明。""",
+        region_history="此前已按以下指令修改过这份文档（保持风格一致）：\n{history}",
+        region_before="需要修改的段落之前的内容（仅供参考，不要输出）：\n{lines}",
+        region_target="需要修改的段落：\n{text}",
+        region_after="需要修改的段落之后的内容（仅供参考，不要输出）：\n{lines}",
+        region_instruction="微调指令：\n{instruction}",
+        region_closing="请只输出修改后的段落，不要添加任何解释或说明：",
+    ),
+    2: PromptSet(
+        version=2,
+        recognition=(
+            "识别图片中的全部文字，包括模糊或被遮挡的部分，不确定处结合上下文推测。"
+            "保持原有段落和排版，按从上到下、从左到右的顺序输出；中文用简体，其他语言保持原文。"
+            "只输出文字内容，不要解释。"
+        ),
+        tile_suffix="\n注意：这是整页文档的局部区域，只输出区域内可见的文字，不要补全区域外的内容。",
+        refine="按指令修改以下文字，只输出修改后的文字，不要解释。\n指令：{instruction}\n文字：\n{text}",
+        tune="按指令优化以下文字，只输出优化后的文字，不要解释。\n指令：{instruction}\n文字：\n{text}",
+        region_history="已执行过的指令（保持风格一致）：\n{history}",
+        region_before="前文（仅供参考，不要输出）：\n{lines}",
+        region_target="待修改段落：\n{text}",
+        region_after="后文（仅供参考，不要输出）：\n{lines}",
+        region_instruction="指令：{instruction}",
+        region_closing="只输出修改后的段落，不要解释：",
+    ),
+}
+
+# 中日韩文字、全角标点大约每字 0.7 个 token，其他字符（英文、数字、空白）大约每 3.3 个字符 1 个 token
+_WIDE_CHARS = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef]")
+WIDE_TOKENS_PER_CHAR = 0.7
+NARROW_TOKENS_PER_CHAR = 0.3
+_PARAGRAPH_BREAK = re.compile(r"(\n[ \t]*\n\s*)")
+
+
+@dataclass
+class PromptConfig:
+    """提示词版本、输出长度上限和长文本分段配置"""
+    version: int = 2
+    # 文字微调的输出上限 = 输入文字 token 数 × output_ratio + output_margin
+    output_ratio: float = 1.3
+    output_margin: int = 128
+    min_output_tokens: int = 256
+    max_output_tokens: int = 16384
+    # 开启思考模式时为思考内容额外预留的 token 数
+    thinking_tokens: int = 4096
+    # 识别的输出上限按图片面积估计（每个输出 token 对应的像素数，越小越宽松）
+    recognition_pixels_per_token: int = 300
+    # 结构化输出（逐行 JSON + 坐标）相对纯文字的输出倍数
+    structured_output_factor: float = 3.0
+    # 超过该 token 数的微调文本按段落切分后并发处理
+    chunk_tokens: int = 1200
+    chunk_concurrency: int = 4
+    # 分段微调时附带的相邻分段上下文行数
+    chunk_context_lines: int = 2
+
+    @classmethod
+    def from_env(cls) -> "PromptConfig":
+        version = int(os.getenv("PROMPT_VERSION", 2))
+        if version not in PROMPT_SETS:
+            raise ValueError(f"PROMPT_VERSION must be one of {sorted(PROMPT_SETS)}, got {version}")
+        return cls(
+            version=version,
+            output_ratio=float(os.getenv("PROMPT_OUTPUT_RATIO", 1.3)),
+            output_margin=int(os.getenv("PROMPT_OUTPUT_MARGIN", 128)),
+            min_output_tokens=int(os.getenv("PROMPT_MIN_OUTPUT_TOKENS", 256)),
+            max_output_tokens=int(os.getenv("PROMPT_MAX_OUTPUT_TOKENS", 16384)),
+            thinking_tokens=int(os.getenv("PROMPT_THINKING_TOKENS", 4096)),
+            recognition_pixels_per_token=int(os.getenv("RECOGNITION_PIXELS_PER_TOKEN", 300)),
+            structured_output_factor=float(os.getenv("STRUCTURED_OUTPUT_TOKEN_FACTOR", 3.0)),
+            chunk_tokens=int(os.getenv("REFINE_CHUNK_TOKENS", 1200)),
+            chunk_concurrency=int(os.getenv("REFINE_CHUNK_CONCURRENCY", 4)),
+            chunk_context_lines=int(os.getenv("REFINE_CHUNK_CONTEXT_LINES", 2)),
+        )
+
+
+@dataclass
+class CallUsage:
+    """一次接口调用（可能包含多次上游调用，如分段微调、分块识别）的 token 用量"""
+    upstream_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # 文字类调用发送前估计的输入 token 数
+    estimated_prompt_tokens: int = 0
+    # 各次上游调用设置的输出上限之和
+    max_tokens: int = 0
+    chunks: int = 0
+    # 达到输出上限被截断的上游调用次数（含重试前的那一次）
+    truncated: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict[str, int]:
+        return {**asdict(self), "total_tokens": self.total_tokens}
+
+
+usage_var: ContextVar[Optional[CallUsage]] = ContextVar("call_usage", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[CallUsage]:
+    """累计当前调用及其中并发任务的上游 token 用量；已在统计中时沿用外层的记录"""
+    current = usage_var.get()
+    if current is not None:
+        yield current
+        return
+    usage = CallUsage()
+    token = usage_var.set(usage)
+    try:
+        yield usage
+    finally:
+        usage_var.reset(token)
+
+
+def record_call_usage(usage: Optional[Dict[str, Any]], max_tokens: Optional[int] = None, finish_reason: Optional[str] = None) -> None:
+    """记录一次上游调用的用量（不在 track_usage 中时忽略）"""
+    current = usage_var.get()
+    if current is None:
+        return
+    current.upstream_calls += 1
+    current.prompt_tokens += (usage or {}).get("prompt_tokens") or 0
+    current.completion_tokens += (usage or {}).get("completion_tokens") or 0
+    current.max_tokens += max_tokens or 0
+    current.truncated += int(finish_reason == "length")
+
+
+def record_estimate(tokens: int) -> None:
+    current = usage_var.get()
+    if current is not None:
+        current.estimated_prompt_tokens += tokens
+
+
+class PromptManager:
+    """提示词模板、token 估计、输出长度上限和长文本分段
+
+    token 估计按字符类别近似，并用上游返回的实际 prompt_tokens 持续校准（指数滑动平均）。
+    """
+
+    def __init__(self, config: PromptConfig):
+        self.config = config
+        self.templates = PROMPT_SETS[config.version]
+        self.calibration = 1.0
+        self.estimated = 0
+        self.observed = 0
+        self.calls_capped = 0
+        self.truncated = 0
+        self.truncation_retries = 0
+        self.chunked_requests = 0
+        self.chunks = 0
+
+    @property
+    def version(self) -> int:
+        return self.templates.version
+
+    def estimate_tokens(self, text: str) -> int:
+        wide = len(_WIDE_CHARS.findall(text))
+        raw = wide * WIDE_TOKENS_PER_CHAR + (len(text) - wide) * NARROW_TOKENS_PER_CHAR
+        return math.ceil(raw * self.calibration)
+
+    def observe(self, estimated: int, usage: Optional[Dict[str, Any]]) -> None:
+        """用上游返回的实际输入 token 数校准估计值（仅限纯文字请求）"""
+        actual = (usage or {}).get("prompt_tokens")
+        if not actual or estimated <= 0:
+            return
+        self.estimated += estimated
+        self.observed += actual
+        ratio = actual / (estimated / self.calibration)
+        self.calibration = min(max(0.9 * self.calibration + 0.1 * ratio, 0.5), 2.0)
+
+    def text_budget(self, input_tokens: int, thinking: str) -> int:
+        """文字微调的 max_tokens：输出长度与输入相当，留出余量和思考预算"""
+        budget = math.ceil(input_tokens * self.config.output_ratio) + self.config.output_margin
+        return self._clamp(budget, thinking)
+
+    def image_budget(self, width: int, height: int, thinking: str, structured: bool = False) -> int:
+        """文字识别的 max_tokens：按图片面积估计可能的文字量，主要用于截断重复输出等失控生成"""
+        budget = math.ceil(width * height / max(self.config.recognition_pixels_per_token, 1))
+        if structured:
+            budget = math.ceil(budget * self.config.structured_output_factor)
+        return self._clamp(budget + self.config.output_margin, thinking)
+
+    def _clamp(self, budget: int, thinking: str) -> int:
+        budget = max(budget, self.config.min_output_tokens)
+        if thinking == "enabled":
+            budget += self.config.thinking_tokens
+        self.calls_capped += 1
+        return min(budget, self.config.max_output_tokens)
+
+    def record_truncation(self, retried: bool) -> None:
+        self.truncated += 1
+        self.truncation_retries += int(retried)
+
+    def split_chunks(self, text: str) -> List[Tuple[str, str]]:
+        """按段落（空行）切分为不超过 chunk_tokens 的分段，返回 (分段, 其后的原分隔符) 列表
+
+        单个过长的段落按行切分；按原分隔符拼接各分段即可还原全文。
+        """
+        limit = self.config.chunk_tokens
+        if limit <= 0 or self.estimate_tokens(text) <= limit:
+            return [(text, "")]
+        pieces = _PARAGRAPH_BREAK.split(text)
+        units: List[Tuple[str, str]] = []
+        for paragraph, separator in zip(pieces[0::2], pieces[1::2] + [""]):
+            if "\n" in paragraph and self.estimate_tokens(paragraph) > limit:
+                lines = paragraph.split("\n")
+                units.extend((line, "\n") for line in lines[:-1])
+                units.append((lines[-1], separator))
+            else:
+                units.append((paragraph, separator))
+
+        groups: List[List[Tuple[str, str]]] = [[]]
+        tokens = 0
+        for unit, separator in units:
+            cost = self.estimate_tokens(unit)
+            if groups[-1] and tokens + cost > limit:
+                groups.append([])
+                tokens = 0
+            groups[-1].append((unit, separator))
+            tokens += cost
+        chunks = [("".join(unit + separator for unit, separator in group[:-1]) + group[-1][0], group[-1][1]) for group in groups]
+        self.chunked_requests += 1
+        self.chunks += len(chunks)
+        return chunks
+
+    def region_prompt(
+        self,
+        text: str,
+        instruction: str,
+        previous_instructions: Sequence[str] = (),
+        context_before: Sequence[str] = (),
+        context_after: Sequence[str] = (),
+    ) -> str:
+        """局部微调提示词：只包含该段落、少量上下文和此前的指令"""
+        templates = self.templates
+        sections = []
+        if previous_instructions:
+            sections.append(templates.region_history.format(history="\n".join(f"- {item}" for item in previous_instructions)))
+        if context_before:
+            sections.append(templates.region_before.format(lines="\n".join(context_before)))
+        sections.append(templates.region_target.format(text=text))
+        if context_after:
+            sections.append(templates.region_after.format(lines="\n".join(context_after)))
+        sections.append(templates.region_instruction.format(instruction=instruction))
+        sections.append(templates.region_closing)
+        return "\n\n".join(sections)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "calibration": round(self.calibration, 3),
+            "estimated_prompt_tokens": self.estimated,
+            "observed_prompt_tokens": self.observed,
+            "calls_capped": self.calls_capped,
+            "truncated": self.truncated,
+            "truncation_retries": self.truncation_retries,
+            "chunked_requests": self.chunked_requests,
+            "chunks": self.chunks,
+        }
+
+
+def create_prompt_manager() -> PromptManager:
+    """根据环境变量创建提示词管理"""
+    return PromptManager(PromptConfig.from_env())
@@ -0,0 +1,379 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.client_quota import ClientContext, current_client
+from app.services.glm_client import GLMAPIError
+from app.services.shared_state import SharedLimiterState, batch_capacity, shared_state_path
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamOverloadedError(Exception):
+    """上游容量不足，请求在排队前或排队超时后被快速拒绝（应返回 503）"""
+
+    def __init__(self, message: str = "上游服务繁忙，请稍后重试", retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("future", "batch", "tag", "seq")
+
+    def __init__(self, future: asyncio.Future, batch: bool, tag: float, seq: int):
+        self.future = future
+        self.batch = batch
+        self.tag = tag
+        self.seq = seq
+
+
+class FairWaitQueue:
+    """按客户端加权公平排序的等待队列（虚拟完成时间，近似 WFQ）
+
+    每个客户端的交互流量和批量流量各是一个流。入队标签 = max(虚拟时间, 该流上一个标签) + 1/权重，
+    出队时取标签最小者：持续大量排队的流只会排在自己之前的请求之后，新到的其他流不必等它排空。
+    不在客户端上下文中的请求属于同一个流，此时退化为先进先出。
+    """
+
+    # 流数量超过该值时清理标签已落后于虚拟时间的流（这些流再次入队时的标签与新流相同）
+    MAX_FLOWS = 1024
+
+    def __init__(self):
+        self._items: List[_Waiter] = []
+        self._finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def push(self, future: asyncio.Future, client: Optional[ClientContext]) -> _Waiter:
+        flow, weight = (client.flow, client.weight) if client is not None else ("", 1.0)
+        tag = max(self._virtual_time, self._finish.get(flow, 0.0)) + 1 / max(weight, 1e-6)
+        self._finish[flow] = tag
+        self._seq += 1
+        waiter = _Waiter(future, client is not None and client.batch, tag, self._seq)
+        self._items.append(waiter)
+        return waiter
+
+    def head(self, allow_batch: bool = True) -> Optional[_Waiter]:
+        """标签最小的等待者；allow_batch 为 False 时跳过批量流量"""
+        candidates = (waiter for waiter in self._items if allow_batch or not waiter.batch)
+        return min(candidates, key=lambda waiter: (waiter.tag, waiter.seq), default=None)
+
+    def pop(self, allow_batch: bool = True) -> Optional[_Waiter]:
+        waiter = self.head(allow_batch)
+        if waiter is not None:
+            self._items.remove(waiter)
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+            if len(self._finish) > self.MAX_FLOWS:
+                self._finish = {flow: tag for flow, tag in self._finish.items() if tag > self._virtual_time}
+        return waiter
+
+    def remove(self, waiter: _Waiter) -> None:
+        try:
+            self._items.remove(waiter)
+        except ValueError:
+            pass
+
+
+def _current_is_batch() -> bool:
+    client = current_client.get()
+    return client is not None and client.batch
+
+
+class AdaptiveLimiter:
+    """GLM 调用的共享限流器
+
+    - 令牌桶：限制每秒请求数（允许突发）
+    - 在途上限：AIMD 自适应，成功时加性增长，遇到 429/超时时乘性减半
+    - 有界等待队列 + 截止时间：预计等待过久或队列已满时立即拒绝
+    - 等待队列按客户端加权公平出队；批量流量最多占用 batch_share 比例的名额，为交互请求保留余量
+
+    请求所属的客户端和流量类型从 current_client 读取，acquire 和 release 需在同一上下文中调用。
+    """
+
+    def __init__(
+        self,
+        rate: float = 10.0,
+        burst: int = 20,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        max_queue: int = 100,
+        max_wait: float = 10.0,
+        decrease_cooldown: float = 1.0,
+        batch_share: float = 1.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.decrease_cooldown = decrease_cooldown
+        self.batch_share = batch_share
+
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.batch_in_flight = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._waiters = FairWaitQueue()
+
+        self.admitted = 0
+        self.shed = 0
+        self.overloads = 0
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """获取一个上游调用名额，退出时根据结果调整并发上限"""
+        await self.acquire()
+        try:
+            yield
+        except GLMAPIError as e:
+            if e.overloaded:
+                self.on_overload()
+            raise
+        else:
+            self.on_success()
+        finally:
+            self.release()
+
+    async def acquire(self) -> None:
+        deadline = time.monotonic() + self.max_wait
+        await self._acquire_concurrency(deadline)
+        try:
+            await self._acquire_token(deadline)
+        except BaseException:
+            self.release()
+            raise
+        self.admitted += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if _current_is_batch():
+            self.batch_in_flight -= 1
+        self._wake_waiters()
+
+    def on_success(self) -> None:
+        # 加性增长：每个"窗口"（约 limit 次成功）上限 +1
+        if self.limit < self.max_concurrency:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._wake_waiters()
+
+    def on_overload(self) -> None:
+        # 乘性减半；冷却期内的连续失败只计一次，避免上限被瞬间压到最低
+        self.overloads += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        logger.warning(f"上游过载，GLM并发上限下调至 {int(self.limit)}")
+
+    @property
+    def saturated(self) -> bool:
+        """等待队列已满，新请求会被立即拒绝"""
+        return len(self._waiters) >= self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "batch_in_flight": self.batch_in_flight,
+            "queued": len(self._waiters),
+            "tokens": round(self._tokens, 2),
+            "rate": self.rate,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "overloads": self.overloads,
+        }
+
+    async def _acquire_concurrency(self, deadline: float) -> None:
+        client = current_client.get()
+        batch = client is not None and client.batch
+        if not self._waiters and self._has_capacity(batch):
+            self._admit(batch)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("GLM等待队列已满")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = self._waiters.push(future, client)
+        # 队列中可能只有受份额限制的批量请求，此时交互请求可以直接获得空闲名额
+        self._wake_waiters()
+        try:
+            await asyncio.wait_for(future, timeout=max(deadline - time.monotonic(), 0))
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 名额已分配但调用方已放弃，归还名额
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("等待GLM并发名额超时")
+            raise
+
+    async def _acquire_token(self, deadline: float) -> None:
+        # 预约令牌：令牌数可以为负，表示需要等待的时间
+        self._refill()
+        self._tokens -= 1
+        wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if time.monotonic() + wait > deadline:
+            self._tokens += 1
+            self._reject("GLM请求速率超限")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _batch_allowed(self) -> bool:
+        return self.batch_share >= 1 or self.batch_in_flight < batch_capacity(self.limit, self.batch_share)
+
+    def _has_capacity(self, batch: bool) -> bool:
+        return self.in_flight < int(self.limit) and (not batch or self._batch_allowed())
+
+    def _admit(self, batch: bool) -> None:
+        self.in_flight += 1
+        if batch:
+            self.batch_in_flight += 1
+
+    def _wake_waiters(self) -> None:
+        while self.in_flight < int(self.limit):
+            waiter = self._waiters.pop(allow_batch=self._batch_allowed())
+            if waiter is None:
+                break
+            if not waiter.future.done():
+                self._admit(waiter.batch)
+                waiter.future.set_result(None)
+
+    def _reject(self, reason: str) -> None:
+        self.shed += 1
+        logger.warning(f"{reason}，拒绝请求")
+        raise UpstreamOverloadedError(retry_after=max(1.0, 1 / self.rate))
+
+
+class SharedAdaptiveLimiter(AdaptiveLimiter):
+    """令牌桶、AIMD 并发上限和在途数在所有工作进程间共享的限流器（SHARED_STATE_DIR）
+
+    速率和并发上限按整个服务计算，不再随工作进程数成倍增加。等待队列仍在进程内：
+    其他进程释放名额时没有通知，排在队首的请求每隔 poll_interval 秒重新检查一次。
+    """
+
+    def __init__(self, state: SharedLimiterState, poll_interval: float = 0.01, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.state = state
+        self.poll_interval = poll_interval
+
+    def release(self) -> None:
+        batch = _current_is_batch()
+        self.in_flight -= 1
+        if batch:
+            self.batch_in_flight -= 1
+        self.state.release(batch)
+
+    def on_success(self) -> None:
+        self.limit = self.state.increase_limit(self.max_concurrency)
+
+    def on_overload(self) -> None:
+        self.overloads += 1
+        limit = self.state.decrease_limit(self.min_concurrency, self.decrease_cooldown)
+        if limit is not None:
+            self.limit = limit
+            logger.warning(f"上游过载，GLM全局并发上限下调至 {int(self.limit)}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.state.snapshot(self.rate, self.burst)
+        self.limit = snapshot["limit"]
+        return {
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "batch_in_flight": self.batch_in_flight,
+            "global_in_flight": snapshot["in_flight"],
+            "global_batch_in_flight": snapshot["batch_in_flight"],
+            "queued": len(self._waiters),
+            "tokens": round(snapshot["tokens"], 2),
+            "rate": self.rate,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "overloads": self.overloads,
+        }
+
+    async def _acquire_concurrency(self, deadline: float) -> None:
+        client = current_client.get()
+        batch = client is not None and client.batch
+        if not self._waiters and self._try_acquire_slot(batch):
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("GLM等待队列已满")
+
+        waiter = self._waiters.push(asyncio.get_running_loop().create_future(), client)
+        try:
+            # 按进程内的公平顺序，只有轮到的请求检查全局名额
+            while not (self._is_turn(waiter) and self._try_acquire_slot(batch)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._reject("等待GLM并发名额超时")
+                await asyncio.sleep(min(self.poll_interval, remaining))
+        finally:
+            self._waiters.remove(waiter)
+
+    def _is_turn(self, waiter) -> bool:
+        """队首请求；队首是批量请求时（可能受份额限制），排在最前的交互请求也可以检查"""
+        head = self._waiters.head()
+        if head is waiter:
+            return True
+        return head is not None and head.batch and not waiter.batch and self._waiters.head(allow_batch=False) is waiter
+
+    def _try_acquire_slot(self, batch: bool) -> bool:
+        if not self.state.try_acquire(batch, self.batch_share):
+            return False
+        self._admit(batch)
+        return True
+
+    async def _acquire_token(self, deadline: float) -> None:
+        wait = self.state.reserve_token(self.rate, self.burst, deadline - time.monotonic())
+        if wait is None:
+            self._reject("GLM请求速率超限")
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _wake_waiters(self) -> None:
+        # 队首请求自行轮询全局名额
+        pass
+
+
+def create_upstream_limiter(
+    rate: Optional[float] = None,
+    burst: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    name: str = "default",
+) -> AdaptiveLimiter:
+    """根据环境变量创建 GLM 调用限流器（参数可按后端覆盖）
+
+    设置 SHARED_STATE_DIR 时各工作进程共享同名后端的限流状态。
+    """
+    options = dict(
+        rate=rate if rate is not None else float(os.getenv("GLM_RATE_LIMIT_QPS", 10)),
+        burst=burst if burst is not None else int(os.getenv("GLM_RATE_LIMIT_BURST", 20)),
+        max_concurrency=max_concurrency if max_concurrency is not None else int(os.getenv("GLM_MAX_IN_FLIGHT", 32)),
+        min_concurrency=int(os.getenv("GLM_MIN_IN_FLIGHT", 1)),
+        max_queue=int(os.getenv("GLM_MAX_QUEUE", 100)),
+        max_wait=float(os.getenv("GLM_MAX_QUEUE_WAIT", 10)),
+        batch_share=float(os.getenv("GLM_BATCH_MAX_SHARE", 0.75)),
+    )
+    path = shared_state_path(f"limiter-{name}.bin")
+    if path is None:
+        return AdaptiveLimiter(**options)
+    state = SharedLimiterState(path, burst=options["burst"], max_concurrency=options["max_concurrency"])
+    return SharedAdaptiveLimiter(state, **options)
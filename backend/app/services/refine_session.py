@@ -0,0 +1,267 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services.shared_state import shared_state_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RefineSession:
+    """服务端保存的微调会话：当前文本（按行）和历次微调指令"""
+    session_id: str
+    lines: List[str]
+    instructions: List[str] = field(default_factory=list)
+    version: int = 0
+    expires_at: float = 0.0
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+def split_lines(text: str) -> List[str]:
+    return text.split("\n") if text else []
+
+
+def diff_lines(old: List[str], new: List[str], offset: int = 0) -> List[Dict[str, Any]]:
+    """计算行级差异，返回按顺序应用即可得到新文本的变更块
+
+    每个变更块为 {"start": i, "end": j, "lines": [...]}：用 lines 替换旧文本中 [start, end) 行
+    （0 起始、左闭右开，均相对变更前的完整文本）；start == end 表示插入，lines 为空表示删除。
+    """
+    hunks = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        hunks.append({"start": i1 + offset, "end": i2 + offset, "lines": new[j1:j2]})
+    return hunks
+
+
+class RefineSessionStore:
+    """进程内微调会话存储（LRU + 空闲过期），只适用于单工作进程或按会话粘性路由的部署"""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 3600.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, RefineSession]" = OrderedDict()
+        # 会话 -> 本进程内的微调锁，没有请求持有时自动释放
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self.created = 0
+        self.evictions = 0
+        self.conflicts = 0
+
+    def lock(self, session_id: str) -> asyncio.Lock:
+        """同一会话在本进程内的微调按顺序执行"""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    async def create(self, text: str) -> RefineSession:
+        session = self._new_session(text)
+        self._sessions[session.session_id] = session
+        self.created += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[RefineSession]:
+        """查询会话并续期，过期会话视为不存在"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.time()
+        if session.expires_at <= now:
+            del self._sessions[session_id]
+            return None
+        session.expires_at = now + self.ttl
+        self._sessions.move_to_end(session_id)
+        return session
+
+    async def update(self, session: RefineSession, lines: List[str], instruction: str) -> bool:
+        """保存一次微调的结果并递增版本号；会话已被删除时返回 False"""
+        if self._sessions.get(session.session_id) is not session:
+            self.conflicts += 1
+            return False
+        session.lines = lines
+        session.instructions.append(instruction)
+        session.version += 1
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "created": self.created,
+            "evictions": self.evictions,
+            "conflicts": self.conflicts,
+            "shared": False,
+        }
+
+    def _new_session(self, text: str) -> RefineSession:
+        return RefineSession(
+            session_id=uuid.uuid4().hex,
+            lines=split_lines(text),
+            expires_at=time.time() + self.ttl,
+        )
+
+
+class SharedRefineSessionStore(RefineSessionStore):
+    """保存在 SQLite（WAL）中的微调会话，多个工作进程共享（SHARED_STATE_DIR）
+
+    每次请求都从数据库读取最新版本；保存时按版本号条件更新，
+    其他工作进程已先保存了同一会话的微调时返回 False（由接口返回 409）。
+    """
+
+    def __init__(self, path: str, max_sessions: int = 1000, ttl: float = 3600.0):
+        super().__init__(max_sessions=max_sessions, ttl=ttl)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._db_lock = threading.Lock()
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS refine_sessions ("
+                "session_id TEXT PRIMARY KEY, lines TEXT NOT NULL, instructions TEXT NOT NULL, "
+                "version INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS refine_sessions_expires ON refine_sessions (expires_at)")
+            self._db.execute("DELETE FROM refine_sessions WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        logger.info(f"Refine sessions shared via {path}")
+
+    async def create(self, text: str) -> RefineSession:
+        session = self._new_session(text)
+        await asyncio.to_thread(self._db_create, session)
+        self.created += 1
+        return session
+
+    async def get(self, session_id: str) -> Optional[RefineSession]:
+        return await asyncio.to_thread(self._db_get, session_id)
+
+    async def update(self, session: RefineSession, lines: List[str], instruction: str) -> bool:
+        instructions = session.instructions + [instruction]
+        if not await asyncio.to_thread(self._db_update, session, lines, instructions):
+            self.conflicts += 1
+            return False
+        session.lines = lines
+        session.instructions = instructions
+        session.version += 1
+        return True
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self._db_delete, session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._db_lock:
+            sessions = self._db.execute(
+                "SELECT COUNT(*) FROM refine_sessions WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {
+            "sessions": sessions,
+            "created": self.created,
+            "evictions": self.evictions,
+            "conflicts": self.conflicts,
+            "shared": True,
+        }
+
+    def _db_create(self, session: RefineSession) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT INTO refine_sessions (session_id, lines, instructions, version, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (session.session_id, json.dumps(session.lines, ensure_ascii=False), "[]", session.version, session.expires_at),
+            )
+            # 清理过期会话，并按最近使用时间淘汰超出上限的会话
+            self._db.execute("DELETE FROM refine_sessions WHERE expires_at <= ?", (time.time(),))
+            evicted = self._db.execute(
+                "DELETE FROM refine_sessions WHERE session_id IN ("
+                "SELECT session_id FROM refine_sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_sessions,),
+            ).rowcount
+            self._db.commit()
+        self.evictions += max(evicted, 0)
+
+    def _db_get(self, session_id: str) -> Optional[RefineSession]:
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT lines, instructions, version FROM refine_sessions WHERE session_id = ? AND expires_at > ?",
+                (session_id, now),
+            ).fetchone()
+            if row is None:
+                return None
+            # 续期
+            self._db.execute(
+                "UPDATE refine_sessions SET expires_at = ? WHERE session_id = ?", (now + self.ttl, session_id)
+            )
+            self._db.commit()
+        lines, instructions, version = row
+        return RefineSession(
+            session_id=session_id,
+            lines=json.loads(lines),
+            instructions=json.loads(instructions),
+            version=version,
+            expires_at=now + self.ttl,
+        )
+
+    def _db_update(self, session: RefineSession, lines: List[str], instructions: List[str]) -> bool:
+        with self._db_lock:
+            updated = self._db.execute(
+                "UPDATE refine_sessions SET lines = ?, instructions = ?, version = ?, expires_at = ? "
+                "WHERE session_id = ? AND version = ? AND expires_at > ?",
+                (
+                    json.dumps(lines, ensure_ascii=False), json.dumps(instructions, ensure_ascii=False),
+                    session.version + 1, time.time() + self.ttl, session.session_id, session.version, time.time(),
+                ),
+            ).rowcount
+            self._db.commit()
+        return updated == 1
+
+    def _db_delete(self, session_id: str) -> bool:
+        with self._db_lock:
+            deleted = self._db.execute(
+                "DELETE FROM refine_sessions WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+            ).rowcount
+            self._db.commit()
+        return deleted == 1
+
+
+def resolve_line_range(
+    line_count: int,
+    start_line: Optional[int],
+    end_line: Optional[int],
+) -> Tuple[int, int]:
+    """将 1 起始、闭区间的行号范围转换为切片下标，未指定时为全文"""
+    start = (start_line or 1) - 1
+    end = end_line if end_line is not None else line_count
+    if start < 0 or end > line_count or start >= end:
+        raise ValueError(f"行号范围无效（共 {line_count} 行）")
+    return start, end
+
+
+def create_refine_session_store() -> RefineSessionStore:
+    """根据环境变量创建微调会话存储：设置了 SHARED_STATE_DIR 时保存在其中的共享数据库，否则保存在进程内"""
+    max_sessions = int(os.getenv("REFINE_MAX_SESSIONS", 1000))
+    ttl = float(os.getenv("REFINE_SESSION_TTL", 3600))
+    path = shared_state_path("refine_sessions.db")
+    if path is not None:
+        return SharedRefineSessionStore(path, max_sessions=max_sessions, ttl=ttl)
+    return RefineSessionStore(max_sessions=max_sessions, ttl=ttl)
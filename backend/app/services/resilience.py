@@ -0,0 +1,256 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from app.services.glm_client import GLMAPIError
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.utils.stats import percentile
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 可重试的上游 HTTP 状态码
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(UpstreamOverloadedError):
+    """熔断器打开期间快速失败"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("上游服务暂时不可用，请稍后重试", retry_after=retry_after)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """超时、连接错误和 429/5xx 可重试；参数错误、鉴权失败和本地限流不重试"""
+    if not isinstance(error, GLMAPIError):
+        return False
+    return error.timeout or error.status_code is None or error.status_code in RETRYABLE_STATUS_CODES
+
+
+class CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却后放行少量探测请求（半开），探测成功则恢复"""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        half_open_max_calls: int = 1,
+        name: str = "GLM",
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.rejected = 0
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            remaining = self.opened_at + self.recovery_timeout - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpenError(retry_after=remaining)
+            self.state = "half_open"
+            self.half_open_calls = 0
+        if self.state == "half_open":
+            if self.half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpenError(retry_after=1.0)
+            self.half_open_calls += 1
+
+    def available(self) -> bool:
+        """当前是否允许发起调用（不改变状态）：关闭、冷却已结束或半开状态仍有探测名额"""
+        if self.state == "open":
+            return self.open_remaining() <= 0
+        if self.state == "half_open":
+            return self.half_open_calls < self.half_open_max_calls
+        return True
+
+    def trip(self) -> None:
+        """立即熔断（如 API Key 失效），冷却后同样放行探测请求"""
+        if self.state != "open":
+            logger.warning(f"{self.name}熔断器立即打开，{self.recovery_timeout}s 后探测")
+        self.state = "open"
+        self.opened_at = time.monotonic()
+
+    def open_remaining(self) -> float:
+        """熔断打开时距离允许探测的剩余秒数，未熔断时为 0"""
+        if self.state != "open":
+            return 0.0
+        return max(self.opened_at + self.recovery_timeout - time.monotonic(), 0.0)
+
+    def release_probe(self) -> None:
+        """半开状态下的探测请求未得到结论（被取消或本地拒绝），归还探测名额"""
+        if self.state == "half_open" and self.half_open_calls > 0:
+            self.half_open_calls -= 1
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            logger.info(f"{self.name}熔断器恢复关闭")
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"{self.name}连续失败 {self.consecutive_failures} 次，熔断 {self.recovery_timeout}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class ResilientCaller:
+    """上游调用的韧性层：总超时、分类重试（指数退避 + 抖动）、对冲请求和熔断"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        total_timeout: Optional[float] = 300.0,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95.0,
+        hedge_min_samples: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.total_timeout = total_timeout
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+
+    async def call(self, fn: Callable[[], Awaitable[T]], hedge: bool = False) -> T:
+        """执行上游调用；hedge=True 时（仅限幂等的非流式调用）允许发起对冲请求，
+        且只有这类调用的耗时会计入对冲延迟统计"""
+        try:
+            return await asyncio.wait_for(self._call_with_retries(fn, hedge), timeout=self.total_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise GLMAPIError(f"GLM request exceeded total timeout {self.total_timeout}s", timeout=True)
+
+    def hedge_delay(self) -> Optional[float]:
+        """对冲触发延迟：最近成功调用延迟的 p95，样本不足时返回 None"""
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        return percentile(sorted(self._latencies), self.hedge_percentile)
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.hedge_delay()
+        return {
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "total_timeouts": self.timeouts,
+            "hedge_delay": round(delay, 3) if delay is not None else None,
+            "circuit_state": self.breaker.state,
+            "circuit_rejected": self.breaker.rejected,
+            "consecutive_failures": self.breaker.consecutive_failures,
+        }
+
+    async def _call_with_retries(self, fn: Callable[[], Awaitable[T]], hedge: bool) -> T:
+        for attempt in range(self.max_attempts):
+            self.breaker.before_call()
+            try:
+                if hedge and self.hedge_enabled:
+                    result = await self._hedged(fn)
+                else:
+                    result = await self._timed(fn, record=hedge)
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    if isinstance(e, GLMAPIError):
+                        # 上游正常返回了错误（如参数错误），说明服务本身可用
+                        self.breaker.record_success()
+                    else:
+                        self.breaker.release_probe()
+                    raise
+                # 429 表示限流而非故障，不计入熔断
+                if e.status_code != 429:
+                    self.breaker.record_failure()
+                if attempt + 1 >= self.max_attempts:
+                    raise
+                # 指数退避 + 完全抖动
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                self.retries += 1
+                logger.warning(f"GLM调用失败，{delay:.2f}s 后重试 ({attempt + 1}/{self.max_attempts - 1}): {e}")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+        raise AssertionError("unreachable")
+
+    async def _timed(self, fn: Callable[[], Awaitable[T]], record: bool = True) -> T:
+        self.attempts += 1
+        start = time.monotonic()
+        result = await fn()
+        if record:
+            self._latencies.append(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[T]]) -> T:
+        """主请求超过 p95 延迟仍未返回时发起副本请求，取先成功的结果"""
+        primary = asyncio.ensure_future(self._timed(fn))
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    self.hedges += 1
+                    tasks.append(asyncio.ensure_future(self._timed(fn)))
+
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+
+def create_resilient_caller() -> ResilientCaller:
+    """根据环境变量创建韧性层"""
+    total_timeout = float(os.getenv("GLM_TOTAL_TIMEOUT", 300))
+    return ResilientCaller(
+        max_attempts=int(os.getenv("GLM_MAX_RETRIES", 2)) + 1,
+        base_delay=float(os.getenv("GLM_RETRY_BASE_DELAY", 0.5)),
+        max_delay=float(os.getenv("GLM_RETRY_MAX_DELAY", 8)),
+        total_timeout=total_timeout if total_timeout > 0 else None,
+        hedge_enabled=os.getenv("GLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes"),
+        hedge_percentile=float(os.getenv("GLM_HEDGE_PERCENTILE", 95)),
+        hedge_min_samples=int(os.getenv("GLM_HEDGE_MIN_SAMPLES", 20)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("GLM_CIRCUIT_FAILURE_THRESHOLD", 5)),
+            recovery_timeout=float(os.getenv("GLM_CIRCUIT_RECOVERY_TIMEOUT", 30)),
+        ),
+    )
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.shared_state import shared_state_path
+
+logger = logging.getLogger(__name__)
+
+
+class RecognitionCache:
+    """识别结果缓存：进程内 LRU（TTL + 容量淘汰）+ 可选 SQLite 磁盘层
+
+    磁盘层使用 WAL 模式，可由多个工作进程同时读写，作为进程间共享的缓存。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        disk_path: Optional[str] = None,
+        disk_max_entries: int = 100000,
+    ):
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (value, expires_at, size)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._disk_writes = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @staticmethod
+    def make_key(image_hash: str, prompt: str, model: str, thinking: str) -> str:
+        """由图片 SHA-256、实际提示词、模型和思考模式生成缓存键"""
+        material = json.dumps([image_hash, prompt, model, thinking], ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """查询缓存，内存未命中时回落到磁盘层并提升到内存"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return value
+            self._remove(key)
+            self.expirations += 1
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                value, expires_at = row
+                self._store(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """写入缓存（同时写入磁盘层）"""
+        expires_at = time.time() + self.ttl
+        self._store(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中/未命中/淘汰计数"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "disk_enabled": self._db is not None,
+        }
+
+    def _store(self, key: str, value: str, expires_at: float) -> None:
+        size = len(value.encode('utf-8'))
+        # max_entries 为 0 时不使用内存层（只使用共享的磁盘层）
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, expires_at, size)
+        self._bytes += size
+
+        # 超出条目数或字节数上限时按 LRU 淘汰
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _open_disk(self, disk_path: str) -> None:
+        directory = os.path.dirname(disk_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 其他进程写入时最多等待 5 秒
+        self._db = sqlite3.connect(disk_path, check_same_thread=False, timeout=5)
+        with self._db_lock:
+            # WAL：读写互不阻塞，多个进程可同时读取；读取通过内存映射完成
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA mmap_size=268435456")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS recognition_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM recognition_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        logger.info(f"Recognition cache disk tier: {disk_path}")
+
+    def _disk_get(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM recognition_cache WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+        return row
+
+    def _disk_set(self, key: str, value: str, expires_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO recognition_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._disk_writes += 1
+            # 每 100 次写入清理一次过期条目，并按过期时间淘汰超出上限的最旧条目
+            if self._disk_writes % 100 == 0:
+                self._db.execute("DELETE FROM recognition_cache WHERE expires_at <= ?", (time.time(),))
+                self._db.execute(
+                    "DELETE FROM recognition_cache WHERE key IN ("
+                    "SELECT key FROM recognition_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+            self._db.commit()
+
+
+def create_recognition_cache() -> Optional[RecognitionCache]:
+    """根据环境变量创建识别结果缓存，RECOGNITION_CACHE_ENABLED=false 时返回 None"""
+    if os.getenv("RECOGNITION_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    return RecognitionCache(
+        max_entries=int(os.getenv("RECOGNITION_CACHE_MAX_ENTRIES", 1024)),
+        max_bytes=int(os.getenv("RECOGNITION_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+        ttl=float(os.getenv("RECOGNITION_CACHE_TTL", 24 * 3600)),
+        # 未单独指定磁盘层路径时，设置了 SHARED_STATE_DIR 则使用其中的共享数据库
+        disk_path=os.getenv("RECOGNITION_CACHE_DB") or shared_state_path("recognition_cache.db"),
+        disk_max_entries=int(os.getenv("RECOGNITION_CACHE_DB_MAX_ENTRIES", 100000)),
+    )
@@ -0,0 +1,198 @@
+import os
+import re
+import mmap
+import time
+import struct
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"UBLIMIT2"
+# 魔数、令牌数、上次补充时间、并发上限（AIMD）、上次下调时间
+HEADER = struct.Struct("<8sdddd")
+# 每个工作进程一个槽位：进程号、在途请求数、其中批量流量的在途数
+SLOT = struct.Struct("<qqq")
+MAX_WORKERS = 64
+# 清理已退出进程槽位的最小间隔（秒）
+LIVENESS_INTERVAL = 1.0
+
+
+def shared_state_dir() -> Optional[str]:
+    """跨工作进程共享状态（识别缓存、限流器）的目录，SHARED_STATE_DIR 为空时各进程独立"""
+    return os.getenv("SHARED_STATE_DIR") or None
+
+
+def shared_state_path(name: str) -> Optional[str]:
+    directory = shared_state_dir()
+    if directory is None:
+        return None
+    return os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", name))
+
+
+def batch_capacity(limit: float, share: float) -> int:
+    """批量流量最多占用的并发名额（至少 1 个，保证批量请求不会饿死）"""
+    return max(1, int(int(limit) * share))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedLimiterState:
+    """多个工作进程共享的限流状态：内存映射文件 + 文件锁
+
+    令牌桶、AIMD 并发上限和各进程的在途请求数都保存在同一个小文件中，每次读写在 flock 保护下完成
+    （只涉及几十字节，持锁时间为微秒级）。进程异常退出时其槽位的在途数在下次检查时清零。
+    """
+
+    def __init__(self, path: str, burst: int, max_concurrency: int):
+        if fcntl is None:
+            raise RuntimeError("shared limiter state requires fcntl (POSIX)")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.pid = os.getpid()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._size = HEADER.size + SLOT.size * MAX_WORKERS
+        self._last_sweep = 0.0
+        with self._locked():
+            if os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+            self._mmap = mmap.mmap(self._fd, self._size)
+            if HEADER.unpack_from(self._mmap, 0)[0] != MAGIC:
+                self._mmap[:] = bytes(self._size)
+                self._write_header(float(burst), time.time(), float(max_concurrency), 0.0)
+            else:
+                # 沿用其他进程的状态，配置调小时按新配置截断
+                tokens, last_refill, limit, last_decrease = self._header()
+                self._write_header(min(tokens, burst), last_refill, min(limit, max_concurrency), last_decrease)
+            self._slot = self._claim_slot()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _slot_offset(self, index: int) -> int:
+        return HEADER.size + SLOT.size * index
+
+    def _claim_slot(self) -> int:
+        """占用一个槽位：优先使用本进程号（进程号被复用时清零旧计数），其次是空槽位或已退出进程的槽位"""
+        free = None
+        for index in range(MAX_WORKERS):
+            pid = SLOT.unpack_from(self._mmap, self._slot_offset(index))[0]
+            if pid == self.pid:
+                free = index
+                break
+            if free is None and (pid == 0 or not _pid_alive(pid)):
+                free = index
+        if free is None:
+            raise RuntimeError(f"shared limiter state supports at most {MAX_WORKERS} workers")
+        SLOT.pack_into(self._mmap, self._slot_offset(free), self.pid, 0, 0)
+        return free
+
+    def _header(self):
+        _, tokens, last_refill, limit, last_decrease = HEADER.unpack_from(self._mmap, 0)
+        return tokens, last_refill, limit, last_decrease
+
+    def _write_header(self, tokens: float, last_refill: float, limit: float, last_decrease: float) -> None:
+        HEADER.pack_into(self._mmap, 0, MAGIC, tokens, last_refill, limit, last_decrease)
+
+    def _total_in_flight(self) -> Tuple[int, int]:
+        """全局在途数和其中批量流量的在途数"""
+        now = time.monotonic()
+        sweep = now - self._last_sweep >= LIVENESS_INTERVAL
+        if sweep:
+            self._last_sweep = now
+        total = batch = 0
+        for index in range(MAX_WORKERS):
+            offset = self._slot_offset(index)
+            pid, in_flight, batch_in_flight = SLOT.unpack_from(self._mmap, offset)
+            if pid == 0:
+                continue
+            if sweep and pid != self.pid and not _pid_alive(pid):
+                SLOT.pack_into(self._mmap, offset, 0, 0, 0)
+                continue
+            total += in_flight
+            batch += batch_in_flight
+        return total, batch
+
+    def try_acquire(self, batch: bool = False, batch_share: float = 1.0) -> bool:
+        """全局在途数低于并发上限（批量流量还需低于其份额）时占用一个名额"""
+        with self._locked():
+            limit = self._header()[2]
+            total, batch_total = self._total_in_flight()
+            if total >= int(limit):
+                return False
+            if batch and batch_share < 1 and batch_total >= batch_capacity(limit, batch_share):
+                return False
+            offset = self._slot_offset(self._slot)
+            _, in_flight, batch_in_flight = SLOT.unpack_from(self._mmap, offset)
+            SLOT.pack_into(self._mmap, offset, self.pid, in_flight + 1, batch_in_flight + int(batch))
+            return True
+
+    def release(self, batch: bool = False) -> None:
+        with self._locked():
+            offset = self._slot_offset(self._slot)
+            _, in_flight, batch_in_flight = SLOT.unpack_from(self._mmap, offset)
+            SLOT.pack_into(self._mmap, offset, self.pid, max(in_flight - 1, 0), max(batch_in_flight - int(batch), 0))
+
+    def reserve_token(self, rate: float, burst: int, max_wait: float) -> Optional[float]:
+        """预约一个令牌，返回需要等待的秒数；等待超过 max_wait 时不预约并返回 None"""
+        with self._locked():
+            tokens, last_refill, limit, last_decrease = self._header()
+            now = time.time()
+            tokens = min(burst, tokens + max(now - last_refill, 0) * rate) - 1
+            wait = -tokens / rate if tokens < 0 else 0.0
+            if wait > max_wait:
+                tokens += 1
+            self._write_header(tokens, now, limit, last_decrease)
+            return None if wait > max_wait else wait
+
+    def increase_limit(self, max_concurrency: int) -> float:
+        """加性增长，返回新的全局并发上限"""
+        with self._locked():
+            tokens, last_refill, limit, last_decrease = self._header()
+            if limit < max_concurrency:
+                limit = min(max_concurrency, limit + 1 / limit)
+                self._write_header(tokens, last_refill, limit, last_decrease)
+            return limit
+
+    def decrease_limit(self, min_concurrency: int, cooldown: float) -> Optional[float]:
+        """乘性减半，返回新的全局并发上限；冷却期内（可能由其他进程刚下调过）返回 None"""
+        with self._locked():
+            tokens, last_refill, limit, last_decrease = self._header()
+            now = time.time()
+            if now - last_decrease < cooldown:
+                return None
+            limit = max(min_concurrency, limit / 2)
+            self._write_header(tokens, last_refill, limit, now)
+            return limit
+
+    def snapshot(self, rate: float, burst: int) -> Dict[str, Any]:
+        with self._locked():
+            tokens, last_refill, limit, _ = self._header()
+            in_flight, batch_in_flight = self._total_in_flight()
+            return {
+                "limit": limit,
+                "tokens": min(burst, tokens + max(time.time() - last_refill, 0) * rate),
+                "in_flight": in_flight,
+                "batch_in_flight": batch_in_flight,
+            }
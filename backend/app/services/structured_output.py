@@ -0,0 +1,213 @@
+import re
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 坐标按图片宽高归一化到 0-1000（与 GLM-4.5V 的定位输出一致），与图片分辨率无关
+COORDINATE_SCALE = 1000
+# 缓存中结构化结果的格式版本
+FORMAT_VERSION = 1
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = """
+
+请按以下格式输出识别结果：JSON 数组，每一行文字对应一个对象，按从上到下、从左到右的阅读顺序排列：
+[{"text": "该行文字", "bbox": [x1, y1, x2, y2], "confidence": 0.95}]
+- bbox 为该行文字的外接矩形，左上角 (x1, y1)、右下角 (x2, y2)，坐标按图片宽高归一化到 0-1000 的整数
+- confidence 为你对该行识别结果准确程度的估计，取值 0 到 1，模糊或靠推测补全的文字应给出较低的值
+- 只输出 JSON 数组，不要添加任何解释或说明"""
+
+BOX_MARKERS = ("<|begin_of_box|>", "<|end_of_box|>")
+CODE_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class RecognizedLine:
+    """一行识别结果：文字、归一化外接矩形 (x1, y1, x2, y2) 和模型给出的置信度"""
+    text: str
+    box: Optional[Tuple[int, int, int, int]] = None
+    confidence: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {"text": self.text, "box": list(self.box) if self.box else None, "confidence": self.confidence}
+
+
+def _parse_box(value: Any) -> Optional[Tuple[int, int, int, int]]:
+    # 兼容 [[x1, y1, x2, y2]] 这类多套一层的输出
+    if isinstance(value, list) and len(value) == 1 and isinstance(value[0], list):
+        value = value[0]
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        return None
+    try:
+        x1, y1, x2, y2 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        return None
+    # 0-1 的小数坐标按比例换算
+    if max(x1, y1, x2, y2) <= 1:
+        x1, y1, x2, y2 = (v * COORDINATE_SCALE for v in (x1, y1, x2, y2))
+    clamp = lambda v: int(round(min(max(v, 0), COORDINATE_SCALE)))
+    x1, x2 = sorted((clamp(x1), clamp(x2)))
+    y1, y2 = sorted((clamp(y1), clamp(y2)))
+    return x1, y1, x2, y2
+
+
+def _parse_confidence(value: Any) -> Optional[float]:
+    try:
+        confidence = float(value)
+    except (TypeError, ValueError):
+        return None
+    # 兼容百分数
+    if confidence > 1:
+        confidence /= 100
+    return round(min(max(confidence, 0.0), 1.0), 2)
+
+
+def _line_from_object(item: Any) -> Optional[RecognizedLine]:
+    if isinstance(item, str):
+        return RecognizedLine(text=item.strip()) if item.strip() else None
+    if not isinstance(item, dict):
+        return None
+    text = item.get("text", item.get("content"))
+    if not isinstance(text, str) or not text.strip():
+        return None
+    box = next((_parse_box(item[key]) for key in ("bbox", "bbox_2d", "box") if key in item), None)
+    return RecognizedLine(text=text.strip(), box=box, confidence=_parse_confidence(item.get("confidence")))
+
+
+def _json_objects(text: str) -> Iterable[Tuple[int, int]]:
+    """按括号配对查找顶层 JSON 对象（跳过字符串内的括号），返回 (起始, 结束) 位置，用于数组不完整或格式有误的输出"""
+    depth = 0
+    start = None
+    in_string = escaped = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"' and depth > 0:
+            in_string = True
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield start, index + 1
+
+
+def parse_structured_output(raw: str) -> List[RecognizedLine]:
+    """解析模型输出的逐行结构化结果
+
+    依次尝试：完整 JSON 数组 -> 逐个提取 JSON 对象 -> 按纯文本逐行处理（无坐标和置信度），
+    因此模型未按格式输出时仍能得到文字内容。
+    """
+    if not raw:
+        return []
+    text = raw
+    for marker in BOX_MARKERS:
+        text = text.replace(marker, "")
+    text = CODE_FENCE.sub("", text.strip())
+
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            items = json.loads(text[start:end + 1])
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list):
+            lines = [line for line in map(_line_from_object, items) if line is not None]
+            if lines:
+                return lines
+
+    lines = []
+    for start, end in _json_objects(text):
+        try:
+            line = _line_from_object(json.loads(text[start:end]))
+        except json.JSONDecodeError:
+            continue
+        if line is not None:
+            lines.append(line)
+    if lines:
+        return lines
+
+    logger.warning("结构化输出解析失败，按纯文本逐行处理")
+    return [RecognizedLine(text=line.strip()) for line in text.split("\n") if line.strip()]
+
+
+class StructuredLineStream:
+    """流式输出的增量解析：每当一个完整的行对象到达时返回该行"""
+
+    def __init__(self):
+        self._buffer = ""
+        # 已解析部分的结束位置，之后只扫描新到达的内容
+        self._position = 0
+
+    def feed(self, delta: str) -> List[RecognizedLine]:
+        self._buffer += delta
+        pending = self._buffer[self._position:]
+        lines = []
+        consumed = 0
+        for start, end in _json_objects(pending):
+            consumed = end
+            try:
+                line = _line_from_object(json.loads(pending[start:end]))
+            except json.JSONDecodeError:
+                line = None
+            if line is not None:
+                lines.append(line)
+        self._position += consumed
+        return lines
+
+    def finish(self) -> List[RecognizedLine]:
+        """完整输出的解析结果（以此为准，流式过程中返回的行只用于提前展示）"""
+        return parse_structured_output(self._buffer)
+
+
+def lines_to_text(lines: Sequence[RecognizedLine]) -> str:
+    return "\n".join(line.text for line in lines)
+
+
+def encode_lines(lines: Sequence[RecognizedLine]) -> str:
+    """紧凑的缓存格式：{"v": 1, "l": [[文字, [x1, y1, x2, y2] | null, 置信度 | null], ...]}，通常只比纯文字多 20-30 字节 / 行"""
+    payload = {"v": FORMAT_VERSION, "l": [[line.text, list(line.box) if line.box else None, line.confidence] for line in lines]}
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_lines(value: str) -> List[RecognizedLine]:
+    """解析 encode_lines 的输出；不是结构化结果（如普通识别文字）时抛出 ValueError"""
+    payload = json.loads(value)
+    if not isinstance(payload, dict) or payload.get("v") != FORMAT_VERSION:
+        raise ValueError("not a structured recognition result")
+    return [RecognizedLine(text=text, box=tuple(box) if box else None, confidence=confidence) for text, box, confidence in payload["l"]]
+
+
+def select_region(lines: Sequence[RecognizedLine], region: Sequence[int]) -> List[RecognizedLine]:
+    """返回中心点落在区域 (x1, y1, x2, y2)（归一化坐标）内的行；没有坐标的行不参与区域选择"""
+    x1, y1, x2, y2 = region
+    selected = []
+    for line in lines:
+        if line.box is None:
+            continue
+        cx = (line.box[0] + line.box[2]) / 2
+        cy = (line.box[1] + line.box[3]) / 2
+        if x1 <= cx <= x2 and y1 <= cy <= y2:
+            selected.append(line)
+    return selected
+
+
+def parse_region(value: str) -> Tuple[int, int, int, int]:
+    """解析 "x1,y1,x2,y2" 格式的区域参数"""
+    try:
+        box = _parse_box([float(part) for part in value.split(",")])
+    except ValueError:
+        box = None
+    if box is None:
+        raise ValueError("region 格式应为 x1,y1,x2,y2（0-1000 归一化坐标）")
+    return box
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.client_quota import record_client_upstream
+from app.services.glm_client import GLMAPIError, create_glm_client
+from app.services.rate_limiter import AdaptiveLimiter, create_upstream_limiter
+from app.services.resilience import CircuitBreaker, CircuitOpenError, is_retryable
+from app.utils.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "glm-4.5v"
+# 默认分组处理所有请求；fast 分组（如关闭思考模式的模型）只处理默认提示词的小图识别
+DEFAULT_TIER = "default"
+FAST_TIER = "fast"
+
+# API Key 无效或无权限，直接摘除该后端
+AUTH_STATUS_CODES = (401, 403)
+
+
+@dataclass(frozen=True)
+class UpstreamRoute:
+    """请求路由到的后端分组，以及该分组使用的模型和思考模式（结果缓存键包含这两项）"""
+    tier: str
+    model: str
+    thinking: str
+
+
+class UpstreamBackend:
+    """一个上游后端（API Key + 接口地址 + 模型），拥有独立的限流器和健康状态"""
+
+    def __init__(
+        self,
+        name: str,
+        client: Any,
+        limiter: AdaptiveLimiter,
+        breaker: CircuitBreaker,
+        tier: str = DEFAULT_TIER,
+        model: str = DEFAULT_MODEL,
+        thinking: str = "enabled",
+        weight: float = 1.0,
+    ):
+        self.name = name
+        self.client = client
+        self.limiter = limiter
+        self.breaker = breaker
+        self.tier = tier
+        self.model = model
+        self.thinking = thinking
+        self.weight = max(weight, 0.01)
+
+        # 已分配到该后端、尚未完成的请求数（含在限流器中排队的请求）
+        self.outstanding = 0
+        # 成功调用耗时的指数加权平均（秒）
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+    @property
+    def state(self) -> str:
+        """healthy（正常）、ejected（已摘除，冷却中）或 probing（冷却结束，等待探测结果）"""
+        if self.breaker.state == "closed":
+            return "healthy"
+        return "ejected" if self.breaker.open_remaining() > 0 else "probing"
+
+    def record_success(self, elapsed: float) -> None:
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        self.breaker.record_success()
+
+    def record_error(self, error: BaseException) -> None:
+        """按错误类型更新健康状态，与 ResilientCaller 的熔断判断保持一致"""
+        if not isinstance(error, GLMAPIError):
+            self.breaker.release_probe()
+            return
+        was_open = self.breaker.state == "open"
+        if error.status_code in AUTH_STATUS_CODES:
+            self.failures += 1
+            logger.error(f"GLM后端 {self.name} 鉴权失败（{error.status_code}），暂时摘除")
+            self.breaker.trip()
+        elif is_retryable(error) and error.status_code != 429:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            # 参数错误或限流说明后端本身可用
+            self.breaker.record_success()
+        if self.breaker.state == "open" and not was_open:
+            self.ejections += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "tier": self.tier,
+            "model": self.model,
+            "thinking": self.thinking,
+            "weight": self.weight,
+            "state": self.state,
+            "retry_after": round(self.breaker.open_remaining(), 1),
+            "outstanding": self.outstanding,
+            "latency_ewma": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "limiter": self.limiter.stats(),
+        }
+
+
+class UpstreamPool:
+    """多个上游后端的负载均衡
+
+    - least_outstanding：选择未完成请求数 / 权重最小的后端
+    - latency：随机取两个后端，选择 (未完成请求数 + 1) × 平均耗时 / 权重较小的一个
+    连续失败的后端按熔断器摘除，冷却后放行一个探测请求，成功则重新加入。
+    """
+
+    def __init__(self, backends: List[UpstreamBackend], strategy: str = "least_outstanding"):
+        if not any(backend.tier == DEFAULT_TIER for backend in backends):
+            raise ValueError("at least one GLM backend in the default tier is required")
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"unknown GLM routing strategy: {strategy}")
+        self.backends = backends
+        self.strategy = strategy
+        self.tiers: Dict[str, List[UpstreamBackend]] = {}
+        for backend in backends:
+            self.tiers.setdefault(backend.tier, []).append(backend)
+        # 模型和思考模式在选择后端之前就已确定（请求参数、思考模式选择和结果缓存键都按分组计算），
+        # 分组内不一致时部分后端的配置不会生效，因此直接拒绝；需要不同模型时应放到不同分组
+        for tier, members in self.tiers.items():
+            if len({(backend.model, backend.thinking) for backend in members}) > 1:
+                raise ValueError(f"GLM backends in tier {tier} must share the same model and thinking mode")
+
+    def route(self, cheap: bool = False) -> UpstreamRoute:
+        """cheap 请求优先使用 fast 分组（分组内没有可用后端时回退到默认分组）；分组内所有后端的模型和思考模式相同"""
+        tier = FAST_TIER if cheap and self.available(FAST_TIER) else DEFAULT_TIER
+        first = self.tiers[tier][0]
+        return UpstreamRoute(tier=tier, model=first.model, thinking=first.thinking)
+
+    def available(self, tier: str = DEFAULT_TIER) -> bool:
+        return any(backend.breaker.available() for backend in self.tiers.get(tier, ()))
+
+    def saturated(self, tier: str = DEFAULT_TIER) -> bool:
+        """分组内所有后端的等待队列均已满"""
+        return all(backend.limiter.saturated for backend in self.tiers.get(tier, ()))
+
+    def select(self, tier: str = DEFAULT_TIER) -> UpstreamBackend:
+        """在分组内选择一个后端；全部被摘除时快速失败"""
+        members = self.tiers.get(tier) or self.tiers[DEFAULT_TIER]
+        candidates = [backend for backend in members if backend.breaker.available()]
+        if not candidates:
+            retry_after = min(backend.breaker.open_remaining() for backend in members)
+            raise CircuitOpenError(retry_after=max(retry_after, 1.0))
+        if len(candidates) == 1:
+            return candidates[0]
+        # 冷却结束的后端优先分配一个请求作为探测，成功后重新加入（失败时由重试转到其他后端）
+        for backend in candidates:
+            if backend.breaker.state != "closed":
+                return backend
+        if self.strategy == "latency" and len(candidates) > 2:
+            candidates = random.sample(candidates, 2)
+        sampled = [backend.latency for backend in candidates if backend.latency is not None]
+        # 尚无耗时数据的后端按已有后端的平均耗时估计，保证新加入的后端能分到流量
+        default_latency = sum(sampled) / len(sampled) if sampled else 1.0
+
+        def score(backend: UpstreamBackend) -> float:
+            value = (backend.outstanding + 1) / backend.weight
+            if self.strategy == "latency":
+                value *= backend.latency if backend.latency is not None else default_latency
+            # 近期连续失败（尚未达到摘除阈值）的后端降低优先级
+            return value * (1 + backend.breaker.consecutive_failures)
+
+        return min(candidates, key=lambda backend: (score(backend), random.random()))
+
+    @asynccontextmanager
+    async def lease(self, tier: str = DEFAULT_TIER) -> AsyncIterator[UpstreamBackend]:
+        """选择后端并获取其限流名额，退出时根据结果更新限流器和健康状态"""
+        backend = self.select(tier)
+        backend.breaker.before_call()
+        backend.outstanding += 1
+        try:
+            wait_start = time.perf_counter()
+            try:
+                await backend.limiter.acquire()
+            except BaseException:
+                backend.breaker.release_probe()
+                raise
+            waited = time.perf_counter() - wait_start
+            observe_stage("limiter_wait", waited)
+            record_client_upstream(waited)
+            backend.requests += 1
+            start = time.monotonic()
+            try:
+                yield backend
+            except BaseException as e:
+                if isinstance(e, GLMAPIError) and e.overloaded:
+                    backend.limiter.on_overload()
+                backend.record_error(e)
+                raise
+            else:
+                backend.limiter.on_success()
+                backend.record_success(time.monotonic() - start)
+            finally:
+                backend.limiter.release()
+        finally:
+            backend.outstanding -= 1
+
+    def limiter_stats(self) -> Dict[str, Any]:
+        """所有后端限流器的汇总（单个后端时与该限流器的统计一致）"""
+        totals: Dict[str, Any] = {}
+        for backend in self.backends:
+            for key, value in {**backend.limiter.stats(), "max_queue": backend.limiter.max_queue}.items():
+                totals[key] = round(totals.get(key, 0) + value, 2)
+        return totals
+
+    def summary(self) -> Dict[str, Any]:
+        """用于导出指标的汇总统计"""
+        states = [backend.state for backend in self.backends]
+        return {
+            "backends": len(self.backends),
+            "healthy": states.count("healthy"),
+            "ejected": states.count("ejected"),
+            "outstanding": sum(backend.outstanding for backend in self.backends),
+            "requests": sum(backend.requests for backend in self.backends),
+            "failures": sum(backend.failures for backend in self.backends),
+            "ejections": sum(backend.ejections for backend in self.backends),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "strategy": self.strategy,
+            **self.summary(),
+            "tiers": {tier: [backend.name for backend in members] for tier, members in self.tiers.items()},
+            "items": [backend.stats() for backend in self.backends],
+        }
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(backend.client.aclose() for backend in self.backends))
+
+
+def _backend_configs() -> List[Dict[str, Any]]:
+    """读取后端配置：GLM_BACKENDS（JSON 数组）> ZHIPUAI_API_KEYS（逗号分隔）> ZHIPUAI_API_KEY"""
+    raw = os.getenv("GLM_BACKENDS", "").strip()
+    if raw:
+        configs = json.loads(raw)
+        if not isinstance(configs, list) or not configs:
+            raise ValueError("GLM_BACKENDS must be a non-empty JSON array")
+        for index, config in enumerate(configs):
+            config.setdefault("name", f"backend-{index + 1}")
+            if not config.get("api_key") and config.get("api_key_env"):
+                config["api_key"] = os.getenv(config["api_key_env"])
+            if not config.get("api_key"):
+                raise ValueError(f"GLM backend {config['name']} has no api_key")
+        return configs
+
+    keys = [key.strip() for key in os.getenv("ZHIPUAI_API_KEYS", "").split(",") if key.strip()]
+    if keys:
+        return [{"name": f"key-{index + 1}", "api_key": key} for index, key in enumerate(keys)]
+
+    api_key = os.getenv("ZHIPUAI_API_KEY")
+    if not api_key:
+        raise ValueError("ZHIPUAI_API_KEY environment variable is required")
+    return [{"name": "default", "api_key": api_key}]
+
+
+def create_upstream_pool() -> UpstreamPool:
+    """根据环境变量创建上游后端池；未配置多个后端时只有一个默认后端，行为与单个 API Key 相同"""
+    backends = []
+    for config in _backend_configs():
+        # 限流参数默认取 GLM_RATE_LIMIT_* / GLM_MAX_IN_FLIGHT 等（按后端分别计算），可逐个覆盖
+        limiter = create_upstream_limiter(
+            rate=float(config["qps"]) if "qps" in config else None,
+            burst=int(config["burst"]) if "burst" in config else None,
+            max_concurrency=int(config["max_in_flight"]) if "max_in_flight" in config else None,
+            name=config["name"],
+        )
+        backends.append(UpstreamBackend(
+            name=config["name"],
+            client=create_glm_client(config["api_key"], config.get("base_url")),
+            limiter=limiter,
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("GLM_BACKEND_EJECT_FAILURES", 3)),
+                recovery_timeout=float(os.getenv("GLM_BACKEND_EJECT_SECONDS", 30)),
+                name=f"GLM后端 {config['name']} ",
+            ),
+            tier=config.get("tier", DEFAULT_TIER),
+            model=config.get("model", DEFAULT_MODEL),
+            thinking=config.get("thinking", "enabled"),
+            weight=float(config.get("weight", 1)),
+        ))
+    pool = UpstreamPool(backends, strategy=os.getenv("GLM_ROUTING_STRATEGY", "least_outstanding"))
+    if len(backends) > 1:
+        logger.info(f"GLM后端池: {len(backends)} 个后端，路由策略 {pool.strategy}")
+    return pool
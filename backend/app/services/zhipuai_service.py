@@ -1,40 +1,176 @@
 import os
+import json
+import time
+import asyncio
 import base64
-import httpx
-from zai import ZhipuAiClient
-from PIL import Image
-from io import BytesIO
-from typing import Optional
+import hashlib
+from dataclasses import dataclass, replace
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from app.services.client_quota import record_client_tokens
+from app.services.glm_client import GLMAPIError
+from app.services.image_difficulty import ThinkingConfig, ThinkingStats, estimate_difficulty
+from app.services.image_preprocess import PreprocessConfig, PreprocessStats, preprocess_image
+from app.services.image_tiling import TilingConfig, merge_grid_lines, merge_tile_texts, row_overlaps, should_tile, split_image
+from app.services.prompts import CallUsage, create_prompt_manager, record_call_usage, record_estimate, track_usage
+from app.services.perceptual_index import ImageFingerprint, create_perceptual_index, image_fingerprint
+from app.services.rate_limiter import UpstreamOverloadedError
+from app.services.resilience import create_resilient_caller
+from app.services.result_cache import RecognitionCache, create_recognition_cache
+from app.services.structured_output import (
+    STRUCTURED_OUTPUT_INSTRUCTIONS,
+    RecognizedLine,
+    StructuredLineStream,
+    decode_lines,
+    encode_lines,
+    lines_to_text,
+    parse_structured_output,
+)
+from app.services.upstream_pool import DEFAULT_TIER, UpstreamRoute, create_upstream_pool
+from app.utils.image_validation import MAX_IMAGE_SIZE, ValidatedImage
+from app.utils.logging_setup import redact_text
+from app.utils.metrics import record_token_usage, stage_timer
+from app.utils.singleflight import SingleFlight
+from app.utils.text_cleaning import StreamingTextCleaner
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class RecognitionResult:
+    """文字识别结果"""
+    text: str
+    cached: bool = False
+    # 结构化输出模式下的逐行结果；result_id 为结果缓存键，可用于后续查询
+    lines: Optional[List[RecognizedLine]] = None
+    result_id: Optional[str] = None
+    # 本次调用的 token 用量（CallUsage.to_dict()）
+    usage: Optional[Dict[str, int]] = None
+
+
 class ZhipuAIService:
     def __init__(self):
-        self.api_key = os.getenv("ZHIPUAI_API_KEY")
-        if not self.api_key:
-            raise ValueError("ZHIPUAI_API_KEY environment variable is required")
+        # 上游后端池（一个或多个 API Key / 接口地址 / 模型），每个后端有独立的限流器和健康状态
+        self.pool = create_upstream_pool()
+        self.model = self.pool.route().model
+        # 默认提示词且不超过该像素数 / 字节数的图片优先路由到 fast 分组
+        self.fast_max_pixels = int(os.getenv("GLM_FAST_TIER_MAX_PIXELS", 1048576))
+        self.fast_max_bytes = int(os.getenv("GLM_FAST_TIER_MAX_BYTES", 1048576))
+        # 按图片难度选择是否开启思考模式
+        self.thinking_config = ThinkingConfig.from_env()
+        self.thinking_stats = ThinkingStats()
+        # 超时、重试、对冲和熔断
+        self.resilience = create_resilient_caller()
+        self.cache = create_recognition_cache()
+        # 近似重复图片（重新编码、缩放、裁边）复用已缓存的识别结果，依赖结果缓存
+        self.near_duplicates = create_perceptual_index() if self.cache is not None else None
+        self.preprocess_config = PreprocessConfig.from_env()
+        self.preprocess_stats = PreprocessStats()
+        self.tiling_config = TilingConfig.from_env()
+        # 版本化的提示词模板、token 估计、输出长度上限和长文本分段
+        self.prompts = create_prompt_manager()
+        # 合并相同图片和提示词的并发识别请求
+        self.inflight: SingleFlight[str] = SingleFlight()
+    
+    async def aclose(self) -> None:
+        """关闭所有后端的 GLM 客户端连接池"""
+        await self.pool.aclose()
+    
+    @asynccontextmanager
+    async def upstream_errors(self) -> AsyncIterator[None]:
+        """将重试后仍然失败的上游过载错误（429/超时）转换为 UpstreamOverloadedError"""
+        try:
+            yield
+        except GLMAPIError as e:
+            if e.overloaded:
+                raise UpstreamOverloadedError() from e
+            raise
+    
+    async def create_completion(self, tier: str = DEFAULT_TIER, **payload: Any) -> Dict[str, Any]:
+        """异步调用 GLM chat/completions 接口（后端选择、限流、超时、重试、对冲和熔断）
+        
+        每次尝试（含重试和对冲）都会重新选择后端。
+        """
+        async def attempt() -> Dict[str, Any]:
+            async with self.pool.lease(tier) as backend:
+                with stage_timer("upstream"):
+                    return await backend.client.create_chat_completion(**payload)
         
-        self.client = ZhipuAiClient(api_key=self.api_key)
+        async with self.upstream_errors():
+            response = await self.resilience.call(attempt, hedge=True)
+        record_token_usage(payload.get("model", self.model), response.get("usage"))
+        record_client_tokens(response.get("usage"))
+        choices = response.get("choices") or [{}]
+        record_call_usage(response.get("usage"), payload.get("max_tokens"), choices[0].get("finish_reason"))
+        return response
+    
+    async def stream_completion(self, tier: str = DEFAULT_TIER, **payload: Any) -> AsyncIterator[Dict[str, Any]]:
+        """以流式模式调用 GLM，首个数据块到达前的失败会按策略重试（重试时重新选择后端）"""
+        async with self.upstream_errors():
+            with stage_timer("upstream"):
+                first_chunk, stream, lease = await self.resilience.call(lambda: self._open_stream(tier, payload))
+                # 后端限流名额一直持有到流结束，流中途出错同样计入该后端的健康状态
+                usage = finish_reason = None
+                async with lease:
+                    if first_chunk is not None:
+                        yield first_chunk
+                    async for chunk in stream:
+                        # 流式响应的 usage 通常出现在最后一个数据块
+                        record_token_usage(payload.get("model", self.model), chunk.get("usage"))
+                        record_client_tokens(chunk.get("usage"))
+                        usage = chunk.get("usage") or usage
+                        finish_reason = ((chunk.get("choices") or [{}])[0]).get("finish_reason") or finish_reason
+                        yield chunk
+                record_call_usage(usage, payload.get("max_tokens"), finish_reason)
+    
+    async def _open_stream(
+        self,
+        tier: str,
+        payload: Dict[str, Any]
+    ) -> Tuple[Optional[Dict[str, Any]], AsyncIterator[Dict[str, Any]], AsyncExitStack]:
+        """选择后端、建立流式连接并读取首个数据块；返回的 AsyncExitStack 负责关闭流并归还名额"""
+        lease = AsyncExitStack()
+        backend = await lease.enter_async_context(self.pool.lease(tier))
+        stream = backend.client.stream_chat_completion(**payload)
+        lease.push_async_callback(stream.aclose)
+        try:
+            first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            return None, stream, lease
+        except BaseException as e:
+            await lease.__aexit__(type(e), e, e.__traceback__)
+            raise
+        return first_chunk, stream, lease
     
     def image_to_base64(self, image_bytes: bytes) -> str:
         """将图片字节转换为base64编码"""
         return base64.b64encode(image_bytes).decode('utf-8')
     
-    def validate_image(self, image_bytes: bytes) -> bool:
-        """验证图片格式和大小"""
+    async def prepare_image(self, image: ValidatedImage) -> str:
+        """预处理图片以缩小上传体积，返回 data URL"""
+        with stage_timer("encode"):
+            return await self._prepare_image(image)
+    
+    async def _prepare_image(self, image: ValidatedImage) -> str:
+        if not self.preprocess_config.enabled:
+            image.release_pixels()
+            return image.data_url
+        
+        # 图片解码和编码是CPU密集操作，放到线程中执行；预处理是最后一个使用像素数据的阶段，之后即释放
         try:
-            image = Image.open(BytesIO(image_bytes))
-            # 检查图片格式
-            if image.format.lower() not in ['jpeg', 'jpg', 'png']:
-                return False
-            # 检查图片大小 (5MB限制)
-            if len(image_bytes) > 5 * 1024 * 1024:
-                return False
-            return True
-        except Exception as e:
-            logger.error(f"Image validation failed: {e}")
-            return False
+            prepared = await asyncio.to_thread(preprocess_image, image, self.preprocess_config)
+        finally:
+            image.release_pixels()
+        self.preprocess_stats.record(prepared)
+        logger.info(
+            f"图片预处理完成: {prepared.original_size} -> {len(prepared.data)} bytes "
+            f"({prepared.mime_type}, {prepared.width}x{prepared.height}), "
+            f"耗时 {prepared.elapsed * 1000:.1f}ms"
+        )
+        if prepared.data is image.data:
+            return image.data_url
+        return f"data:{prepared.mime_type};base64,{self.image_to_base64(prepared.data)}"
     
     def clean_response_text(self, text: str) -> str:
         """清理GLM-4.5V返回结果中的特殊标记"""
@@ -50,67 +186,393 @@ class ZhipuAIService:
         
         return '\n'.join(cleaned_lines)
     
-    async def recognize_text(self, image_bytes: bytes, custom_prompt: Optional[str] = None) -> str:
-        """使用GLM-4.5V识别图片中的文字"""
+    async def _recognition_params(
+        self,
+        image: ValidatedImage,
+        custom_prompt: Optional[str],
+        thinking: Optional[str] = None,
+        structured: bool = False
+    ) -> Tuple[str, UpstreamRoute, str]:
+        """确定识别使用的提示词、上游路由（模型和思考模式）和缓存键"""
+        # 使用自定义提示词或默认提示词
+        prompt = custom_prompt if custom_prompt else self.prompts.templates.recognition
+        # 结构化输出的提示词不同，缓存键也随之区分
+        if structured:
+            prompt += STRUCTURED_OUTPUT_INSTRUCTIONS
+        # 默认提示词的小图可以交给更快的 fast 分组（如关闭思考模式）处理
+        cheap = (
+            not custom_prompt
+            and image.width * image.height <= self.fast_max_pixels
+            and image.size <= self.fast_max_bytes
+        )
+        route = self.pool.route(cheap)
+        route = replace(route, thinking=await self._select_thinking(image, route, thinking))
+        cache_key = RecognitionCache.make_key(image.sha256, prompt, route.model, route.thinking)
+        return prompt, route, cache_key
+    
+    async def _select_thinking(self, image: ValidatedImage, route: UpstreamRoute, override: Optional[str]) -> str:
+        """确定思考模式：请求指定 > 按图片难度（auto，仅对默认开启思考的分组）> 分组配置"""
+        mode = override or self.thinking_config.mode
+        if mode in ("enabled", "disabled"):
+            self.thinking_stats.record_decision("override" if override else "default", mode)
+            return mode
+        if route.thinking != "enabled":
+            self.thinking_stats.record_decision("default", route.thinking)
+            return route.thinking
+        
         try:
-            logger.info(f"开始文字识别，图片大小: {len(image_bytes)} bytes")
-            
-            # 验证图片
-            if not self.validate_image(image_bytes):
-                raise ValueError("Invalid image format or size")
+            with stage_timer("difficulty"):
+                difficulty = await asyncio.to_thread(lambda: estimate_difficulty(image.grayscale()))
+        except Exception as e:
+            logger.warning(f"评估图片难度失败，保持思考模式: {e}")
+            self.thinking_stats.record_decision("default", "enabled")
+            return "enabled"
+        thinking = "disabled" if self.thinking_config.is_easy(difficulty) else "enabled"
+        self.thinking_stats.record_decision("auto", thinking, difficulty)
+        logger.info(
+            f"图片难度: 清晰度 {difficulty.sharpness:.0f}，对比度 {difficulty.contrast}，"
+            f"文字密度 {difficulty.text_density:.3f} -> 思考模式 {thinking}"
+        )
+        return thinking
+    
+    def _recognition_messages(self, image_url: str, prompt: str) -> List[Dict[str, Any]]:
+        """构建图片识别请求的消息体"""
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt
+                    }
+                ]
+            }
+        ]
+    
+    async def recognize(
+        self,
+        image: ValidatedImage,
+        custom_prompt: Optional[str] = None,
+        match_similar: bool = True,
+        thinking: Optional[str] = None,
+        structured: bool = False
+    ) -> RecognitionResult:
+        """识别图片中的文字，优先命中结果缓存（match_similar 时也复用近似重复图片的结果）
+        
+        thinking 为 auto / enabled / disabled，未指定时使用 THINKING_MODE 配置。
+        structured 时要求模型逐行输出文字、位置和置信度，结果中包含 lines 和 result_id。
+        """
+        logger.info(f"开始文字识别，图片大小: {image.size} bytes ({image.format} {image.width}x{image.height})")
+        
+        with track_usage() as usage:
+            prompt, route, cache_key = await self._recognition_params(image, custom_prompt, thinking, structured)
+            result = await self._memoized(
+                cache_key,
+                lambda: self._recognize_upstream(image, prompt, route, structured),
+                similar_image=image if match_similar else None,
+                context=self._near_duplicate_context(prompt, route)
+            )
+        if not structured:
+            return replace(result, usage=usage.to_dict())
+        # 缓存中保存的是紧凑的逐行格式
+        lines = decode_lines(result.text)
+        return RecognitionResult(
+            text=lines_to_text(lines),
+            cached=result.cached,
+            lines=lines,
+            result_id=cache_key if self.cache is not None else None,
+            usage=usage.to_dict()
+        )
+    
+    async def get_result(self, result_id: str) -> Optional[List[RecognizedLine]]:
+        """按 result_id 读取已缓存的结构化识别结果，不存在、已淘汰或不是结构化结果时返回 None"""
+        if self.cache is None:
+            return None
+        value = await self.cache.get(result_id)
+        if value is None:
+            return None
+        try:
+            return decode_lines(value)
+        except ValueError:
+            return None
+    
+    async def _memoized(
+        self,
+        cache_key: str,
+        compute: Callable[[], Awaitable[str]],
+        similar_image: Optional[ValidatedImage] = None,
+        context: Optional[str] = None
+    ) -> RecognitionResult:
+        """优先命中结果缓存（传入图片时再查找近似重复图片），并合并相同键的并发请求"""
+        fingerprint = None
+        if self.cache is not None:
+            cached_text = await self.cache.get(cache_key)
+            if cached_text is not None:
+                logger.info("命中结果缓存")
+                return RecognitionResult(text=cached_text, cached=True)
+            if similar_image is not None:
+                cached_text, fingerprint = await self._find_near_duplicate(similar_image, context)
+                if cached_text is not None:
+                    # 同时保存到本图片的缓存键下，之后可直接命中（结构化结果也可按 result_id 查询）
+                    await self.cache.set(cache_key, cached_text)
+                    return RecognitionResult(text=cached_text, cached=True)
+        
+        async def compute_and_store() -> str:
+            text = await compute()
+            if self.cache is not None:
+                await self.cache.set(cache_key, text)
+                if fingerprint is not None:
+                    self.near_duplicates.add(fingerprint, context, cache_key)
+            return text
+        
+        text, shared = await self.inflight.do(cache_key, compute_and_store)
+        if shared:
+            logger.info("复用进行中的相同请求")
+        
+        return RecognitionResult(text=text)
+    
+    def _near_duplicate_context(self, prompt: str, route: UpstreamRoute) -> str:
+        """近似重复图片只在提示词、模型和思考模式都相同时复用"""
+        return RecognitionCache.make_key("", prompt, route.model, route.thinking)
+    
+    async def _find_near_duplicate(
+        self,
+        image: ValidatedImage,
+        context: str
+    ) -> Tuple[Optional[str], Optional[ImageFingerprint]]:
+        """查找近似重复图片的已缓存结果，返回 (识别结果, 图片指纹)；未启用或计算失败时均为 None"""
+        if self.near_duplicates is None:
+            return None, None
+        try:
+            with stage_timer("fingerprint"):
+                fingerprint = await asyncio.to_thread(lambda: image_fingerprint(image.grayscale(), self.near_duplicates.hash_size))
+        except Exception as e:
+            logger.warning(f"计算图片指纹失败: {e}")
+            return None, None
+        # 校验图逐像素比对较耗时，同样放在线程中
+        cache_key = await asyncio.to_thread(self.near_duplicates.find, fingerprint, context)
+        if cache_key is None:
+            return None, fingerprint
+        return await self.cache.get(cache_key), fingerprint
+    
+    def should_tile(self, image: ValidatedImage, requested: Optional[bool] = None) -> bool:
+        """判断图片是否使用分块识别（requested 为 None 时按图片尺寸自动判断）"""
+        return should_tile(image.width, image.height, image.size, self.tiling_config, requested, MAX_IMAGE_SIZE)
+    
+    async def recognize_tiled(
+        self,
+        image: ValidatedImage,
+        custom_prompt: Optional[str] = None,
+        thinking: Optional[str] = None
+    ) -> RecognitionResult:
+        """将大图切分为重叠分块并发识别，再按阅读顺序合并结果（auto 模式下逐个分块评估难度）"""
+        boxes, rows = await asyncio.to_thread(split_image, image, self.tiling_config)
+        if len(rows) == 1 and len(rows[0]) == 1 and image.size <= MAX_IMAGE_SIZE:
+            return await self.recognize(image, custom_prompt, thinking=thinking)
+        # 各分块已带有裁剪出的像素数据，整页的解码结果不再需要
+        image.release_pixels()
+        
+        prompt = (custom_prompt or self.prompts.templates.recognition) + self.prompts.templates.tile_suffix
+        semaphore = asyncio.Semaphore(self.tiling_config.concurrency)
+        # 网格分块时同一行文字可能横跨左右分块，需要逐行输出坐标才能按位置合并
+        grid = any(len(row) > 1 for row in rows)
+        
+        async def recognize_tile(tile: ValidatedImage) -> RecognitionResult:
+            async with semaphore:
+                # 同一页面的分块版式相近，不做近似重复匹配
+                return await self.recognize(tile, prompt, match_similar=False, thinking=thinking, structured=grid)
+        
+        with track_usage() as usage:
+            results = await asyncio.gather(*(recognize_tile(tile) for row in rows for tile in row))
+        
+        grouped: List[List[RecognitionResult]] = []
+        index = 0
+        for row in rows:
+            grouped.append(results[index:index + len(row)])
+            index += len(row)
+        
+        with stage_timer("merge"):
+            if grid:
+                text = merge_grid_lines(boxes, [[result.lines or [] for result in row] for row in grouped])
+            else:
+                text = merge_tile_texts([[result.text for result in row] for row in grouped], row_overlaps(boxes))
+        logger.info(f"分块识别完成，{len(results)} 个分块，结果长度: {len(text)}")
+        return RecognitionResult(text=text, cached=all(result.cached for result in results), usage=usage.to_dict())
+    
+    async def recognize_stream(
+        self,
+        image: ValidatedImage,
+        custom_prompt: Optional[str] = None,
+        thinking: Optional[str] = None,
+        structured: bool = False
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式识别图片中的文字
+        
+        依次产出 {"type": "reasoning" | "content", "delta": str} 增量事件，
+        最后产出 {"type": "done", "text": str, "cached": bool, "usage": dict}。
+        content 增量已实时清理特殊标记和空行。
+        structured 时以 {"type": "line", "line": RecognizedLine} 代替 content 事件（每解析出完整一行产出一次），
+        done 事件另含以完整输出为准的 lines 和 result_id。
+        """
+        logger.info(f"开始流式文字识别，图片大小: {image.size} bytes ({image.format} {image.width}x{image.height})")
+        
+        prompt, route, cache_key = await self._recognition_params(image, custom_prompt, thinking, structured)
+        context = self._near_duplicate_context(prompt, route)
+        result_id = cache_key if self.cache is not None else None
+        fingerprint = None
+        if self.cache is not None:
+            cached_text = await self.cache.get(cache_key)
+            if cached_text is None:
+                cached_text, fingerprint = await self._find_near_duplicate(image, context)
+                if cached_text is not None:
+                    await self.cache.set(cache_key, cached_text)
+            if cached_text is not None:
+                logger.info("命中识别结果缓存")
+                if structured:
+                    lines = decode_lines(cached_text)
+                    for line in lines:
+                        yield {"type": "line", "line": line}
+                    yield {"type": "done", "text": lines_to_text(lines), "cached": True, "lines": lines,
+                           "result_id": result_id, "usage": CallUsage().to_dict()}
+                    return
+                yield {"type": "content", "delta": cached_text}
+                yield {"type": "done", "text": cached_text, "cached": True, "usage": CallUsage().to_dict()}
+                return
+        
+        try:
+            image_url = await self.prepare_image(image)
+            logger.info("调用GLM-4.5V API进行流式文字识别")
             
-            # 转换为base64
-            image_base64 = self.image_to_base64(image_bytes)
+            upstream_start = time.perf_counter()
+            cleaner = StreamingTextCleaner()
+            line_stream = StructuredLineStream() if structured else None
+            parts: List[str] = []
+            max_tokens = self.prompts.image_budget(image.width, image.height, route.thinking, structured)
+            usage = CallUsage(upstream_calls=1, max_tokens=max_tokens)
+            finish_reason = None
+            async for chunk in self.stream_completion(
+                route.tier,
+                model=route.model,
+                messages=self._recognition_messages(image_url, prompt),
+                thinking={"type": route.thinking},
+                max_tokens=max_tokens
+            ):
+                if chunk.get("usage"):
+                    usage.prompt_tokens = chunk["usage"].get("prompt_tokens") or 0
+                    usage.completion_tokens = chunk["usage"].get("completion_tokens") or 0
+                choices = chunk.get("choices")
+                if not choices:
+                    continue
+                finish_reason = choices[0].get("finish_reason") or finish_reason
+                delta = choices[0].get("delta") or {}
+                if delta.get("reasoning_content"):
+                    yield {"type": "reasoning", "delta": delta["reasoning_content"]}
+                if delta.get("content") and line_stream is not None:
+                    for line in line_stream.feed(delta["content"]):
+                        yield {"type": "line", "line": line}
+                elif delta.get("content"):
+                    cleaned = cleaner.feed(delta["content"])
+                    if cleaned:
+                        parts.append(cleaned)
+                        yield {"type": "content", "delta": cleaned}
             
-            # 构建优化的默认提示词（简体中文）
-            default_prompt = """请仔细识别这张图片中的所有文字内容，特别注意以下要求：
-1. 识别所有可见的文字，包括模糊、不清晰或部分遮挡的文字
-2. 尽可能准确地还原文字的原始内容和含义
-3. 保持原有的文本格式、段落结构和排版布局
-4. 对于模糊或不确定的文字，请根据上下文进行合理推测
-5. 使用简体中文输出结果
-6. 如果图片中包含英文或其他语言，请保持原语言不变
-7. 按照从上到下、从左到右的顺序输出文字内容
-
-请直接输出识别到的文字内容，不需要添加额外的说明或解释。"""
+            tail = cleaner.flush()
+            if tail:
+                parts.append(tail)
+                yield {"type": "content", "delta": tail}
+        except Exception as e:
+            logger.error(f"Stream text recognition failed: {e}")
+            raise e
+        
+        self.thinking_stats.record_latency(route.thinking, time.perf_counter() - upstream_start)
+        lines = None
+        if line_stream is not None:
+            with stage_timer("parse"):
+                lines = line_stream.finish()
+            text = lines_to_text(lines)
+            value = encode_lines(lines)
+        else:
+            text = value = ''.join(parts)
+        logger.info(f"流式识别完成，结果长度: {len(text)}")
+        # 流式输出已发送给客户端，被截断时不重试，也不缓存不完整的结果
+        truncated = finish_reason == "length"
+        if truncated:
+            usage.truncated = 1
+            self.prompts.record_truncation(False)
+            logger.warning(f"流式识别结果达到输出上限 {max_tokens} 被截断，不写入缓存")
+        if self.cache is not None and not truncated:
+            await self.cache.set(cache_key, value)
+            if fingerprint is not None:
+                self.near_duplicates.add(fingerprint, context, cache_key)
+        if line_stream is not None:
+            yield {"type": "done", "text": text, "cached": False, "lines": lines,
+                   "result_id": result_id if not truncated else None, "usage": usage.to_dict()}
+        else:
+            yield {"type": "done", "text": text, "cached": False, "usage": usage.to_dict()}
+    
+    async def recognize_text(self, image_bytes: bytes, custom_prompt: Optional[str] = None) -> str:
+        """使用GLM-4.5V识别图片中的文字"""
+        result = await self.recognize(ValidatedImage.from_bytes(image_bytes), custom_prompt)
+        return result.text
+    
+    async def _recognize_upstream(
+        self,
+        image: ValidatedImage,
+        prompt: str,
+        route: UpstreamRoute,
+        structured: bool = False
+    ) -> str:
+        """调用GLM-4.5V API进行文字识别（structured 时返回 encode_lines 的紧凑格式）"""
+        try:
+            # 预处理并生成 data URL
+            image_url = await self.prepare_image(image)
             
-            # 使用自定义提示词或默认提示词
-            prompt = custom_prompt if custom_prompt else default_prompt
-            logger.info(f"使用提示词: {prompt[:100]}...")
+            logger.debug(f"使用提示词: {redact_text(prompt)}")
             
             # 调用GLM-4.5V API
             logger.info("调用GLM-4.5V API进行文字识别")
-            response = self.client.chat.completions.create(
-                model="glm-4.5v",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{image_base64}"
-                                }
-                            },
-                            {
-                                "type": "text",
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                thinking={
-                    "type": "enabled"
-                }
+            max_tokens = self.prompts.image_budget(image.width, image.height, route.thinking, structured)
+            upstream_start = time.perf_counter()
+            response = await self.create_completion(
+                route.tier,
+                model=route.model,
+                messages=self._recognition_messages(image_url, prompt),
+                thinking={"type": route.thinking},
+                max_tokens=max_tokens
             )
+            if self._truncated(response, max_tokens):
+                # 输出上限是估计值，被截断时以最大上限重试一次
+                logger.warning(f"识别结果达到输出上限 {max_tokens} 被截断，以上限 {self.prompts.config.max_output_tokens} 重试")
+                response = await self.create_completion(
+                    route.tier,
+                    model=route.model,
+                    messages=self._recognition_messages(image_url, prompt),
+                    thinking={"type": route.thinking},
+                    max_tokens=self.prompts.config.max_output_tokens
+                )
+            self.thinking_stats.record_latency(route.thinking, time.perf_counter() - upstream_start)
             
             # 提取识别结果
-            if response.choices and len(response.choices) > 0:
-                raw_text = response.choices[0].message.content
+            choices = response.get("choices")
+            if choices:
+                raw_text = choices[0]["message"].get("content")
                 logger.info(f"GLM-4.5V API返回原始结果长度: {len(raw_text) if raw_text else 0}")
                 
+                if structured:
+                    with stage_timer("parse"):
+                        lines = parse_structured_output(raw_text)
+                    logger.info(f"结构化结果解析完成，{len(lines)} 行")
+                    return encode_lines(lines)
+                
                 # 清理特殊标记
-                cleaned_text = self.clean_response_text(raw_text)
+                with stage_timer("clean"):
+                    cleaned_text = self.clean_response_text(raw_text)
                 logger.info(f"清理后结果长度: {len(cleaned_text)}")
                 
                 return cleaned_text
@@ -121,38 +583,170 @@ class ZhipuAIService:
             logger.error(f"Text recognition failed: {e}")
             raise e
     
-    async def refine_text(self, original_text: str, refinement_instruction: str) -> str:
-        """使用自然语言指令微调识别结果"""
-        try:
-            logger.info(f"开始文字微调，原始文字长度: {len(original_text)}")
-            logger.info(f"微调指令: {refinement_instruction}")
-            
-            prompt = f"""请根据以下指令对文字内容进行微调：
-
-原始文字内容：
-{original_text}
-
-微调指令：
-{refinement_instruction}
+    def _truncated(self, response: Dict[str, Any], max_tokens: int) -> bool:
+        """上游输出是否因达到 max_tokens 被截断（已是最大上限时不再重试）"""
+        choices = response.get("choices") or [{}]
+        if choices[0].get("finish_reason") != "length":
+            return False
+        retry = max_tokens < self.prompts.config.max_output_tokens
+        self.prompts.record_truncation(retry)
+        return retry
+    
+    def _refine_thinking(self, override: Optional[str]) -> str:
+        """文字微调的思考模式：请求指定 enabled / disabled 时使用，否则按 REFINE_THINKING_MODE"""
+        return override if override in ("enabled", "disabled") else self.thinking_config.refine_mode
+    
+    def _refine_cache_key(self, prompt: str, thinking: str, max_tokens: int, temperature: Optional[float]) -> str:
+        """微调结果缓存键：最终发送的提示词（已包含原文、指令、提示词版本、此前的指令和上下文）+ 模型 + 思考模式 + 生成参数"""
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        material = json.dumps(["refine", prompt_hash, self.model, thinking, max_tokens, temperature])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+    
+    async def refine_text(
+        self,
+        original_text: str,
+        refinement_instruction: str,
+        thinking: Optional[str] = None
+    ) -> RecognitionResult:
+        """使用自然语言指令微调识别结果（相同原文和指令的结果会被缓存，长文本分段并发处理）"""
+        logger.info(f"开始文字微调，原始文字长度: {len(original_text)}")
+        logger.info(f"微调指令: {redact_text(refinement_instruction)}")
+        return await self._rewrite(
+            original_text,
+            refinement_instruction,
+            self._refine_thinking(thinking),
+            self.prompts.templates.refine
+        )
+    
+    async def tune_text(self, text: str, instruction: str, thinking: Optional[str] = None) -> RecognitionResult:
+        """按指令优化文字（结果有随机性，不缓存）"""
+        logger.info(f"开始文字优化，原始文字长度: {len(text)}")
+        return await self._rewrite(
+            text,
+            instruction,
+            self._refine_thinking(thinking),
+            self.prompts.templates.tune,
+            cached=False,
+            temperature=0.7
+        )
+    
+    async def refine_region(
+        self,
+        text: str,
+        instruction: str,
+        previous_instructions: Sequence[str] = (),
+        context_before: Sequence[str] = (),
+        context_after: Sequence[str] = (),
+        thinking: Optional[str] = None
+    ) -> RecognitionResult:
+        """微调文档中的一段文字，只发送该段落、少量上下文和此前的指令"""
+        logger.info(f"开始局部微调，段落长度: {len(text)}")
+        return await self._rewrite(
+            text,
+            instruction,
+            self._refine_thinking(thinking),
+            self.prompts.templates.refine,
+            previous_instructions=previous_instructions,
+            context_before=context_before,
+            context_after=context_after
+        )
+    
+    async def _rewrite(
+        self,
+        text: str,
+        instruction: str,
+        thinking: str,
+        template: str,
+        cached: bool = True,
+        temperature: Optional[float] = None,
+        previous_instructions: Sequence[str] = (),
+        context_before: Sequence[str] = (),
+        context_after: Sequence[str] = ()
+    ) -> RecognitionResult:
+        """按指令改写文字：超过 REFINE_CHUNK_TOKENS 的文本按段落切分后并发改写，再按原分隔符拼接
 
-请输出微调后的文字内容："""
+        只有一个分段且没有上下文时使用 template，否则使用局部微调提示词（附带相邻分段的几行作为上下文）。
+        """
+        chunks = self.prompts.split_chunks(text)
+        context_lines = self.prompts.config.chunk_context_lines
+        semaphore = asyncio.Semaphore(self.prompts.config.chunk_concurrency)
+        if len(chunks) > 1:
+            logger.info(f"微调文本切分为 {len(chunks)} 段并发处理")
+        
+        def neighbour_lines(index: int, tail: bool) -> List[str]:
+            if context_lines <= 0 or not 0 <= index < len(chunks):
+                return []
+            lines = chunks[index][0].strip().split("\n")
+            return lines[-context_lines:] if tail else lines[:context_lines]
+        
+        async def rewrite_chunk(index: int, chunk: str) -> RecognitionResult:
+            if not chunk.strip():
+                return RecognitionResult(text=chunk, cached=True)
+            before = list(context_before) if index == 0 else neighbour_lines(index - 1, tail=True)
+            after = list(context_after) if index == len(chunks) - 1 else neighbour_lines(index + 1, tail=False)
+            if len(chunks) == 1 and not (previous_instructions or before or after):
+                prompt = template.format(text=chunk, instruction=instruction)
+            else:
+                prompt = self.prompts.region_prompt(chunk, instruction, previous_instructions, before, after)
+            
+            # 输出长度与待改写的文字相当（不含上下文和指令）
+            max_tokens = self.prompts.text_budget(self.prompts.estimate_tokens(chunk), thinking)
             
+            async def compute() -> str:
+                async with semaphore:
+                    return await self._refine_upstream(prompt, thinking, max_tokens, temperature)
+            
+            if not cached:
+                return RecognitionResult(text=await compute(), cached=False)
+            # 缓存和并发合并都以最终提示词为准：相同文字在不同的上下文或指令历史下不会复用
+            return await self._memoized(self._refine_cache_key(prompt, thinking, max_tokens, temperature), compute)
+        
+        with track_usage() as usage:
+            usage.chunks += len(chunks)
+            results = await asyncio.gather(*(rewrite_chunk(index, chunk) for index, (chunk, _) in enumerate(chunks)))
+        return RecognitionResult(
+            text="".join(result.text + separator for result, (_, separator) in zip(results, chunks)),
+            cached=all(result.cached for result in results),
+            usage=usage.to_dict()
+        )
+    
+    async def _refine_upstream(
+        self,
+        prompt: str,
+        thinking: str = "enabled",
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> str:
+        """调用GLM-4.5V API进行文字微调（未指定 max_tokens 时按整个提示词的 token 数设置）"""
+        try:
             logger.info("调用GLM-4.5V API进行文字微调")
-            response = self.client.chat.completions.create(
-                model="glm-4.5v",
-                messages=[
+            estimated = self.prompts.estimate_tokens(prompt)
+            record_estimate(estimated)
+            if max_tokens is None:
+                max_tokens = self.prompts.text_budget(estimated, thinking)
+            params: Dict[str, Any] = {
+                "model": self.model,
+                "messages": [
                     {
                         "role": "user",
                         "content": prompt
                     }
                 ],
-                thinking={
-                    "type": "enabled"
+                "thinking": {
+                    "type": thinking
                 }
-            )
+            }
+            if temperature is not None:
+                params["temperature"] = temperature
+            response = await self.create_completion(max_tokens=max_tokens, **params)
+            self.prompts.observe(estimated, response.get("usage"))
+            if self._truncated(response, max_tokens):
+                logger.warning(f"微调结果达到输出上限 {max_tokens} 被截断，以上限 {self.prompts.config.max_output_tokens} 重试")
+                response = await self.create_completion(max_tokens=self.prompts.config.max_output_tokens, **params)
             
-            if response.choices and len(response.choices) > 0:
-                raw_text = response.choices[0].message.content
+            choices = response.get("choices")
+            if choices:
+                raw_text = choices[0]["message"].get("content")
                 logger.info(f"GLM-4.5V API返回微调结果长度: {len(raw_text) if raw_text else 0}")
                 
                 # 清理特殊标记
@@ -165,4 +759,22 @@ class ZhipuAIService:
                 
         except Exception as e:
             logger.error(f"Text refinement failed: {e}")
-            raise e
\ No newline at end of file
+            raise e
+
+_service: Optional[ZhipuAIService] = None
+
+
+def get_zhipuai_service() -> ZhipuAIService:
+    """获取进程内共享的 ZhipuAIService（首次调用时创建），也用作 FastAPI 依赖"""
+    global _service
+    if _service is None:
+        _service = ZhipuAIService()
+    return _service
+
+
+async def close_zhipuai_service() -> None:
+    """关闭共享服务的连接池"""
+    global _service
+    if _service is not None:
+        await _service.aclose()
+        _service = None
@@ -0,0 +1,150 @@
+import base64
+import hashlib
+from dataclasses import dataclass, field
+from functools import cached_property
+from io import BytesIO
+from typing import Optional
+
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+from app.utils.metrics import stage_timer
+from app.utils.traffic_recorder import record_request_image
+
+# 上传图片大小上限 (5MB)
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+# 分块读取上传文件的块大小
+READ_CHUNK_SIZE = 64 * 1024
+# 难度评估和近似重复指纹使用的灰度缩略图的长边上限（按整数倍缩小，实际长边在该值和 2 倍之间）
+ANALYSIS_MAX_EDGE = 1024
+
+ALLOWED_CONTENT_TYPES = ['image/jpeg', 'image/jpg', 'image/png']
+ALLOWED_IMAGE_FORMATS = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+
+class ImageValidationError(ValueError):
+    """图片校验失败，message 可直接返回给用户"""
+
+
+@dataclass(eq=False)
+class ValidatedImage:
+    """校验通过的图片：每个请求只构造一次，贯穿整个识别流程
+
+    格式和尺寸仅通过解析文件头获得，不做完整解码；
+    哈希和 data URL 在首次使用时计算并缓存。
+    像素数据在首次使用时解码一次，预处理、难度评估、近似重复指纹和分块共用，预处理完成后释放。
+    """
+    data: bytes
+    format: str
+    width: int
+    height: int
+    _decoded: Optional[Image.Image] = field(default=None, init=False, repr=False)
+    _gray: Optional[Image.Image] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_size: int = MAX_IMAGE_SIZE) -> "ValidatedImage":
+        """探测图片头部信息并校验格式和大小"""
+        if len(data) > max_size:
+            raise ImageValidationError(f"文件大小不能超过 {max_size // (1024 * 1024)}MB")
+        try:
+            with Image.open(BytesIO(data)) as image:
+                image_format = (image.format or "").upper()
+                width, height = image.size
+        except Exception as e:
+            raise ImageValidationError("图片格式或大小不符合要求") from e
+        if image_format not in ALLOWED_IMAGE_FORMATS:
+            raise ImageValidationError("只支持 JPG、JPEG、PNG 格式的图片")
+        return cls(data=data, format=image_format, width=width, height=height)
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def mime_type(self) -> str:
+        return ALLOWED_IMAGE_FORMATS[self.format]
+
+    @cached_property
+    def sha256(self) -> str:
+        return hashlib.sha256(self.data).hexdigest()
+
+    @cached_property
+    def data_url(self) -> str:
+        # 在 bytes 上拼接后一次性解码，减少 base64 大字符串的中间拷贝
+        url = f"data:{self.mime_type};base64,".encode('ascii') + base64.b64encode(self.data)
+        return url.decode('ascii')
+
+    def decoded(self) -> Image.Image:
+        """解码后的图片（已按 EXIF 方向旋转），调用方不能原地修改"""
+        if self._decoded is None:
+            with Image.open(BytesIO(self.data)) as image:
+                image.load()
+                self._decoded = ImageOps.exif_transpose(image)
+        return self._decoded
+
+    def grayscale(self) -> Image.Image:
+        """按整数倍区域平均缩小到长边不超过 ANALYSIS_MAX_EDGE 两倍的灰度图，供难度评估和近似重复指纹共用"""
+        if self._gray is None:
+            gray = self.decoded().convert("L")
+            factor = max(gray.size) // ANALYSIS_MAX_EDGE
+            # 整数倍区域平均缩小，比 thumbnail 快，且不会像过度缩小那样使模糊图片显得清晰
+            self._gray = gray.reduce(factor) if factor > 1 else gray
+        return self._gray
+
+    def with_decoded(self, image: Image.Image) -> "ValidatedImage":
+        """设置已解码的像素数据（如分块时裁剪出的区域），避免再次解码编码后的数据"""
+        self._decoded = image
+        return self
+
+    def release_pixels(self) -> None:
+        """释放解码后的像素数据（之后再使用时重新解码）"""
+        self._decoded = None
+        self._gray = None
+
+
+def check_content_type(content_type: Optional[str]) -> None:
+    """校验上传文件声明的 Content-Type"""
+    if not content_type or not content_type.startswith('image/'):
+        raise ImageValidationError("只支持图片文件")
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise ImageValidationError("只支持 JPG、JPEG、PNG 格式的图片")
+
+
+async def read_upload(file: UploadFile, max_size: int = MAX_IMAGE_SIZE) -> bytes:
+    """读取上传文件，超过大小上限时立即拒绝而不继续读入内存"""
+    too_large = ImageValidationError(f"文件大小不能超过 {max_size // (1024 * 1024)}MB")
+    if file.size is not None:
+        # 已知大小时先拒绝超限文件，否则一次性读取，避免分块拼接的额外拷贝
+        if file.size > max_size:
+            raise too_large
+        data = await file.read(max_size + 1)
+        if len(data) > max_size:
+            raise too_large
+        return data
+
+    # 大小未知时分块读取，累计超限即停止
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_size:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def validate_upload(file: UploadFile, max_size: int = MAX_IMAGE_SIZE) -> ValidatedImage:
+    """校验并读取上传图片，返回 ValidatedImage"""
+    check_content_type(file.content_type)
+    with stage_timer("read"):
+        data = await read_upload(file, max_size)
+    with stage_timer("validate"):
+        image = ValidatedImage.from_bytes(data, max_size)
+    record_request_image(image.data, image.format, image.width, image.height)
+    return image
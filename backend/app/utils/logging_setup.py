@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import queue
+import atexit
+import hashlib
+import logging
+import logging.handlers
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 当前请求（或异步任务）的标识和各阶段累计耗时，由 RequestLogMiddleware 设置
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+stage_times_var: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_times", default=None)
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+# LogRecord 自带的属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id", "taskName"}
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def record_stage_time(stage: str, seconds: float) -> None:
+    """累计当前请求某一阶段的耗时（不在请求上下文中时忽略）"""
+    stages = stage_times_var.get()
+    if stages is not None:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def redact_text(text: Optional[str]) -> str:
+    """按 LOG_PROMPT_MODE 处理写入日志的提示词和指令：full（原文）、truncate（截断）、hash（摘要和长度）、off（不记录）"""
+    if text is None:
+        return "-"
+    mode = os.getenv("LOG_PROMPT_MODE", "hash").lower()
+    if mode == "full":
+        return text
+    if mode == "truncate":
+        limit = int(os.getenv("LOG_PROMPT_MAX_CHARS", 100))
+        return text if len(text) <= limit else f"{text[:limit]}...（共 {len(text)} 字）"
+    if mode == "off":
+        return f"<{len(text)} 字>"
+    return f"<sha256:{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}, {len(text)} 字>"
+
+
+class RequestContextFilter(logging.Filter):
+    """为日志记录附加请求标识，并按请求采样 INFO 及以下级别的日志
+
+    同一请求的日志全部保留或全部丢弃；WARNING 及以上级别和请求之外的日志始终保留。
+    该过滤器运行在产生日志的线程上（入队之前），被丢弃的记录不占用队列。
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        record.request_id = request_id or "-"
+        if self.sample_rate >= 1 or request_id is None or record.levelno > logging.INFO:
+            return True
+        if zlib.crc32(request_id.encode("utf-8")) / 0xFFFFFFFF < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列已满（磁盘写入跟不上）时丢弃日志而不是阻塞事件循环"""
+
+    def __init__(self, log_queue: "queue.Queue"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON，包含请求标识和通过 extra 传入的字段"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LoggingState:
+    """日志队列和后台写入线程"""
+
+    def __init__(self, queue_handler: DroppingQueueHandler, context: RequestContextFilter, listener: logging.handlers.QueueListener):
+        self.queue_handler = queue_handler
+        self.context = context
+        self.listener = listener
+        self.running = False
+
+    def start(self) -> None:
+        self.listener.start()
+        self.running = True
+
+    def stop(self) -> None:
+        """写完队列中剩余的日志后停止后台线程"""
+        if self.running:
+            self.running = False
+            self.listener.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue_handler.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "sampled_out": self.context.sampled_out,
+            "sample_rate": self.context.sample_rate,
+        }
+
+
+_state: Optional[LoggingState] = None
+
+
+def _file_handler(log_file: str) -> logging.Handler:
+    """按大小（LOG_MAX_BYTES）或时间（LOG_ROTATE_WHEN，如 midnight）轮转的日志文件"""
+    # 多工作进程时每个进程应写入各自的文件（如 logs/app-{pid}.log），避免轮转时互相覆盖
+    log_file = log_file.replace("{pid}", str(os.getpid()))
+    if os.path.dirname(log_file):
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    backup_count = int(os.getenv("LOG_BACKUP_COUNT", 5))
+    when = os.getenv("LOG_ROTATE_WHEN")
+    if when:
+        return logging.handlers.TimedRotatingFileHandler(log_file, when=when, backupCount=backup_count, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024)),
+        backupCount=backup_count,
+        encoding='utf-8',
+    )
+
+
+def setup_logging(log_file: Optional[str] = None) -> LoggingState:
+    """配置根日志：业务代码只把记录放入队列，由后台线程格式化并写入控制台和轮转文件
+
+    LOG_FORMAT 为 text 或 json；LOG_SAMPLE_RATE 为按请求采样的比例（0-1）。
+    """
+    global _state
+    if _state is not None:
+        return _state
+
+    formatter = JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(_file_handler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", 10000))))
+    context = RequestContextFilter(float(os.getenv("LOG_SAMPLE_RATE", 1.0)))
+    queue_handler.addFilter(context)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _state = LoggingState(queue_handler, context, listener)
+    _state.start()
+    atexit.register(_state.stop)
+    return _state
+
+
+def get_logging_state() -> Optional[LoggingState]:
+    return _state
+
+
+class RequestLogMiddleware:
+    """为每个请求设置请求标识（沿用 X-Request-ID 请求头或新生成）和阶段耗时记录，
+    响应头返回 X-Request-ID，请求结束时输出一条包含路由、状态码、总耗时和各阶段耗时的日志（纯 ASGI 实现）
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = os.getenv("LOG_REQUESTS", "true").lower() == "true"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1").strip()[:64] or new_request_id()
+        request_token = request_id_var.set(request_id)
+        stages: Dict[str, float] = {}
+        stages_token = stage_times_var.set(stages)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if self.enabled:
+                route = getattr(scope.get("route"), "path", None) or scope["path"]
+                duration_ms = round((time.perf_counter() - start) * 1000, 1)
+                logger.info(
+                    f"{scope['method']} {route} {status} {duration_ms}ms",
+                    extra={
+                        "route": route,
+                        "status": status,
+                        "duration_ms": duration_ms,
+                        "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in stages.items()},
+                    },
+                )
+            stage_times_var.reset(stages_token)
+            request_id_var.reset(request_token)
@@ -0,0 +1,282 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.logging_setup import record_stage_time
+
+# 延迟直方图默认分桶（秒），覆盖从毫秒级本地处理到分钟级的上游调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    """带标签的指标基类"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        lines = self.header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值"""
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """累积分桶直方图，用于延迟分布（p99 等分位数由 Prometheus 端计算）"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> (各分桶计数, 总和, 总数)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """记录代码块耗时（异常时同样记录）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        # 导出时读取的组件统计：(指标名前缀, 说明, 统计函数)
+        self._collectors: List[Tuple[str, str, Callable[[], Optional[Dict[str, Any]]]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_stats(self, prefix: str, documentation: str, stats: Callable[[], Optional[Dict[str, Any]]]) -> None:
+        """将组件 stats() 返回的数值字段导出为 gauge（如缓存命中数、限流器在途数）"""
+        self._collectors.append((prefix, documentation, stats))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, documentation, stats in self._collectors:
+            for key, value in (stats() or {}).items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.append(f"# HELP {name} {documentation}: {key}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUESTS = registry.counter(
+    "unblurai_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+HTTP_REQUEST_DURATION = registry.histogram(
+    "unblurai_http_request_duration_seconds", "HTTP request latency including streamed body", ("method", "route")
+)
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge("unblurai_http_requests_in_flight", "HTTP requests currently being served")
+STAGE_DURATION = registry.histogram(
+    "unblurai_stage_duration_seconds",
+    "Recognition pipeline stage latency (read/validate/fingerprint/difficulty/encode/limiter_wait/upstream/clean/parse/merge/serialize)",
+    ("stage",),
+)
+UPSTREAM_TOKENS = registry.counter(
+    "unblurai_upstream_tokens_total", "Tokens reported by GLM usage", ("model", "kind")
+)
+# 按客户端统计（标签数量受 CLIENT_METRICS_MAX_LABELS 限制，超出的客户端归入 other）
+CLIENT_REQUESTS = registry.counter(
+    "unblurai_client_requests_total", "API requests by client, traffic class and quota outcome", ("client", "class", "outcome")
+)
+CLIENT_UPSTREAM_CALLS = registry.counter(
+    "unblurai_client_upstream_calls_total", "GLM calls made on behalf of each client", ("client", "class")
+)
+CLIENT_TOKENS = registry.counter(
+    "unblurai_client_tokens_total", "GLM tokens used on behalf of each client", ("client", "kind")
+)
+CLIENT_QUEUE_WAIT = registry.histogram(
+    "unblurai_client_queue_wait_seconds", "Time spent waiting for a GLM slot by traffic class", ("class",)
+)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """记录识别流程某一阶段的耗时（同时累计到当前请求的日志记录中）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_DURATION.observe(seconds, stage=stage)
+    record_stage_time(stage, seconds)
+
+
+def record_token_usage(model: str, usage: Optional[Dict[str, Any]]) -> None:
+    """累计上游返回的 token 用量"""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind)
+        if value:
+            UPSTREAM_TOKENS.inc(value, model=model, kind=kind.replace("_tokens", ""))
+
+
+class MetricsMiddleware:
+    """记录每个路由的请求数和延迟（纯 ASGI 实现，流式响应在响应体发送完毕时计时）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with HTTP_REQUESTS_IN_FLIGHT.track_inprogress():
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # 使用路由模板而不是原始路径作为标签，避免标签基数失控
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                method = scope["method"]
+                HTTP_REQUESTS.inc(method=method, route=route, status=status)
+                HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, method=method, route=route)
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call(Generic[T]):
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """合并相同 key 的并发调用：同一时刻只执行一次，其余调用方共享同一结果
+
+    上游调用在独立任务中执行，单个调用方被取消不会影响其他等待者；
+    只有当所有等待者都已取消时才会取消上游调用。异常会传递给每个等待者。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call[T]] = {}
+        self.executions = 0
+        self.saved = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """执行或加入 key 对应的调用，返回 (结果, 是否共享了他人的调用)"""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._finish(key, call))
+            self.executions += 1
+        else:
+            self.saved += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # 立即移除，之后到达的相同请求发起新的调用，而不是加入正在取消的任务
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                call.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executions": self.executions,
+            "saved_calls": self.saved,
+            "in_flight": len(self._calls),
+        }
+
+    def _finish(self, key: str, call: _Call[T]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        # 读取异常，避免无人等待时出现 "exception was never retrieved" 警告
+        if not call.task.cancelled():
+            call.task.exception()
@@ -0,0 +1,20 @@
+from typing import Dict, Iterable, Sequence
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """对已排序数据计算百分位数（线性插值）"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+
+
+def latency_summary(values: Iterable[float], quantiles: Sequence[float] = (50, 90, 95, 99)) -> Dict[str, float]:
+    """返回 p50/p90/p95/p99/max 等延迟统计（保留3位小数）"""
+    ordered = sorted(values)
+    summary = {f"p{int(q)}": round(percentile(ordered, q), 3) for q in quantiles}
+    summary["max"] = round(ordered[-1], 3) if ordered else 0.0
+    return summary
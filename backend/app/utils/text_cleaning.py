@@ -0,0 +1,67 @@
+from typing import List
+
+# GLM-4.5V 输出中包裹答案的特殊标记
+BOX_MARKERS = ('<|begin_of_box|>', '<|end_of_box|>')
+
+
+class StreamingTextCleaner:
+    """增量版的 clean_response_text：逐块输入模型输出，产出清理后的文本
+
+    移除特殊标记（允许标记被拆分到多个数据块中），去掉每行首尾空白并跳过空行。
+    所有块的输出拼接后与对完整文本调用 clean_response_text 的结果一致。
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._line_started = False
+        self._pending_whitespace = ''
+        self._pending_newline = False
+
+    def feed(self, delta: str) -> str:
+        """输入一个数据块，返回可以立即输出的清理后文本"""
+        self._buffer += delta
+        for marker in BOX_MARKERS:
+            self._buffer = self._buffer.replace(marker, '')
+
+        # 结尾可能是被拆开的标记前缀，暂不输出
+        hold = self._partial_marker_length(self._buffer)
+        text = self._buffer[:len(self._buffer) - hold]
+        self._buffer = self._buffer[len(self._buffer) - hold:]
+        return self._emit(text)
+
+    def flush(self) -> str:
+        """输入结束，输出剩余文本（行尾空白被丢弃）"""
+        text, self._buffer = self._buffer, ''
+        return self._emit(text)
+
+    @staticmethod
+    def _partial_marker_length(text: str) -> int:
+        for length in range(min(len(text), max(len(m) for m in BOX_MARKERS) - 1), 0, -1):
+            suffix = text[-length:]
+            if any(marker.startswith(suffix) for marker in BOX_MARKERS):
+                return length
+        return 0
+
+    def _emit(self, text: str) -> str:
+        output: List[str] = []
+        for char in text:
+            if char == '\n':
+                if self._line_started:
+                    self._pending_newline = True
+                self._line_started = False
+                self._pending_whitespace = ''
+            elif char.isspace():
+                # 行首空白丢弃；行内空白在遇到后续字符时才输出
+                if self._line_started:
+                    self._pending_whitespace += char
+            else:
+                if not self._line_started:
+                    if self._pending_newline:
+                        output.append('\n')
+                        self._pending_newline = False
+                    self._line_started = True
+                else:
+                    output.append(self._pending_whitespace)
+                self._pending_whitespace = ''
+                output.append(char)
+        return ''.join(output)
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.services.prompts import track_usage
+from app.utils.logging_setup import stage_times_var
+
+logger = logging.getLogger(__name__)
+
+# 记录请求特征的接口（batch、jobs 等接口不记录）
+RECORDED_ROUTES = ("/api/upload", "/api/upload-stream", "/api/refine", "/api/tune")
+
+# 当前请求的记录，由 TrafficRecorderMiddleware 设置，接口通过 record_request_shape 等函数补充请求特征
+traffic_record_var: ContextVar[Optional[Dict[str, Any]]] = ContextVar("traffic_record", default=None)
+
+
+class TrafficRecorder:
+    """把匿名化的请求特征追加写入 JSON Lines 文件，供 benchmarks/replay_traffic.py 回放
+
+    每行一个请求，只包含图片大小/格式/尺寸、文字和提示词长度、到达时间、状态码、耗时、
+    上游调用次数、上游耗时和 token 用量，不包含图片、文字、提示词、客户端标识和来源地址。
+    相同内容的图片或文字带有相同的 key（加盐哈希的前 12 位），回放时可复现缓存命中。
+    写入由后台线程批量完成，队列满或文件超过 max_bytes 时丢弃记录。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sample_rate: float = 1.0,
+        max_bytes: int = 100 * 1024 * 1024,
+        queue_size: int = 10000,
+        salt: Optional[str] = None,
+    ):
+        # 多工作进程时每个进程写入各自的文件（如 data/traffic-{pid}.jsonl），回放时可同时传入多个文件
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.salt = (salt or os.urandom(16).hex()).encode("utf-8")
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.bytes_written = 0
+
+    def sample(self) -> bool:
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def key(self, data: bytes) -> str:
+        return hashlib.sha256(self.salt + data).hexdigest()[:12]
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """放入写入队列（不阻塞请求）"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                if os.path.dirname(self.path):
+                    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if os.path.exists(self.path):
+                    self.bytes_written = os.path.getsize(self.path)
+                self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+                logger.info(f"请求录制已开启，写入 {self.path}（采样率 {self.sample_rate:g}）")
+
+    def _run(self) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    return
+                batch = [record]
+                # 一次写入队列中已有的全部记录
+                while len(batch) < 500:
+                    try:
+                        record = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is None:
+                        self._write(f, batch)
+                        return
+                    batch.append(record)
+                self._write(f, batch)
+
+    def _write(self, f, batch: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in batch)
+        size = len(lines.encode("utf-8"))
+        if self.bytes_written + size > self.max_bytes:
+            self.dropped += len(batch)
+            return
+        f.write(lines)
+        f.flush()
+        self.bytes_written += size
+        self.recorded += len(batch)
+
+    def stop(self) -> None:
+        """写完队列中的记录后停止后台线程"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "queued": self._queue.qsize(),
+            "bytes_written": self.bytes_written,
+        }
+
+
+def create_traffic_recorder() -> Optional[TrafficRecorder]:
+    """根据环境变量创建请求录制（TRAFFIC_RECORD_FILE 为空时不录制）"""
+    path = os.getenv("TRAFFIC_RECORD_FILE", "").strip()
+    if not path:
+        return None
+    return TrafficRecorder(
+        path,
+        sample_rate=float(os.getenv("TRAFFIC_RECORD_SAMPLE_RATE", 1.0)),
+        max_bytes=int(os.getenv("TRAFFIC_RECORD_MAX_BYTES", 100 * 1024 * 1024)),
+        salt=os.getenv("TRAFFIC_RECORD_SALT") or None,
+    )
+
+
+_recorder: Optional[TrafficRecorder] = None
+_configured = False
+
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """获取进程内共享的请求录制（首次调用时读取配置，未开启时返回 None）"""
+    global _recorder, _configured
+    if not _configured:
+        _recorder = create_traffic_recorder()
+        _configured = True
+    return _recorder
+
+
+def record_request_shape(**fields: Any) -> None:
+    """补充当前请求的特征字段（值为 None 的字段省略；不在录制中时忽略）"""
+    record = traffic_record_var.get()
+    if record is not None:
+        record.update((name, value) for name, value in fields.items() if value is not None)
+
+
+def record_request_image(data: bytes, image_format: str, width: int, height: int) -> None:
+    record = traffic_record_var.get()
+    if record is not None and _recorder is not None:
+        record.update(img_b=len(data), img_f=image_format, img_w=width, img_h=height, key=_recorder.key(data))
+
+
+def record_request_text(text: str, instruction: str) -> None:
+    """记录待微调文字和指令的长度（key 只由文字内容决定）"""
+    record = traffic_record_var.get()
+    if record is not None and _recorder is not None:
+        record.update(text=len(text), instr=len(instruction), key=_recorder.key(text.encode("utf-8")))
+
+
+class TrafficRecorderMiddleware:
+    """录制 RECORDED_ROUTES 的请求特征、耗时和上游用量（纯 ASGI 实现，需位于 RequestLogMiddleware 之内以读取阶段耗时）
+
+    记录字段：t 到达时间（Unix 秒）、r 路由、s 状态码、ms 总耗时、ttfb 首字节时间（毫秒）；
+    img_b/img_f/img_w/img_h 图片字节数/格式/宽/高，text/instr/prompt 文字/指令/自定义提示词长度，key 内容标识，
+    thinking/structured/tiled 请求选项；n 上游调用次数，up_ms 上游耗时，wait_ms 等待限流名额的时间，
+    pt/ct 输入/输出 token 数，trunc 被截断的上游调用次数。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        recorder = get_traffic_recorder() if scope["type"] == "http" else None
+        if recorder is None or scope["path"] not in RECORDED_ROUTES or not recorder.sample():
+            await self.app(scope, receive, send)
+            return
+
+        record: Dict[str, Any] = {"t": round(time.time(), 3), "r": scope["path"]}
+        record_token = traffic_record_var.set(record)
+        start = time.perf_counter()
+        status = 500
+        first_byte: Optional[float] = None
+
+        async def send_wrapper(message):
+            nonlocal status, first_byte
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and first_byte is None:
+                first_byte = time.perf_counter() - start
+            await send(message)
+
+        # 最外层的用量统计：识别、微调过程中的所有上游调用（含分块、分段和重试）都累计到这里
+        with track_usage() as usage:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                traffic_record_var.reset(record_token)
+                stages = stage_times_var.get() or {}
+                record.update(
+                    s=status,
+                    ms=round((time.perf_counter() - start) * 1000, 1),
+                    ttfb=round(first_byte * 1000, 1) if first_byte is not None else None,
+                    n=usage.upstream_calls,
+                    up_ms=round(stages.get("upstream", 0.0) * 1000, 1),
+                    wait_ms=round(stages.get("limiter_wait", 0.0) * 1000, 1),
+                    pt=usage.prompt_tokens,
+                    ct=usage.completion_tokens,
+                    trunc=usage.truncated or None,
+                )
+                recorder.submit({name: value for name, value in record.items() if value is not None})
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+批量流量压满上游时交互请求的排队延迟测试（进程内直接驱动 GLM 限流器，上游调用用固定耗时模拟）
+
+一个批量客户端以 --batch-clients 个并发持续请求上游（相当于批量识别或异步任务），
+同时若干交互客户端按泊松到达发起单次请求。对比三种调度方式下交互请求获得名额的等待时间和批量吞吐：
+
+- fifo：不区分客户端，先进先出（改动前的行为）
+- fair：按客户端加权公平排队（GLM_BATCH_MAX_SHARE=1）
+- fair+reserve：加权公平排队，且批量流量最多占用 GLM_BATCH_MAX_SHARE 比例的名额
+
+用法：
+    python benchmarks/bench_fairness.py [--max-in-flight 8] [--hold 0.5] [--batch-clients 64] [--interactive-qps 2] [--duration 20]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from app.services.client_quota import BATCH, INTERACTIVE, ClientContext, ClientQuotas, current_client  # noqa: E402
+from app.services.rate_limiter import AdaptiveLimiter, UpstreamOverloadedError  # noqa: E402
+from app.utils.stats import latency_summary  # noqa: E402
+
+
+async def run_mode(args, fair: bool, batch_share: float) -> Dict:
+    limiter = AdaptiveLimiter(
+        rate=1000,
+        burst=1000,
+        max_concurrency=args.max_in_flight,
+        max_queue=args.batch_clients + 100,
+        max_wait=args.duration * 2,
+        batch_share=batch_share,
+    )
+    quotas = ClientQuotas(batch_weight=args.batch_weight)
+    rng = random.Random(args.seed)
+    deadline = time.monotonic() + args.duration
+    waits: Dict[str, List[float]] = {INTERACTIVE: [], BATCH: []}
+    completed = {INTERACTIVE: 0, BATCH: 0}
+    shed = 0
+
+    async def call(client: Optional[ClientContext], kind: str) -> None:
+        nonlocal shed
+        current_client.set(client)
+        start = time.monotonic()
+        try:
+            async with limiter.slot():
+                admitted = time.monotonic()
+                waits[kind].append(admitted - start)
+                await asyncio.sleep(args.hold * rng.uniform(0.5, 1.5))
+            # 测试窗口结束前已排队的请求会在窗口之后完成，吞吐只统计窗口内获得名额的调用
+            completed[kind] += int(admitted < deadline)
+        except UpstreamOverloadedError:
+            shed += 1
+
+    async def batch_worker() -> None:
+        client = quotas.identify(None, None, "10.0.0.1", BATCH) if fair else None
+        while time.monotonic() < deadline:
+            await call(client, BATCH)
+
+    async def interactive_arrivals() -> None:
+        tasks = []
+        index = 0
+        while time.monotonic() < deadline:
+            await asyncio.sleep(rng.expovariate(args.interactive_qps))
+            index += 1
+            client = quotas.identify(None, None, f"10.0.1.{index % args.interactive_users}", INTERACTIVE) if fair else None
+            tasks.append(asyncio.ensure_future(call(client, INTERACTIVE)))
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(interactive_arrivals(), *(batch_worker() for _ in range(args.batch_clients)))
+    return {
+        "interactive": latency_summary([value * 1000 for value in waits[INTERACTIVE]], (50, 99)),
+        "interactive_count": completed[INTERACTIVE],
+        "batch_qps": completed[BATCH] / args.duration,
+        "shed": shed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-in-flight", type=int, default=8, help="GLM_MAX_IN_FLIGHT")
+    parser.add_argument("--hold", type=float, default=0.5, help="每次上游调用的平均耗时（秒）")
+    parser.add_argument("--batch-clients", type=int, default=64, help="批量客户端的并发请求数")
+    parser.add_argument("--batch-weight", type=float, default=0.25, help="CLIENT_BATCH_WEIGHT")
+    parser.add_argument("--batch-share", type=float, default=0.75, help="GLM_BATCH_MAX_SHARE（fair+reserve 模式）")
+    parser.add_argument("--interactive-qps", type=float, default=2.0, help="交互请求的平均到达速率")
+    parser.add_argument("--interactive-users", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"GLM_MAX_IN_FLIGHT={args.max_in_flight}, upstream ~{args.hold}s, {args.batch_clients} batch streams, "
+          f"{args.interactive_qps} interactive req/s over {args.duration}s")
+    print(f"{'mode':<14} {'interactive wait p50 ms':>23} {'p99 ms':>9} {'max ms':>9} {'batch qps':>10} {'shed':>6}")
+    for label, fair, share in (("fifo", False, 1.0), ("fair", True, 1.0), ("fair+reserve", True, args.batch_share)):
+        result = asyncio.run(run_mode(args, fair, share))
+        interactive = result["interactive"]
+        print(
+            f"{label:<14} {interactive['p50']:>23.1f} {interactive['p99']:>9.1f} {interactive['max']:>9.1f} "
+            f"{result['batch_qps']:>10.2f} {result['shed']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+近似重复图片复用的误复用率测试
+
+语料目录按内容分组：同一子目录下的图片视为相同内容（重新编码、缩放、裁边等变体），
+不同子目录视为不同内容。未指定 --corpus 时生成合成语料：版式相同、文字不同的
+截图，只改动了一行文字的同一截图，以及只改动了一个数字的发票（字号 22/16/12，
+最容易误判的情况），每张再生成 JPEG 重存、缩放、裁边等变体。
+
+按不同的 dHash 汉明距离阈值和校验图分块差异阈值统计：
+- 正确复用率：同组图片对中通过两项判断的比例（越高越能省下上游调用）
+- 误复用率：不同组图片对中通过两项判断的比例（应为 0，否则会返回别的图片的识别结果），
+  分为“只改动一行文字或一个数字的同一图片”和“其他内容”两类
+并按上传顺序模拟 PerceptualIndex，统计实际返回错误结果的次数。
+
+用法：
+    python benchmarks/bench_near_duplicates.py [--corpus path/to/corpus] [--documents 30] [--thresholds 4 8 12 16 24]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from io import BytesIO
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+WORDS = ["识别", "模糊", "文字", "截图", "会议", "纪要", "预算", "UnblurAI", "report", "invoice",
+         "2024", "合同", "版本", "deadline", "客户", "确认", "发票", "金额", "today", "notes"]
+
+
+def encode(image, fmt: str = "PNG", **options) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def random_lines(rng: random.Random) -> List[str]:
+    title = " ".join(rng.choice(WORDS) for _ in range(3))
+    return [title] + [" ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 8))) for _ in range(rng.randint(6, 9))]
+
+
+def make_screenshot(lines: List[str]):
+    """版式固定的聊天截图样式：标题栏 + 若干行文字"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (720, 480), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 720, 56), fill=(40, 120, 200))
+    draw.text((24, 14), lines[0], fill="white", font_size=24)
+    y = 80
+    for line in lines[1:]:
+        draw.text((24, y), line, fill=(30, 30, 30), font_size=22)
+        y += 42
+    return image
+
+
+def make_invoice(rows: List[Tuple[str, str]], font_size: int):
+    """发票样式：表头 + 若干行“项目 / 金额”，字号决定行距和图片尺寸"""
+    from PIL import Image, ImageDraw
+
+    line_height = int(font_size * 1.8)
+    image = Image.new("RGB", (font_size * 30, line_height * (len(rows) + 3)), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((font_size, font_size // 2), "INVOICE No. 2024-0815", fill="black", font_size=int(font_size * 1.3))
+    draw.line((font_size, line_height * 2 - 4, image.width - font_size, line_height * 2 - 4), fill="black", width=2)
+    for index, (item, amount) in enumerate(rows):
+        y = line_height * (index + 2)
+        draw.text((font_size, y), item, fill="black", font_size=font_size)
+        draw.text((image.width - font_size * 9, y), amount, fill="black", font_size=font_size)
+    return image
+
+
+def random_invoice(rng: random.Random) -> List[Tuple[str, str]]:
+    return [
+        (" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))), f"{rng.randint(10, 99999)}.{rng.randint(0, 99):02d}")
+        for _ in range(rng.randint(5, 8))
+    ]
+
+
+def edit_digit(rows: List[Tuple[str, str]], rng: random.Random) -> List[Tuple[str, str]]:
+    """把某一行金额中的一个数字换成另一个数字"""
+    edited = list(rows)
+    row = rng.randrange(len(rows))
+    item, amount = rows[row]
+    positions = [i for i, char in enumerate(amount) if char.isdigit()]
+    position = rng.choice(positions)
+    digit = rng.choice([d for d in "0123456789" if d != amount[position]])
+    edited[row] = (item, amount[:position] + digit + amount[position + 1:])
+    return edited
+
+
+def variants(image, rng: random.Random) -> List[bytes]:
+    """常见的重新上传变体：JPEG 重存、聊天软件缩放、少量裁边"""
+    width, height = image.size
+    scale = rng.uniform(0.5, 0.9)
+    crop = rng.randint(2, 12)
+    return [
+        encode(image.convert("RGB"), "JPEG", quality=rng.randint(60, 85)),
+        encode(image.resize((int(width * scale), int(height * scale))), "JPEG", quality=80),
+        encode(image.crop((crop, crop, width - crop, height - crop))),
+        encode(image.resize((int(width * scale), int(height * scale))).crop((crop, crop, int(width * scale) - crop, int(height * scale) - crop))),
+    ]
+
+
+def synthetic_corpus(documents: int, seed: int) -> Dict[str, List[bytes]]:
+    """每篇文档另有一个只改动一行文字（截图）或一个数字（发票）的版本，作为不同内容（最难区分的负样本）"""
+    rng = random.Random(seed)
+    corpus = {}
+    for index in range(documents):
+        lines = random_lines(rng)
+        edited = list(lines)
+        row = rng.randrange(1, len(lines))
+        edited[row] = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 8)))
+        for label, content in ((f"doc-{index}", lines), (f"doc-{index}-edited", edited)):
+            image = make_screenshot(content)
+            corpus[label] = [encode(image)] + variants(image, rng)
+    for index in range(documents):
+        rows = random_invoice(rng)
+        edited = edit_digit(rows, rng)
+        font_size = (22, 16, 12)[index % 3]
+        for label, content in ((f"invoice-{index}", rows), (f"invoice-{index}-edited", edited)):
+            image = make_invoice(content, font_size)
+            corpus[label] = [encode(image)] + variants(image, rng)
+    return corpus
+
+
+def load_corpus(path: str) -> Dict[str, List[bytes]]:
+    corpus = {}
+    for label in sorted(os.listdir(path)):
+        directory = os.path.join(path, label)
+        if not os.path.isdir(directory):
+            continue
+        files = sorted(os.listdir(directory))
+        corpus[label] = [open(os.path.join(directory, name), "rb").read() for name in files]
+    return corpus
+
+
+def main() -> None:
+    from app.services.perceptual_index import PerceptualIndex, hamming, image_fingerprint, confirm_distance
+    from app.utils.image_validation import ValidatedImage
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="按内容分子目录的标注语料")
+    parser.add_argument("--documents", type=int, default=30, help="合成语料的截图和发票数")
+    parser.add_argument("--hash-size", type=int, default=16)
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[4, 8, 12, 24])
+    parser.add_argument("--block-diffs", type=int, nargs="+", default=[6, 10, 14, 169],
+                        help="校验图分块内无法匹配的像素数阈值（窗口为 13x13，169 相当于不做二次校验）")
+    parser.add_argument("--seed", type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.documents, args.seed)
+    start = time.perf_counter()
+    samples: List[Tuple[str, object]] = [
+        (label, image_fingerprint(ValidatedImage.from_bytes(data, max_size=len(data)).grayscale(), args.hash_size))
+        for label, items in corpus.items() for data in items
+    ]
+    elapsed = (time.perf_counter() - start) / len(samples)
+    print(f"{len(corpus)} documents, {len(samples)} images, {args.hash_size * args.hash_size}-bit dHash, "
+          f"{elapsed * 1000:.1f}ms per fingerprint")
+
+    # 图片对分类：same（同一内容）、edited（同一图片改动一行文字或一个数字，仅合成语料）、different（其他内容）
+    pairs: Dict[str, List[Tuple[int, int]]] = {"same": [], "edited": [], "different": []}
+    max_threshold = max(args.thresholds)
+    for (label_a, a), (label_b, b) in combinations(samples, 2):
+        if label_a == label_b:
+            kind = "same"
+        elif label_a.replace("-edited", "") == label_b.replace("-edited", ""):
+            kind = "edited"
+        else:
+            kind = "different"
+        # 宽高比差异过大的图片不会被复用，与 PerceptualIndex 的判断保持一致
+        if abs(a.aspect - b.aspect) > 0.05 * a.aspect:
+            pairs[kind].append((10 ** 6, 10 ** 6))
+            continue
+        distance = hamming(a.hash, b.hash)
+        block_diff = confirm_distance(a, b) if distance <= max_threshold else 10 ** 6
+        pairs[kind].append((distance, block_diff))
+
+    def rate(kind: str, threshold: int, block_limit: int) -> str:
+        items = pairs[kind]
+        if not items:
+            return "-"
+        matched = sum(distance <= threshold and block_diff <= block_limit for distance, block_diff in items)
+        return f"{matched / len(items):.3%}"
+
+    print(f"\n{'dHash':>6} {'block':>6} {'true reuse':>11} {'false:edited':>13} {'false:other':>12} {'index hits':>11} {'wrong':>6}")
+    for threshold in args.thresholds:
+        for block_limit in args.block_diffs:
+            # 模拟按顺序上传：每张图片先查索引，未命中则写入
+            index = PerceptualIndex(hash_size=args.hash_size, max_distance=threshold, max_block_diff=block_limit)
+            order = list(range(len(samples)))
+            random.Random(args.seed).shuffle(order)
+            hits = wrong = 0
+            for position in order:
+                label, fingerprint = samples[position]
+                match = index.find(fingerprint, "context")
+                if match is None:
+                    index.add(fingerprint, "context", f"{label}#{position}")
+                    continue
+                hits += 1
+                if match.split("#")[0] != label:
+                    wrong += 1
+            print(f"{threshold:>6} {block_limit:>6} {rate('same', threshold, block_limit):>11} "
+                  f"{rate('edited', threshold, block_limit):>13} {rate('different', threshold, block_limit):>12} "
+                  f"{hits:>11} {wrong:>6}")
+
+
+if __name__ == "__main__":
+    import logging
+
+    logging.disable(logging.INFO)
+    main()
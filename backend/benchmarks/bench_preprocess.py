@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+图片预处理基准测试
+
+对一组模糊文字样本图片，分别在不同预处理配置下测量编码耗时和
+base64 后的请求体大小。未指定 --corpus 时自动生成合成样本。
+
+用法：
+    python benchmarks/bench_preprocess.py [--corpus DIR] [--count 12]
+"""
+
+import argparse
+import base64
+import os
+import random
+import statistics
+import sys
+import time
+from io import BytesIO
+from typing import List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from app.services.image_preprocess import PreprocessConfig, preprocess_image  # noqa: E402
+from app.utils.image_validation import ValidatedImage  # noqa: E402
+
+SETTINGS = {
+    "passthrough(png)": PreprocessConfig(max_edge=0, output_format="PNG"),
+    "auto": PreprocessConfig(),
+    "auto+max1600": PreprocessConfig(max_edge=1600),
+    "auto+max1024": PreprocessConfig(max_edge=1024),
+    "gray+crop": PreprocessConfig(grayscale=True, crop_to_content=True),
+    "gray+crop+max1024": PreprocessConfig(max_edge=1024, grayscale=True, crop_to_content=True),
+    "webp": PreprocessConfig(output_format="WEBP"),
+}
+
+
+def synthetic_corpus(count: int) -> List[Tuple[str, bytes]]:
+    """生成带模糊文字的截图样本（不同尺寸、模糊半径和留白）"""
+    rng = random.Random(42)
+    corpus = []
+    for i in range(count):
+        width, height = rng.choice([(1280, 720), (1920, 1080), (2560, 1440), (3000, 4000)])
+        image = Image.new("RGB", (width, height), "white")
+        draw = ImageDraw.Draw(image)
+        margin = rng.randint(40, 400)
+        y = margin
+        while y < height - margin:
+            words = " ".join(rng.choice(["UnblurAI", "blurred", "text", "模糊文字", "sample", "2024"]) for _ in range(12))
+            draw.text((margin, y), words, fill=(rng.randint(0, 60),) * 3, font_size=rng.randint(18, 36))
+            y += rng.randint(30, 60)
+        image = image.filter(ImageFilter.GaussianBlur(rng.uniform(1.0, 3.0)))
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        corpus.append((f"synthetic_{i}.png", buffer.getvalue()))
+    return corpus
+
+
+def load_corpus(directory: str) -> List[Tuple[str, bytes]]:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".png", ".jpg", ".jpeg")):
+            with open(os.path.join(directory, name), "rb") as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", help="样本图片目录（JPG/PNG）")
+    parser.add_argument("--count", type=int, default=12, help="合成样本数量")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.count)
+    raw_payload = statistics.mean(len(base64.b64encode(data)) for _, data in corpus)
+    print(f"corpus: {len(corpus)} images, mean raw base64 payload {raw_payload / 1024:.1f} KiB")
+    print(f"{'setting':<22} {'mean ms':>9} {'p95 ms':>9} {'payload KiB':>12} {'vs raw':>8}")
+
+    for name, config in SETTINGS.items():
+        times, payloads = [], []
+        for _, data in corpus:
+            # 计时包含解码（服务中解码由预处理和难度评估等阶段共用）
+            start = time.perf_counter()
+            result = preprocess_image(ValidatedImage.from_bytes(data, max_size=len(data)), config)
+            times.append((time.perf_counter() - start) * 1000)
+            payloads.append(len(base64.b64encode(result.data)))
+        times.sort()
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        mean_payload = statistics.mean(payloads)
+        print(
+            f"{name:<22} {statistics.mean(times):>9.1f} {p95:>9.1f} "
+            f"{mean_payload / 1024:>12.1f} {mean_payload / raw_payload:>7.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
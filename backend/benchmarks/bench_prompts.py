@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+提示词精简、输出上限和长文本分段微调的效果测试
+
+1. 各版本提示词模板的估计 token 数（每次识别、微调都会重复发送的固定部分）
+2. 针对本地模拟 GLM 接口微调若干篇长文档，对比：
+   - v1 single：原提示词，整篇一次发送（改动前的行为）
+   - v2 single：精简提示词，整篇一次发送
+   - v2 chunked：精简提示词，按段落切分为不超过 REFINE_CHUNK_TOKENS 的分段并发微调
+   统计端到端延迟、上游调用次数、输入/输出 token 数和设置的 max_tokens 总和。
+
+模拟接口回显微调请求的用户消息（FAKE_GLM_TEXT_ECHO），并按输出长度增加
+FAKE_GLM_LATENCY_PER_TOKEN 的解码耗时，因此分段带来的上下文行也会计入输出，结果略偏保守。
+
+用法：
+    python benchmarks/bench_prompts.py [--documents 3] [--paragraphs 40] [--latency 0.3] [--per-token 0.002]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SENTENCES = [
+    "本季度项目整体进度符合预期，关键里程碑均已按时完成。",
+    "客户反馈集中在导出格式和批量处理速度两个方面。",
+    "下一阶段需要重点关注识别准确率在低光照场景下的表现。",
+    "The vendor confirmed the revised invoice on Tuesday.",
+    "预算执行率为百分之八十二，剩余部分将用于第四季度的扩容。",
+    "会议决定将发布时间推迟一周，以便完成回归测试。",
+    "Please review the attached contract before the deadline.",
+    "运维团队已完成数据库迁移，未发现数据丢失。",
+]
+
+MODES = (("v1 single", "1", "0"), ("v2 single", "2", "0"), ("v2 chunked", "2", None))
+
+
+def make_document(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(
+        "".join(rng.choice(SENTENCES) for _ in range(rng.randint(2, 6))) for _ in range(paragraphs)
+    )
+
+
+def template_tokens() -> None:
+    from app.services.prompts import PROMPT_SETS, PromptConfig, PromptManager
+
+    print(f"{'version':<8} {'recognition':>12} {'refine':>8} {'tune':>6} {'region':>8}")
+    for version in sorted(PROMPT_SETS):
+        manager = PromptManager(PromptConfig(version=version))
+        templates = manager.templates
+        fixed = lambda template: manager.estimate_tokens(template.format(text="", instruction="", lines="", history=""))
+        region = manager.estimate_tokens(manager.region_prompt("", ""))
+        print(f"{version:<8} {fixed(templates.recognition):>12} {fixed(templates.refine):>8} {fixed(templates.tune):>6} {region:>8}")
+
+
+async def run_mode(documents: List[str], instruction: str) -> Dict:
+    from app.services.zhipuai_service import ZhipuAIService
+    from app.utils.stats import latency_summary
+
+    service = ZhipuAIService()
+    latencies = []
+    totals: Dict[str, int] = {}
+    for document in documents:
+        start = time.perf_counter()
+        result = await service.refine_text(document, instruction, thinking="disabled")
+        latencies.append(time.perf_counter() - start)
+        for key, value in result.usage.items():
+            totals[key] = totals.get(key, 0) + value
+    await service.aclose()
+    return {"latency": latency_summary(latencies, (50,)), "usage": totals}
+
+
+async def main_async(args) -> None:
+    import logging
+
+    logging.disable(logging.WARNING)
+    rng = random.Random(args.seed)
+    documents = [make_document(rng, args.paragraphs) for _ in range(args.documents)]
+    instruction = "修正错别字并统一标点，保持原有段落"
+    template_tokens()
+    print(f"\n{len(documents)} documents, ~{sum(map(len, documents)) // len(documents)} chars each, "
+          f"upstream {args.latency}s + {args.per_token * 1000:.1f}ms/token, chunk {args.chunk_tokens} tokens x {args.chunk_concurrency}")
+    print(f"{'mode':<11} {'p50':>7} {'max':>7} {'calls':>6} {'prompt':>8} {'completion':>11} {'max_tokens':>11} {'truncated':>10}")
+    for label, version, chunk_tokens in MODES:
+        os.environ["PROMPT_VERSION"] = version
+        os.environ["REFINE_CHUNK_TOKENS"] = chunk_tokens or str(args.chunk_tokens)
+        result = await run_mode(documents, instruction)
+        latency, usage = result["latency"], result["usage"]
+        print(
+            f"{label:<11} {latency['p50']:>6.2f}s {latency['max']:>6.2f}s {usage['upstream_calls']:>6} "
+            f"{usage['prompt_tokens']:>8} {usage['completion_tokens']:>11} {usage['max_tokens']:>11} {usage['truncated']:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=3)
+    parser.add_argument("--paragraphs", type=int, default=40, help="每篇文档的段落数")
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟上游基础延迟（秒）")
+    parser.add_argument("--per-token", type=float, default=0.002, help="每个输出 token 的解码耗时（秒）")
+    parser.add_argument("--chunk-tokens", type=int, default=1200, help="REFINE_CHUNK_TOKENS（v2 chunked）")
+    parser.add_argument("--chunk-concurrency", type=int, default=4, help="REFINE_CHUNK_CONCURRENCY")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    os.environ["ZHIPUAI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    # 关闭缓存，保证每次都调用上游
+    os.environ["RECOGNITION_CACHE_ENABLED"] = "false"
+    os.environ["REFINE_CHUNK_CONCURRENCY"] = str(args.chunk_concurrency)
+    os.chdir(BACKEND_DIR)
+
+    import fake_glm_server
+
+    fake_glm_server.FAKE_GLM_LATENCY = args.latency
+    fake_glm_server.FAKE_GLM_LATENCY_PER_TOKEN = args.per_token
+    fake_glm_server.FAKE_GLM_TEXT_ECHO = True
+    server = fake_glm_server.start_in_thread(port=args.port)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+GLM 调用韧性层故障注入压测
+
+针对本地模拟 GLM 接口注入故障，对比开启/关闭各项策略时的成功率和尾延迟：
+- 偶发 500：重试开启 vs 关闭
+- 上游挂起：读超时 + 重试，请求不再无限等待
+- 慢尾请求：对冲开启 vs 关闭的 p99
+- 持续故障：熔断后快速失败
+
+用法：
+    python benchmarks/bench_resilience.py [--requests 200] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_glm_server  # noqa: E402
+
+
+def set_faults(**faults: float) -> None:
+    """重置并设置模拟服务的故障注入参数"""
+    fake_glm_server.FAKE_GLM_ERROR_RATE = faults.get("error_rate", 0)
+    fake_glm_server.FAKE_GLM_HANG_RATE = faults.get("hang_rate", 0)
+    fake_glm_server.FAKE_GLM_HANG_SECONDS = faults.get("hang_seconds", 600)
+    fake_glm_server.FAKE_GLM_SLOW_RATE = faults.get("slow_rate", 0)
+    fake_glm_server.FAKE_GLM_SLOW_LATENCY = faults.get("slow_latency", 5)
+
+
+async def run_scenario(client, caller, total: int, concurrency: int, hedge: bool) -> Tuple[int, List[float], float]:
+    """并发发送 total 个请求，返回 (成功数, 每个请求耗时, 总耗时)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    succeeded = 0
+
+    async def one() -> None:
+        nonlocal succeeded
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await caller.call(
+                    lambda: client.create_chat_completion(model="glm-4.5v", messages=[{"role": "user", "content": "ping"}]),
+                    hedge=hedge,
+                )
+                succeeded += 1
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return succeeded, latencies, time.perf_counter() - start
+
+
+def report(name: str, total: int, result: Tuple[int, List[float], float], caller) -> None:
+    from app.utils.stats import latency_summary
+
+    succeeded, latencies, elapsed = result
+    summary = latency_summary(latencies)
+    stats = caller.stats()
+    print(
+        f"{name:<28} ok={succeeded:>4}/{total:<4} p50={summary['p50']:>6.2f}s "
+        f"p99={summary['p99']:>6.2f}s max={summary['max']:>6.2f}s elapsed={elapsed:>6.2f}s "
+        f"retries={stats['retries']} hedges={stats['hedges']} rejected={stats['circuit_rejected']}"
+    )
+
+
+async def main_async(args) -> None:
+    import logging
+    from app.services.glm_client import AsyncGLMClient
+    from app.services.resilience import CircuitBreaker, ResilientCaller
+
+    logging.disable(logging.WARNING)
+    base_url = f"http://127.0.0.1:{args.port}"
+    latency = fake_glm_server.FAKE_GLM_LATENCY
+
+    def new_caller(**kwargs) -> ResilientCaller:
+        # 熔断阈值设得很高，避免干扰前三个场景
+        kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=10 ** 6))
+        return ResilientCaller(base_delay=0.05, max_delay=0.5, **kwargs)
+
+    client = AsyncGLMClient("bench-key", base_url, timeout=args.timeout)
+    # 慢尾场景使用较长的读超时，使慢请求能够完成而不是超时重试
+    patient_client = AsyncGLMClient("bench-key", base_url, timeout=args.slow_latency * 2)
+    try:
+        print(f"upstream_latency={latency}s requests={args.requests} concurrency={args.concurrency}\n")
+
+        print("== 偶发 500（20%）==")
+        set_faults(error_rate=0.2)
+        for name, attempts in (("retries off", 1), ("retries on (3 attempts)", 3)):
+            caller = new_caller(max_attempts=attempts)
+            report(name, args.requests, await run_scenario(client, caller, args.requests, args.concurrency, False), caller)
+
+        print(f"\n== 上游挂起（5%，读超时 {args.timeout}s）==")
+        set_faults(hang_rate=0.05)
+        for name, attempts in (("timeout only", 1), ("timeout + retries", 3)):
+            caller = new_caller(max_attempts=attempts)
+            report(name, args.requests, await run_scenario(client, caller, args.requests, args.concurrency, False), caller)
+
+        print(f"\n== 慢尾请求（5% 延迟 {args.slow_latency}s）==")
+        set_faults(slow_rate=0.05, slow_latency=args.slow_latency)
+        for name, hedge in (("hedging off", False), ("hedging on (p95)", True)):
+            caller = new_caller(hedge_enabled=hedge, hedge_min_samples=20)
+            # 预热：积累延迟样本以确定对冲阈值
+            await run_scenario(patient_client, caller, 40, args.concurrency, hedge)
+            caller.hedges = caller.hedge_wins = 0
+            report(name, args.requests, await run_scenario(patient_client, caller, args.requests, args.concurrency, hedge), caller)
+
+        print("\n== 持续故障（100% 500）==")
+        set_faults(error_rate=1.0)
+        for name, threshold in (("breaker off", 10 ** 6), ("breaker on (5 failures)", 5)):
+            caller = new_caller(max_attempts=3, breaker=CircuitBreaker(failure_threshold=threshold, recovery_timeout=30))
+            report(name, args.requests, await run_scenario(client, caller, args.requests, args.concurrency, False), caller)
+    finally:
+        set_faults()
+        await client.aclose()
+        await patient_client.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟上游正常延迟（秒）")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="慢尾请求延迟（秒）")
+    parser.add_argument("--timeout", type=float, default=1.0, help="读超时（秒）")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    fake_glm_server.FAKE_GLM_LATENCY = args.latency
+    server = fake_glm_server.start_in_thread(port=args.port)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+多工作进程共享状态（SHARED_STATE_DIR）与进程内独立状态的对比测试
+
+启动 N 个工作进程，模拟负载均衡把请求随机分配到各进程：
+
+- 识别缓存：按 Zipf 分布访问一组图片，未命中时模拟一次上游调用后写入缓存。
+  统计命中率、实际上游调用次数、缓存查询延迟（含 SQLite 共享层）和各进程内存层占用。
+- 限流器：各进程以相同并发持续请求上游名额，统计整个服务的峰值在途数和实际速率，
+  与配置的 GLM_MAX_IN_FLIGHT / GLM_RATE_LIMIT_QPS 比较（独立状态下上限随进程数成倍增加）。
+
+用法：
+    python benchmarks/bench_shared_state.py [--workers 4] [--requests 4000] [--keys 1000] [--max-in-flight 8] [--qps 40]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def cache_worker(shared_dir: str, keys: List[int], upstream_latency: float, start_at: float, results) -> None:
+    if shared_dir:
+        os.environ["SHARED_STATE_DIR"] = shared_dir
+    os.environ["RECOGNITION_CACHE_MAX_ENTRIES"] = os.environ.get("BENCH_MEMORY_ENTRIES", "1024")
+    from app.services.result_cache import RecognitionCache, create_recognition_cache
+
+    cache = create_recognition_cache()
+    value = "模拟识别结果 fake recognition result " * 20
+    lookups: List[float] = []
+    upstream_calls = 0
+
+    async def run() -> None:
+        nonlocal upstream_calls
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        for key in keys:
+            cache_key = RecognitionCache.make_key(str(key), "prompt", "glm-4.5v", "enabled")
+            start = time.perf_counter()
+            cached = await cache.get(cache_key)
+            lookups.append(time.perf_counter() - start)
+            if cached is None:
+                upstream_calls += 1
+                await asyncio.sleep(upstream_latency)
+                await cache.set(cache_key, value)
+
+    asyncio.run(run())
+    stats = cache.stats()
+    results.put({"lookups": lookups, "upstream_calls": upstream_calls, **stats})
+
+
+def limiter_worker(shared_dir: str, concurrency: int, hold: float, duration: float, start_at: float, results) -> None:
+    if shared_dir:
+        os.environ["SHARED_STATE_DIR"] = shared_dir
+    from app.services.rate_limiter import UpstreamOverloadedError, create_upstream_limiter
+
+    limiter = create_upstream_limiter(name="bench")
+    intervals: List[Tuple[float, float]] = []
+    shed = 0
+
+    async def client() -> None:
+        nonlocal shed
+        while time.time() < start_at + duration:
+            try:
+                async with limiter.slot():
+                    begin = time.time()
+                    await asyncio.sleep(hold)
+                    intervals.append((begin, time.time()))
+            except UpstreamOverloadedError:
+                shed += 1
+
+    async def run() -> None:
+        await asyncio.sleep(max(start_at - time.time(), 0))
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    logging_off()
+    asyncio.run(run())
+    results.put({"intervals": intervals, "shed": shed})
+
+
+def logging_off() -> None:
+    import logging
+    logging.disable(logging.WARNING)
+
+
+def run_processes(target, args_list) -> List[Dict]:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [context.Process(target=target, args=(*args, results)) for args in args_list]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return collected
+
+
+def peak_concurrency(intervals: List[Tuple[float, float]]) -> int:
+    events = sorted([(begin, 1) for begin, _ in intervals] + [(end, -1) for _, end in intervals])
+    current = peak = 0
+    for _, delta in events:
+        current += delta
+        peak = max(peak, current)
+    return peak
+
+
+def bench_cache(args, shared_dir: str) -> Dict:
+    from app.utils.stats import latency_summary
+
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(args.keys)]
+    stream = rng.choices(range(args.keys), weights=weights, k=args.requests)
+    # 负载均衡随机分配到各工作进程
+    assignment: List[List[int]] = [[] for _ in range(args.workers)]
+    for key in stream:
+        assignment[rng.randrange(args.workers)].append(key)
+
+    start_at = time.time() + 2
+    results = run_processes(cache_worker, [(shared_dir, keys, args.upstream_latency, start_at) for keys in assignment])
+    lookups = [value for result in results for value in result["lookups"]]
+    upstream_calls = sum(result["upstream_calls"] for result in results)
+    return {
+        "hit_rate": 1 - upstream_calls / len(stream),
+        "upstream_calls": upstream_calls,
+        "lookup": latency_summary([value * 1000 for value in lookups], (50, 99)),
+        "memory_entries": sum(result["entries"] for result in results),
+        "memory_bytes": sum(result["bytes"] for result in results),
+        "distinct_keys": len(set(stream)),
+    }
+
+
+def bench_limiter(args, shared_dir: str) -> Dict:
+    start_at = time.time() + 2
+    results = run_processes(
+        limiter_worker,
+        [(shared_dir, args.clients, args.hold, args.duration, start_at) for _ in range(args.workers)],
+    )
+    intervals = [interval for result in results for interval in result["intervals"]]
+    # 测试窗口结束前已排队的请求会在窗口之后完成，速率只统计窗口内开始的调用
+    started = [begin for begin, _ in intervals if begin < start_at + args.duration]
+    return {
+        "peak_in_flight": peak_concurrency(intervals),
+        "qps": len(started) / args.duration,
+        "shed": sum(result["shed"] for result in results),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--zipf", type=float, default=1.0, help="Zipf 分布指数，越大热点越集中")
+    parser.add_argument("--upstream-latency", type=float, default=0.005, help="缓存未命中时模拟的上游耗时（秒）")
+    parser.add_argument("--memory-entries", type=int, default=1024, help="每个进程的内存层条目上限")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="GLM_MAX_IN_FLIGHT")
+    parser.add_argument("--qps", type=float, default=40, help="GLM_RATE_LIMIT_QPS")
+    parser.add_argument("--clients", type=int, default=16, help="每个进程的并发请求数")
+    parser.add_argument("--hold", type=float, default=0.1, help="每次上游调用占用名额的时长（秒）")
+    parser.add_argument("--duration", type=float, default=4.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    os.chdir(BACKEND_DIR)
+    os.environ["BENCH_MEMORY_ENTRIES"] = str(args.memory_entries)
+    os.environ["GLM_MAX_IN_FLIGHT"] = str(args.max_in_flight)
+    os.environ["GLM_RATE_LIMIT_QPS"] = str(args.qps)
+    os.environ["GLM_RATE_LIMIT_BURST"] = str(args.max_in_flight)
+    os.environ["GLM_MAX_QUEUE_WAIT"] = str(args.duration)
+    os.environ.pop("RECOGNITION_CACHE_DB", None)
+    os.environ.pop("SHARED_STATE_DIR", None)
+
+    print(f"{args.workers} workers, {args.requests} requests over {args.keys} keys (zipf {args.zipf}), "
+          f"memory tier {args.memory_entries} entries/worker")
+    print(f"{'cache':<13} {'hit rate':>9} {'upstream':>9} {'p50 ms':>8} {'p99 ms':>8} {'mem entries':>12} {'mem MB':>7}")
+    modes = [("per-process", None), ("shared", "shared"), ("shared, no L1", "shared")]
+    for label, shared in modes:
+        with tempfile.TemporaryDirectory() as directory:
+            os.environ["BENCH_MEMORY_ENTRIES"] = "0" if label == "shared, no L1" else str(args.memory_entries)
+            result = bench_cache(args, directory if shared else "")
+        print(
+            f"{label:<13} {result['hit_rate']:>9.1%} {result['upstream_calls']:>9} "
+            f"{result['lookup']['p50']:>8.3f} {result['lookup']['p99']:>8.3f} "
+            f"{result['memory_entries']:>12} {result['memory_bytes'] / 1024 / 1024:>7.2f}"
+        )
+    print(f"(best possible hit rate: {1 - result['distinct_keys'] / args.requests:.1%})")
+
+    print(f"\nlimiter: GLM_MAX_IN_FLIGHT={args.max_in_flight}, GLM_RATE_LIMIT_QPS={args.qps}, "
+          f"{args.clients} clients/worker holding {args.hold}s")
+    print(f"{'limiter':<13} {'peak in-flight':>15} {'qps':>8} {'shed':>6}")
+    for label, shared in (("per-process", False), ("shared", True)):
+        with tempfile.TemporaryDirectory() as directory:
+            result = bench_limiter(args, directory if shared else "")
+        print(f"{label:<13} {result['peak_in_flight']:>15} {result['qps']:>8.1f} {result['shed']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+后端冷启动耗时测试
+
+每轮在全新的子进程中测量：导入 main（模块加载、路由注册）、执行 lifespan
+启动（创建共享服务、启动任务工作协程）以及首个 /api/health 请求的耗时。
+取多轮中位数，超过 --budget 时以非零状态退出，可直接用于 CI 检查启动回归。
+
+用法：
+    python benchmarks/bench_startup.py [--runs 5] [--budget 1.5] [--importtime 15]
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中执行，输出一行 JSON
+CHILD_SCRIPT = r"""
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def boot():
+    import httpx
+    async with main.app.router.lifespan_context(main.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/health")
+            response.raise_for_status()
+        return started, time.perf_counter()
+
+started, first_request = asyncio.run(boot())
+print(json.dumps({
+    "import": imported - start,
+    "lifespan": started - imported,
+    "first_request": first_request - started,
+    "total": first_request - start,
+}))
+"""
+
+
+def child_env(tmpdir: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    env["JOB_QUEUE_DB"] = os.path.join(tmpdir, "jobs.db")
+    env["LOG_FILE"] = ""
+    return env
+
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def print_importtime(env: dict, top: int) -> None:
+    """用 -X importtime 列出自身导入耗时最高的模块"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in output.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            rows.append((int(match.group(1)), int(match.group(2)), match.group(4)))
+    print(f"\ntop {top} modules by self import time")
+    print(f"{'self(ms)':>10} {'cumulative(ms)':>15}  module")
+    for self_us, cumulative_us, module in sorted(rows, reverse=True)[:top]:
+        print(f"{self_us / 1000:>10.1f} {cumulative_us / 1000:>15.1f}  {module}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="冷启动总耗时中位数上限（秒）")
+    parser.add_argument("--importtime", type=int, default=0, help="列出导入耗时最高的 N 个模块")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = child_env(tmpdir)
+        # 先预热一次，生成字节码缓存，后续各轮测量的都是常规的冷启动
+        run_once(env)
+        results = [run_once(env) for _ in range(args.runs)]
+
+        print(f"cold start over {args.runs} runs (median / max)")
+        for phase in ("import", "lifespan", "first_request", "total"):
+            values = [result[phase] for result in results]
+            print(f"  {phase:<14} {statistics.median(values) * 1000:>8.1f}ms {max(values) * 1000:>8.1f}ms")
+
+        if args.importtime:
+            print_importtime(env, args.importtime)
+
+    median_total = statistics.median(result["total"] for result in results)
+    if median_total > args.budget:
+        print(f"\nFAIL: median cold start {median_total:.3f}s exceeds budget {args.budget:.3f}s")
+        sys.exit(1)
+    print(f"\nOK: median cold start {median_total:.3f}s within budget {args.budget:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+/api/upload-stream 首字节时间（TTFB）测试
+
+针对本地模拟的 GLM 流式接口，测量 /api/upload-stream 的
+首字节时间、首个识别文字增量时间和总耗时。
+
+用法：
+    python benchmarks/bench_stream_ttfb.py [--requests 10] [--first-chunk 0.2] [--interval 0.05]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_sample_image(seed: int) -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    # 每个请求使用不同图片，避免命中识别结果缓存
+    Image.new("RGB", (200, 80), (seed % 256, 255, 255)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def measure(client, seed: int):
+    """返回 (首字节时间, 首个文字增量时间, 总耗时, 识别结果)"""
+    start = time.perf_counter()
+    first_byte = first_delta = None
+    text = None
+    async with client.stream(
+        "POST",
+        "/api/upload-stream",
+        files={"file": ("sample.png", make_sample_image(seed), "image/png")},
+    ) as response:
+        async for line in response.aiter_lines():
+            now = time.perf_counter() - start
+            if first_byte is None:
+                first_byte = now
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event["type"] == "delta" and first_delta is None:
+                first_delta = now
+            elif event["type"] == "success":
+                text = event["recognized_text"]
+            elif event["type"] == "error":
+                raise RuntimeError(event["message"])
+    return first_byte, first_delta, time.perf_counter() - start, text
+
+
+async def main_async(args) -> None:
+    import httpx
+
+    # 通过真实 HTTP 连接访问，ASGITransport 会缓冲整个响应，无法测量 TTFB
+    base_url = f"http://127.0.0.1:{args.port + 1}"
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        results = [await measure(client, seed) for seed in range(args.requests)]
+
+    assert all(text == "模拟识别结果\nfake result" for *_, text in results), results
+    for label, index in (("TTFB", 0), ("first text delta", 1), ("total", 2)):
+        values = [result[index] * 1000 for result in results]
+        print(f"{label:<18} mean {statistics.mean(values):8.1f} ms   max {max(values):8.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--first-chunk", type=float, default=0.2, help="模拟上游首个数据块延迟（秒）")
+    parser.add_argument("--interval", type=float, default=0.05, help="模拟上游数据块间隔（秒）")
+    parser.add_argument("--port", type=int, default=18081, help="模拟上游端口，后端使用 port+1")
+    args = parser.parse_args()
+
+    os.environ["FAKE_GLM_FIRST_CHUNK_LATENCY"] = str(args.first_chunk)
+    os.environ["FAKE_GLM_CHUNK_INTERVAL"] = str(args.interval)
+    os.environ["ZHIPUAI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    os.chdir(BACKEND_DIR)
+    os.makedirs("logs", exist_ok=True)
+
+    import logging
+    import fake_glm_server
+    from main import app
+
+    logging.disable(logging.INFO)
+
+    upstream = fake_glm_server.start_in_thread(port=args.port)
+    backend = fake_glm_server.start_in_thread(port=args.port + 1, asgi_app=app)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        backend.should_exit = True
+        upstream.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+按图片难度选择思考模式的效果测试
+
+生成清晰截图和退化版本（高斯模糊、低分辨率放大、低对比度、暗光、JPEG 低质量、噪点照片），
+针对本地模拟 GLM 接口分别以 THINKING_MODE=enabled（全部开启思考）和 auto（按难度选择）
+识别同一批图片，统计端到端延迟、开启思考的调用占比、难度评估耗时，以及难度判断与
+样本标签的一致程度（清晰图片关闭思考、退化图片保留思考）。
+
+模拟接口对开启思考的请求额外增加 FAKE_GLM_THINKING_LATENCY 秒，只能反映延迟变化；
+关闭思考对识别准确率的影响需要在真实接口和标注样本上评估。
+
+用法：
+    python benchmarks/bench_thinking.py [--latency 0.3] [--thinking-latency 1.5] [--images 40] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from io import BytesIO
+from typing import List, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ["识别", "模糊", "文字", "截图", "会议", "纪要", "预算", "UnblurAI", "report", "invoice",
+         "2024", "合同", "版本", "deadline", "客户", "确认", "发票", "金额", "today", "notes"]
+
+
+def make_screenshot(rng: random.Random):
+    """聊天或文档截图样式：标题栏 + 若干行文字"""
+    from PIL import Image, ImageDraw
+
+    width, height = rng.choice([(720, 480), (1080, 720), (1280, 1600)])
+    image = Image.new("RGB", (width, height), (245, 245, 245))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, 56), fill=(40, 120, 200))
+    draw.text((24, 14), " ".join(rng.choice(WORDS) for _ in range(3)), fill="white", font_size=24)
+    font_size = rng.choice([16, 20, 24])
+    y = 80
+    while y < height - font_size * 2:
+        draw.text((24, y), " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 10))), fill=(30, 30, 30), font_size=font_size)
+        y += int(font_size * 1.8)
+    return image
+
+
+def degrade(image, rng: random.Random):
+    """返回 (退化类型, 图片)"""
+    from PIL import Image, ImageEnhance, ImageFilter
+
+    kind = rng.choice(["blur", "upscaled", "low_contrast", "dark", "jpeg", "photo"])
+    width, height = image.size
+    if kind == "blur":
+        return kind, image.filter(ImageFilter.GaussianBlur(rng.uniform(1.2, 3)))
+    if kind == "upscaled":
+        factor = rng.choice([2, 3, 4])
+        return kind, image.resize((width // factor, height // factor)).resize((width, height))
+    if kind == "low_contrast":
+        return kind, ImageEnhance.Contrast(image).enhance(rng.uniform(0.15, 0.3))
+    if kind == "dark":
+        return kind, ImageEnhance.Brightness(image).enhance(rng.uniform(0.2, 0.35))
+    if kind == "jpeg":
+        buffer = BytesIO()
+        image.filter(ImageFilter.GaussianBlur(1)).save(buffer, format="JPEG", quality=rng.randint(5, 15))
+        return kind, Image.open(BytesIO(buffer.getvalue())).convert("RGB")
+    noise = Image.effect_noise((width, height), 60).convert("RGB")
+    return kind, Image.blend(image, noise, 0.5)
+
+
+def make_corpus(count: int, seed: int) -> List[Tuple[str, bytes]]:
+    """一半清晰截图、一半退化图片，返回 (标签, PNG 字节)"""
+    rng = random.Random(seed)
+    corpus = []
+    for index in range(count):
+        image = make_screenshot(rng)
+        label = "crisp"
+        if index % 2:
+            label, image = degrade(image, rng)
+        buffer = BytesIO()
+        image.save(buffer, format="PNG")
+        corpus.append((label, buffer.getvalue()))
+    return corpus
+
+
+async def run_mode(mode: str, corpus, concurrency: int):
+    from app.services.image_difficulty import estimate_difficulty
+    from app.services.zhipuai_service import ZhipuAIService
+    from app.utils.image_validation import ValidatedImage
+    from app.utils.stats import latency_summary
+
+    os.environ["THINKING_MODE"] = mode
+    service = ZhipuAIService()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    choices = []
+
+    async def one(label: str, data: bytes) -> None:
+        async with semaphore:
+            image = ValidatedImage.from_bytes(data, max_size=len(data))
+            start = time.perf_counter()
+            await service.recognize(image)
+            latencies.append(time.perf_counter() - start)
+            # 与服务内的判断相同，单独计算以便按样本标签统计
+            easy = mode == "auto" and service.thinking_config.is_easy(estimate_difficulty(image.grayscale()))
+            choices.append((label, "disabled" if easy else "enabled"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(label, data) for label, data in corpus))
+    wall = time.perf_counter() - start
+    stats = service.thinking_stats.stats()
+    await service.aclose()
+    return latency_summary(latencies), wall, choices, stats
+
+
+async def main_async(args) -> None:
+    import logging
+    import fake_glm_server
+
+    logging.disable(logging.INFO)
+    corpus = make_corpus(args.images, args.seed)
+    print(f"{len(corpus)} images ({sum(label == 'crisp' for label, _ in corpus)} crisp), "
+          f"upstream latency {args.latency}s + {args.thinking_latency}s with thinking, concurrency {args.concurrency}")
+    print(f"{'mode':<9} {'p50':>7} {'p95':>7} {'wall':>7} {'thinking':>9} {'estimate':>9} {'crisp skipped':>14} {'degraded kept':>14}")
+
+    results = {}
+    for mode in ("enabled", "auto"):
+        fake_glm_server.stats.clear()
+        summary, wall, choices, stats = await run_mode(mode, corpus, args.concurrency)
+        results[mode] = summary
+        crisp = [thinking for label, thinking in choices if label == "crisp"]
+        degraded = [thinking for label, thinking in choices if label != "crisp"]
+        print(
+            f"{mode:<9} {summary['p50']:>6.2f}s {summary['p95']:>6.2f}s {wall:>6.2f}s "
+            f"{fake_glm_server.stats['thinking'] / max(fake_glm_server.stats['requests'], 1):>9.0%} "
+            f"{stats['avg_estimate_ms']:>7.1f}ms "
+            f"{crisp.count('disabled') / max(len(crisp), 1):>14.0%} {degraded.count('enabled') / max(len(degraded), 1):>14.0%}"
+        )
+        if mode == "auto":
+            missed = sorted({label for label, thinking in choices if label != "crisp" and thinking == "disabled"})
+            if missed:
+                print(f"          degraded images routed without thinking: {', '.join(missed)}")
+
+    print(f"\np50 speedup: {results['enabled']['p50'] / max(results['auto']['p50'], 1e-9):.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.3, help="模拟上游基础延迟（秒）")
+    parser.add_argument("--thinking-latency", type=float, default=1.5, help="开启思考时的额外延迟（秒）")
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    os.environ["ZHIPUAI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    # 关闭缓存，保证每次都调用上游
+    os.environ["RECOGNITION_CACHE_ENABLED"] = "false"
+    os.chdir(BACKEND_DIR)
+
+    import fake_glm_server
+
+    fake_glm_server.FAKE_GLM_LATENCY = args.latency
+    fake_glm_server.FAKE_GLM_THINKING_LATENCY = args.thinking_latency
+    server = fake_glm_server.start_in_thread(port=args.port)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+分块识别与整图识别的耗时对比
+
+生成整页文档扫描样本，针对本地模拟 GLM 接口分别测量整图单次识别和
+分块并发识别（条带 / 网格）的端到端耗时。模拟接口的延迟按请求体大小
+线性增长（FAKE_GLM_LATENCY_PER_MB），近似“内容越多输出越长”；为使
+两种方式按相同内容量计费，压测时关闭了预处理缩放。
+
+用法：
+    python benchmarks/bench_tiling.py [--latency 1.0] [--latency-per-mb 8] [--runs 3]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_document(width: int, height: int) -> bytes:
+    """生成 A4 300dpi 大小的多段落文字扫描样本"""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(7)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    y = 150
+    while y < height - 150:
+        for _ in range(rng.randint(3, 8)):
+            words = " ".join(rng.choice(["UnblurAI", "document", "scan", "模糊文字", "paragraph", "2024"]) for _ in range(14))
+            draw.text((150, y), words, fill=(20, 20, 20), font_size=36)
+            y += 52
+        y += 60
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+async def measure(fn, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.mean(timings)
+
+
+async def main_async(args) -> None:
+    import logging
+    from app.services.image_tiling import TilingConfig, split_image
+    from app.services.zhipuai_service import ZhipuAIService
+    from app.utils.image_validation import ValidatedImage
+
+    logging.disable(logging.INFO)
+
+    data = make_document(args.width, args.height)
+    image = ValidatedImage.from_bytes(data, max_size=len(data))
+    service = ZhipuAIService()
+    print(f"document {args.width}x{args.height} {len(data) / 1024 / 1024:.2f}MB, "
+          f"upstream latency {args.latency}s + {args.latency_per_mb}s/MB, runs={args.runs}")
+    print(f"{'mode':<24} {'tiles':>6} {'mean latency':>14}")
+
+    single = await measure(lambda: service.recognize(image), args.runs)
+    print(f"{'single-shot':<24} {1:>6} {single:>13.2f}s")
+
+    for mode in ("bands", "grid"):
+        for concurrency in (1, args.concurrency):
+            service.tiling_config = TilingConfig(mode=mode, tile_size=args.tile_size, concurrency=concurrency)
+            _, tiles = split_image(image, service.tiling_config)
+            count = sum(len(row) for row in tiles)
+            tiled = await measure(lambda: service.recognize_tiled(image), args.runs)
+            print(f"{f'tiled {mode} x{concurrency}':<24} {count:>6} {tiled:>13.2f}s  ({single / tiled:.2f}x)")
+
+    await service.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟上游基础延迟（秒）")
+    parser.add_argument("--latency-per-mb", type=float, default=8.0, help="每 MB 请求体的额外延迟（秒）")
+    parser.add_argument("--width", type=int, default=2480)
+    parser.add_argument("--height", type=int, default=3508)
+    parser.add_argument("--tile-size", type=int, default=1024)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    os.environ["ZHIPUAI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    # 关闭缓存和预处理缩放，保证每次都按完整内容量调用上游
+    os.environ["RECOGNITION_CACHE_ENABLED"] = "false"
+    os.environ["IMAGE_PREPROCESS_ENABLED"] = "false"
+    os.chdir(BACKEND_DIR)
+
+    import fake_glm_server
+
+    fake_glm_server.FAKE_GLM_LATENCY = args.latency
+    fake_glm_server.FAKE_GLM_LATENCY_PER_MB = args.latency_per_mb
+    server = fake_glm_server.start_in_thread(port=args.port)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
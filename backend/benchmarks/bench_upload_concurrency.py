@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+/api/upload 并发吞吐压测
+
+针对本地模拟 GLM 接口，在不同并发度下驱动 /api/upload，
+验证吞吐随在途请求数增长，而不是被串行化。每个请求的图片都不同，
+避免结果缓存和相同请求合并使测得的吞吐远高于上游实际处理能力。
+
+用法：
+    python benchmarks/bench_upload_concurrency.py [--latency 0.5] [--concurrency 1 4 16 32]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from io import BytesIO
+from typing import List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_sample_image(index: int) -> bytes:
+    """生成第 index 张样本图片（左上角像素编码序号，保证每张图片内容不同）"""
+    from PIL import Image
+
+    image = Image.new("RGB", (200, 80), "white")
+    image.putpixel((0, 0), (index % 256, index // 256 % 256, index // 65536 % 256))
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+async def run_level(client, images: List[bytes], concurrency: int, rounds: int) -> float:
+    """以固定并发度发送 concurrency * rounds 个请求（每个请求使用不同的图片），返回每秒请求数"""
+
+    async def one(image_bytes: bytes):
+        response = await client.post(
+            "/api/upload",
+            files={"file": ("sample.png", image_bytes, "image/png")},
+        )
+        assert response.status_code == 200 and response.json()["success"], response.text
+
+    start = time.perf_counter()
+    for round_index in range(rounds):
+        batch = images[round_index * concurrency:(round_index + 1) * concurrency]
+        await asyncio.gather(*(one(image_bytes) for image_bytes in batch))
+    elapsed = time.perf_counter() - start
+    return concurrency * rounds / elapsed
+
+
+async def main_async(args) -> None:
+    import logging
+    import httpx
+    from main import app
+
+    logging.disable(logging.INFO)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"transport={os.environ['GLM_TRANSPORT']} upstream_latency={args.latency}s")
+        print(f"{'concurrency':>12} {'req/s':>10} {'ideal':>10}")
+        offset = 0
+        for concurrency in args.concurrency:
+            count = concurrency * args.rounds
+            images = [make_sample_image(offset + index) for index in range(count)]
+            offset += count
+            rps = await run_level(client, images, concurrency, args.rounds)
+            ideal = concurrency / args.latency
+            print(f"{concurrency:>12} {rps:>10.2f} {ideal:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟上游延迟（秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--transport", choices=["httpx", "threadpool"], default="httpx")
+    args = parser.parse_args()
+
+    os.environ["FAKE_GLM_LATENCY"] = str(args.latency)
+    os.environ["ZHIPUAI_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["GLM_TRANSPORT"] = args.transport
+    os.environ.setdefault("ZHIPUAI_API_KEY", "bench-key")
+    # 放宽上游限流，测量接口本身的并发能力（默认 10 QPS 会限制高并发档位的吞吐）
+    os.environ.setdefault("GLM_RATE_LIMIT_QPS", "1000")
+    os.environ.setdefault("GLM_RATE_LIMIT_BURST", "1000")
+    os.chdir(BACKEND_DIR)
+    os.makedirs("logs", exist_ok=True)
+
+    import fake_glm_server
+
+    server = fake_glm_server.start_in_thread(port=args.port)
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+上传图片校验链路的内存剖析
+
+对比旧链路（整体读取 -> 多次 PIL 打开 -> base64 -> f-string data URL）
+与 ValidatedImage 链路（分块读取 -> 仅解析文件头 -> 惰性 data URL）
+每个请求的 Python 分配峰值（tracemalloc）和进程峰值 RSS 增量。
+每种模式在独立子进程中运行，避免相互影响 ru_maxrss。
+
+用法：
+    python benchmarks/bench_upload_memory.py [--size-mb 4] [--requests 20]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# 在模块级导入，避免模块导入的内存分配计入第一个请求
+from app.utils.image_validation import ImageValidationError, validate_upload  # noqa: E402
+
+
+def make_image(size_mb: float) -> bytes:
+    """生成接近指定大小的 PNG（随机噪声几乎不可压缩）"""
+    from PIL import Image
+
+    side = int((size_mb * 1024 * 1024 / 3) ** 0.5)
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_upload(data: bytes, known_size: bool = True):
+    """构造与 Starlette 解析 multipart 后一致的 UploadFile（超过 1MB 落盘的临时文件）"""
+    from starlette.datastructures import Headers, UploadFile
+
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(data)
+    spooled.seek(0)
+    return UploadFile(
+        file=spooled,
+        size=len(data) if known_size else None,
+        filename="sample.png",
+        headers=Headers({"content-type": "image/png"}),
+    )
+
+
+async def legacy_request(upload) -> int:
+    """复现旧链路：整体读取、路由和服务中重复校验、两次拷贝生成 data URL"""
+    from PIL import Image
+
+    file_content = await upload.read()
+    if len(file_content) > 5 * 1024 * 1024:
+        return 0
+    for _ in range(2):
+        image = Image.open(BytesIO(file_content))
+        assert image.format.lower() in ["jpeg", "jpg", "png"]
+    image_base64 = base64.b64encode(file_content).decode("utf-8")
+    url = f"data:image/jpeg;base64,{image_base64}"
+    return len(json.dumps({"url": url}))
+
+
+async def validated_request(upload) -> int:
+    """ValidatedImage 链路"""
+    try:
+        image = await validate_upload(upload)
+    except ImageValidationError:
+        return 0
+    return len(json.dumps({"url": image.data_url}))
+
+
+def run_mode(mode: str, size_mb: float, requests: int) -> None:
+    handler = legacy_request if mode == "legacy" else validated_request
+    data = make_image(size_mb)
+    oversized = make_image(8)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    peaks = []
+    # 最后一个请求为超限文件，且不提供大小，用于观察分块读取时的提前拒绝
+    cases = [(data, True)] * requests + [(oversized, False)]
+    for payload, known_size in cases:
+        upload = make_upload(payload, known_size)
+        tracemalloc.start()
+        asyncio.run(handler(upload))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "mode": mode,
+        "image_bytes": len(data),
+        "peak_alloc_mib": max(peaks[:-1]) / 1024 / 1024,
+        "oversized_peak_alloc_mib": peaks[-1] / 1024 / 1024,
+        # Linux 下 ru_maxrss 单位为 KiB
+        "rss_growth_mib": (peak_rss - base_rss) / 1024,
+    }))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=float, default=4.0)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--mode", choices=["legacy", "validated"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.size_mb, args.requests)
+        return
+
+    print(f"{'mode':<10} {'image MiB':>10} {'peak/req MiB':>13} {'8MB reject MiB':>15} {'RSS growth MiB':>15}")
+    for mode in ("legacy", "validated"):
+        output = subprocess.check_output([
+            sys.executable, __file__, "--mode", mode,
+            "--size-mb", str(args.size_mb), "--requests", str(args.requests),
+        ])
+        result = json.loads(output)
+        print(
+            f"{mode:<10} {result['image_bytes'] / 1024 / 1024:>10.2f} {result['peak_alloc_mib']:>13.2f} "
+            f"{result['oversized_peak_alloc_mib']:>15.2f} {result['rss_growth_mib']:>15.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+本地模拟的 GLM chat/completions 接口，用于离线压测
+
+- 支持视觉请求（image_url 为 base64 data URL 或 http 地址，格式错误时返回 400）
+- 支持流式输出和思考模式（thinking.type 为 enabled 时返回 reasoning_content，并额外增加思考耗时）
+- 提示词要求输出 bbox 时返回逐行 JSON 结果（包在代码块中，与真实模型的常见输出一致）
+- 延迟分布、错误率、429 比例、挂起和慢尾均可通过环境变量或运行时修改模块变量配置
+- 遵守 max_tokens（按 count_tokens 近似计数），超出时截断输出并返回 finish_reason=length
+- GET /stats 返回收到的请求数、图片数、各类注入故障次数，压测时可用于统计实际上游调用次数
+
+用法：
+    FAKE_GLM_PORT=18080 FAKE_GLM_LATENCY=0.5 FAKE_GLM_LATENCY_DIST=lognormal python benchmarks/fake_glm_server.py
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+# 每次调用的模拟上游延迟（秒）；使用非固定分布时为中位数
+FAKE_GLM_LATENCY = float(os.getenv("FAKE_GLM_LATENCY", 0.5))
+# 延迟分布：fixed（固定）、uniform（[0, 2x] 均匀）、exponential（指数）、lognormal（对数正态，长尾）、
+# empirical（从 FAKE_GLM_LATENCY_SAMPLES_FILE 中随机抽取）
+FAKE_GLM_LATENCY_DIST = os.getenv("FAKE_GLM_LATENCY_DIST", "fixed")
+# 经验分布的样本：JSON 对象 {"image": [秒, ...], "text": [秒, ...]}，分别用于视觉请求和纯文字请求
+# （replay_traffic.py 由录制的上游耗时生成）
+FAKE_GLM_LATENCY_SAMPLES: dict = {}
+if os.getenv("FAKE_GLM_LATENCY_SAMPLES_FILE"):
+    with open(os.getenv("FAKE_GLM_LATENCY_SAMPLES_FILE"), encoding="utf-8") as samples_file:
+        FAKE_GLM_LATENCY_SAMPLES = json.load(samples_file)
+# 对数正态分布的 sigma，越大尾部越长（0.5 时 p99 约为中位数的 3.2 倍）
+FAKE_GLM_LATENCY_SIGMA = float(os.getenv("FAKE_GLM_LATENCY_SIGMA", 0.5))
+# 每 MB 请求体额外增加的延迟（秒），用于模拟大图生成更长输出的耗时
+FAKE_GLM_LATENCY_PER_MB = float(os.getenv("FAKE_GLM_LATENCY_PER_MB", 0))
+# 每个输出 token 额外增加的延迟（秒），用于模拟输出越长解码越慢
+FAKE_GLM_LATENCY_PER_TOKEN = float(os.getenv("FAKE_GLM_LATENCY_PER_TOKEN", 0))
+# 纯文字请求（微调）回显用户消息，而不是返回固定内容，使输出长度随输入变化
+FAKE_GLM_TEXT_ECHO = os.getenv("FAKE_GLM_TEXT_ECHO", "false").lower() == "true"
+# 开启思考模式时额外增加的延迟（秒）
+FAKE_GLM_THINKING_LATENCY = float(os.getenv("FAKE_GLM_THINKING_LATENCY", 0))
+# 流式模式：首个数据块延迟和后续数据块间隔（秒）
+FAKE_GLM_FIRST_CHUNK_LATENCY = float(os.getenv("FAKE_GLM_FIRST_CHUNK_LATENCY", 0.2))
+FAKE_GLM_CHUNK_INTERVAL = float(os.getenv("FAKE_GLM_CHUNK_INTERVAL", 0.05))
+# 返回 429（限流）的概率
+FAKE_GLM_429_RATE = float(os.getenv("FAKE_GLM_429_RATE", 0))
+# 故障注入（压测脚本可在运行时修改这些模块变量）：
+# 返回 500 的概率；挂起不响应的概率和时长；慢尾请求的概率和延迟
+FAKE_GLM_ERROR_RATE = float(os.getenv("FAKE_GLM_ERROR_RATE", 0))
+FAKE_GLM_HANG_RATE = float(os.getenv("FAKE_GLM_HANG_RATE", 0))
+FAKE_GLM_HANG_SECONDS = float(os.getenv("FAKE_GLM_HANG_SECONDS", 600))
+FAKE_GLM_SLOW_RATE = float(os.getenv("FAKE_GLM_SLOW_RATE", 0))
+FAKE_GLM_SLOW_LATENCY = float(os.getenv("FAKE_GLM_SLOW_LATENCY", 5))
+
+REASONING_CHUNKS = ["图片中", "包含两行", "文字。"]
+CONTENT_CHUNKS = ["<|begin_", "of_box|>模拟", "识别结果\n", "  fake ", "result<|end_of_box|>"]
+TEXT_CONTENT = "模拟微调结果\nfake refined result"
+STRUCTURED_CHUNKS = [
+    "```json\n[\n  {\"text\": \"模拟识别",
+    "结果\", \"bbox\": [52, 40, 410, 88], \"confidence\": 0.96},\n",
+    "  {\"text\": \"fake result\", \"bbox\": [52, 120, 380, 166], \"conf",
+    "idence\": 0.71}\n]\n```",
+]
+
+stats = Counter()
+
+# 设置随机种子时延迟和故障注入序列可复现
+if os.getenv("FAKE_GLM_SEED"):
+    random.seed(int(os.getenv("FAKE_GLM_SEED")))
+
+
+def sample_latency(base: float, images: int = 0) -> float:
+    """按配置的分布采样一次延迟（经验分布按是否包含图片选择样本）"""
+    if FAKE_GLM_LATENCY_DIST == "empirical":
+        samples = FAKE_GLM_LATENCY_SAMPLES.get("image" if images else "text")
+        if samples:
+            return random.choice(samples)
+    if base <= 0:
+        return 0.0
+    if FAKE_GLM_LATENCY_DIST == "uniform":
+        return random.uniform(0, 2 * base)
+    if FAKE_GLM_LATENCY_DIST == "exponential":
+        # 中位数为 base 的指数分布
+        return random.expovariate(math.log(2) / base)
+    if FAKE_GLM_LATENCY_DIST == "lognormal":
+        return random.lognormvariate(math.log(base), FAKE_GLM_LATENCY_SIGMA)
+    return base
+
+
+def inspect_messages(messages) -> int:
+    """校验消息格式，返回图片数量；格式错误时抛出 ValueError"""
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("messages must be a non-empty list")
+    images = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            continue
+        if not isinstance(content, list):
+            raise ValueError("message content must be a string or a list of parts")
+        for part in content:
+            if part.get("type") == "text":
+                continue
+            if part.get("type") != "image_url":
+                raise ValueError(f"unsupported content part: {part.get('type')}")
+            url = (part.get("image_url") or {}).get("url", "")
+            if url.startswith("data:"):
+                header, _, data = url.partition(",")
+                if ";base64" not in header:
+                    raise ValueError("image data URL must be base64 encoded")
+                try:
+                    base64.b64decode(data, validate=True)
+                except (binascii.Error, ValueError):
+                    raise ValueError("invalid base64 image data")
+            elif not url.startswith(("http://", "https://")):
+                raise ValueError("image_url must be a data URL or an http(s) URL")
+            images += 1
+    return images
+
+
+def wants_structured(messages) -> bool:
+    """提示词中要求输出 bbox 时视为结构化输出请求"""
+    for message in messages:
+        content = message.get("content")
+        parts = [content] if isinstance(content, str) else [part.get("text", "") for part in content]
+        if any('"bbox"' in part for part in parts):
+            return True
+    return False
+
+
+def count_tokens(text: str) -> int:
+    """近似的 token 数：中日韩文字约每字 0.65 个，其他字符约每 4 个 1 个"""
+    wide = sum(1 for char in text if ord(char) >= 0x2e80)
+    return math.ceil(wide * 0.65 + (len(text) - wide) / 4)
+
+
+def text_reply(messages) -> str:
+    if not FAKE_GLM_TEXT_ECHO:
+        return TEXT_CONTENT
+    content = messages[-1].get("content")
+    return content if isinstance(content, str) else TEXT_CONTENT
+
+
+def limit_output(content: str, reasoning: str, max_tokens) -> tuple:
+    """按 max_tokens 截断输出，返回 (content, finish_reason)"""
+    content_tokens = count_tokens(content)
+    available = (max_tokens or 0) - count_tokens(reasoning)
+    if not max_tokens or content_tokens <= available:
+        return content, "stop"
+    stats["truncated"] += 1
+    return content[:max(len(content) * available // content_tokens, 0)], "length"
+
+
+def usage(body_size: int, images: int, content: str, reasoning: str, prompt: str = "") -> dict:
+    """近似的 token 用量：图片按固定数量计，文字按 count_tokens 计（未提供提示词时按请求体大小估计）"""
+    prompt_tokens = images * 1000 + (50 if images else count_tokens(prompt) if prompt else body_size // 4)
+    completion_tokens = count_tokens(content) + count_tokens(reasoning)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def completion_chunk(model: str, delta: dict, finish_reason=None, usage_info=None) -> str:
+    chunk = {
+        "id": "fake-completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"role": "assistant", **delta}, "finish_reason": finish_reason}],
+    }
+    if usage_info:
+        chunk["usage"] = usage_info
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+async def stream_chunks(
+    model: str, thinking: bool, images: int, body_size: int, structured: bool = False,
+    text: str = TEXT_CONTENT, max_tokens=None
+):
+    first_chunk = sample_latency(FAKE_GLM_FIRST_CHUNK_LATENCY, images)
+    if thinking:
+        first_chunk += FAKE_GLM_THINKING_LATENCY
+    await asyncio.sleep(first_chunk)
+    content_chunks = (STRUCTURED_CHUNKS if structured else CONTENT_CHUNKS) if images else [text]
+    reasoning = "".join(REASONING_CHUNKS) if thinking else ""
+    content, finish_reason = limit_output("".join(content_chunks), reasoning, max_tokens)
+    if finish_reason == "length":
+        content_chunks = [content]
+    deltas = [{"reasoning_content": text} for text in REASONING_CHUNKS] if thinking else []
+    deltas += [{"content": text} for text in content_chunks]
+    for index, delta in enumerate(deltas):
+        if index:
+            await asyncio.sleep(FAKE_GLM_CHUNK_INTERVAL)
+        yield completion_chunk(model, delta)
+    usage_info = usage(body_size, images, content, reasoning)
+    yield completion_chunk(model, {}, finish_reason=finish_reason, usage_info=usage_info)
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.body()
+    payload = json.loads(body)
+    stats["requests"] += 1
+    try:
+        images = inspect_messages(payload.get("messages"))
+    except ValueError as e:
+        stats["invalid"] += 1
+        return JSONResponse(status_code=400, content={"error": {"code": "1210", "message": str(e)}})
+    stats["images"] += images
+    thinking = (payload.get("thinking") or {}).get("type") == "enabled"
+    if thinking:
+        stats["thinking"] += 1
+
+    if random.random() < FAKE_GLM_429_RATE:
+        stats["rate_limited"] += 1
+        return JSONResponse(status_code=429, content={"error": {"code": "1302", "message": "rate limited"}})
+    if random.random() < FAKE_GLM_ERROR_RATE:
+        stats["errors"] += 1
+        return JSONResponse(status_code=500, content={"error": {"code": "500", "message": "internal error"}})
+    if random.random() < FAKE_GLM_HANG_RATE:
+        stats["hangs"] += 1
+        await asyncio.sleep(FAKE_GLM_HANG_SECONDS)
+    model = payload.get("model", "glm-4.5v")
+    structured = wants_structured(payload["messages"])
+    if payload.get("stream"):
+        stats["streams"] += 1
+        return StreamingResponse(
+            stream_chunks(model, thinking, images, len(body), structured, text_reply(payload["messages"]), payload.get("max_tokens")),
+            media_type="text/event-stream",
+        )
+
+    slow = random.random() < FAKE_GLM_SLOW_RATE
+    if slow:
+        stats["slow"] += 1
+    latency = FAKE_GLM_SLOW_LATENCY if slow else sample_latency(FAKE_GLM_LATENCY, images)
+    if thinking:
+        latency += FAKE_GLM_THINKING_LATENCY
+    if structured and images:
+        content = "".join(STRUCTURED_CHUNKS)
+    else:
+        content = "<|begin_of_box|>模拟识别结果\nfake result<|end_of_box|>" if images else text_reply(payload["messages"])
+    reasoning = "".join(REASONING_CHUNKS) if thinking else ""
+    content, finish_reason = limit_output(content, reasoning, payload.get("max_tokens"))
+    latency += FAKE_GLM_LATENCY_PER_TOKEN * (count_tokens(content) + count_tokens(reasoning))
+    await asyncio.sleep(latency + FAKE_GLM_LATENCY_PER_MB * len(body) / (1024 * 1024))
+    return {
+        "id": "fake-completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": finish_reason,
+                "message": {
+                    "role": "assistant",
+                    "content": content,
+                    "reasoning_content": reasoning,
+                },
+            }
+        ],
+        "usage": usage(len(body), images, content, reasoning, "".join(
+            message["content"] for message in payload["messages"] if isinstance(message.get("content"), str)
+        )),
+    }
+
+
+@app.get("/stats")
+async def fake_stats():
+    return dict(stats)
+
+
+@app.delete("/stats")
+async def reset_fake_stats():
+    stats.clear()
+    return {}
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 18080, asgi_app=None) -> uvicorn.Server:
+    """在后台线程启动模拟服务（或指定的 ASGI 应用），返回 uvicorn.Server 以便停止"""
+    config = uvicorn.Config(asgi_app or app, host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_GLM_PORT", 18080)), log_level="warning")
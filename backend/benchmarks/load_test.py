@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+端到端压测：离线驱动 /api/upload、/api/upload-stream、/api/refine、/api/tune
+
+启动本地模拟 GLM 接口（fake_glm_server.py）和生产模式的后端进程（start.py），
+按场景和并发度发送请求，统计吞吐、延迟分位数（p50/p95/p99）、首字节时间、
+流式接口的首个识别文字时间、后端进程（含工作进程）的峰值 RSS，以及实际发往上游的调用次数。
+
+结果可用 --output 保存为 JSON，并通过 --baseline 与保存的基线比较：吞吐下降或
+p95 上升超过 --tolerance 时以非零状态退出。每个请求使用不同的图片和文字，
+不会命中识别结果缓存。
+
+用法：
+    python benchmarks/load_test.py [--scenarios upload upload-stream refine tune] [--concurrency 1 8 32]
+        [--requests 200] [--latency 0.5 --latency-dist lognormal] [--error-rate 0.01 --rate-429 0.02]
+        [--workers 1] [--env GLM_MAX_IN_FLIGHT=64] [--output results.json]
+        [--baseline benchmarks/baselines/load_test.json --tolerance 0.15]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = ("upload", "upload-stream", "refine", "tune")
+
+# 默认放开后端的上游限流，使压测反映后端自身的开销（可用 --env 覆盖）
+DEFAULT_BACKEND_ENV = {
+    "GLM_RATE_LIMIT_QPS": "10000",
+    "GLM_RATE_LIMIT_BURST": "10000",
+    "GLM_MAX_IN_FLIGHT": "256",
+    "GLM_MAX_QUEUE": "10000",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_image(index: int) -> bytes:
+    """生成带序号的文字图片，保证每个请求的图片内容不同"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (480, 120), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((20, 40), f"UnblurAI load test #{index}", fill=(index % 200, 30, 30), font_size=28)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class RssSampler:
+    """周期性采样进程树（后端主进程及其工作进程）的 RSS 总和"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _children(self, pid: int) -> List[int]:
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+        return children
+
+    def current(self) -> int:
+        """进程树当前 RSS（字节），非 Linux 平台返回 0"""
+        total = 0
+        pending = [self.pid]
+        while pending:
+            pid = pending.pop()
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                continue
+            pending.extend(self._children(pid))
+        return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def send(client, scenario: str, index: int) -> Dict[str, Optional[float]]:
+    """发送一个请求，返回延迟、首字节时间、首个识别文字时间和是否成功"""
+    if scenario in ("upload", "upload-stream"):
+        request = client.build_request(
+            "POST", f"/api/{scenario}", files={"file": (f"load-{index}.png", make_image(index), "image/png")}
+        )
+    elif scenario == "refine":
+        request = client.build_request("POST", "/api/refine", json={
+            "original_text": f"第 {index} 段压测文字\n包含一些错別字",
+            "refinement_instruction": "修正错别字",
+        })
+    else:
+        request = client.build_request("POST", "/api/tune", data={
+            "text": f"第 {index} 段压测文字",
+            "instruction": "改为书面语",
+        })
+
+    start = time.perf_counter()
+    ttfb = first_content = None
+    body = b""
+    try:
+        response = await client.send(request, stream=True)
+        try:
+            async for chunk in response.aiter_raw():
+                now = time.perf_counter()
+                if ttfb is None:
+                    ttfb = now - start
+                body += chunk
+                if first_content is None and scenario == "upload-stream" and b'"type": "delta"' in body:
+                    first_content = now - start
+        finally:
+            await response.aclose()
+    except Exception:
+        return {"latency": time.perf_counter() - start, "ttfb": None, "first_content": None, "ok": False}
+
+    latency = time.perf_counter() - start
+    if response.status_code != 200:
+        ok = False
+    elif scenario == "upload-stream":
+        ok = b'"type": "success"' in body
+    else:
+        ok = bool(json.loads(body).get("success"))
+    return {"latency": latency, "ttfb": ttfb, "first_content": first_content, "ok": ok}
+
+
+async def run_level(base_url: str, scenario: str, concurrency: int, requests: int, offset: int) -> Dict:
+    import httpx
+
+    results = []
+    counter = iter(range(offset, offset + requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=300, limits=limits) as client:
+        async def worker():
+            for index in counter:
+                results.append(await send(client, scenario, index))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["ok"]]
+    latencies = [r["latency"] for r in ok]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    firsts = [r["first_content"] for r in ok if r["first_content"] is not None]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttfb_p50": percentile(ttfbs, 0.50),
+        "first_content_p50": percentile(firsts, 0.50) if firsts else None,
+    }
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"process exited with code {process.returncode} before becoming ready: {url}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"timed out waiting for {url}")
+
+
+def upstream_calls(fake_url: str) -> int:
+    import httpx
+
+    return httpx.get(f"{fake_url}/stats").json().get("requests", 0)
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> bool:
+    """与基线比较，返回是否没有超出容忍度的退化"""
+    previous = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    passed = True
+    print(f"\ncompared with baseline ({baseline.get('created', 'unknown')}, tolerance {tolerance:.0%})")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if before is None:
+            continue
+        throughput_change = result["throughput"] / before["throughput"] - 1 if before["throughput"] else 0.0
+        p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0.0
+        regressed = throughput_change < -tolerance or p95_change > tolerance
+        passed = passed and not regressed
+        print(f"  {result['scenario']:<14} c={result['concurrency']:<4} throughput {throughput_change:+7.1%}  "
+              f"p95 {p95_change:+7.1%}  {'REGRESSED' if regressed else 'ok'}")
+    return passed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=50, help="每个场景、每个并发度的请求数")
+    parser.add_argument("--latency", type=float, default=0.5, help="模拟上游延迟中位数（秒）")
+    parser.add_argument("--latency-dist", default="lognormal", choices=["fixed", "uniform", "exponential", "lognormal"])
+    parser.add_argument("--thinking-latency", type=float, default=0.3, help="思考模式额外延迟（秒）")
+    parser.add_argument("--first-chunk", type=float, default=0.2, help="流式首个数据块延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="上游返回 500 的概率")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="上游返回 429 的概率")
+    parser.add_argument("--seed", type=int, default=1, help="模拟接口的随机种子，使延迟和故障序列可复现")
+    parser.add_argument("--workers", type=int, default=1, help="后端工作进程数")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给后端进程的环境变量")
+    parser.add_argument("--output", help="保存结果的 JSON 文件")
+    parser.add_argument("--baseline", help="用于比较的基线 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    fake_port, backend_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    base_url = f"http://127.0.0.1:{backend_port}"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fake_env = dict(
+            os.environ,
+            FAKE_GLM_PORT=str(fake_port),
+            FAKE_GLM_LATENCY=str(args.latency),
+            FAKE_GLM_LATENCY_DIST=args.latency_dist,
+            FAKE_GLM_THINKING_LATENCY=str(args.thinking_latency),
+            FAKE_GLM_FIRST_CHUNK_LATENCY=str(args.first_chunk),
+            FAKE_GLM_ERROR_RATE=str(args.error_rate),
+            FAKE_GLM_429_RATE=str(args.rate_429),
+            FAKE_GLM_SEED=str(args.seed),
+        )
+        backend_env = dict(os.environ, **DEFAULT_BACKEND_ENV)
+        backend_env.update(
+            SERVER_MODE="production",
+            WEB_WORKERS=str(args.workers),
+            HOST="127.0.0.1",
+            PORT=str(backend_port),
+            LOG_LEVEL="warning",
+            LOG_FILE="",
+            ZHIPUAI_BASE_URL=fake_url,
+            ZHIPUAI_API_KEY=os.getenv("ZHIPUAI_API_KEY", "bench-key"),
+            JOB_QUEUE_DB=os.path.join(tmpdir, "jobs.db"),
+            JOB_WORKERS="0",
+        )
+        backend_env.update(item.split("=", 1) for item in args.env)
+
+        fake_log = open(os.path.join(tmpdir, "fake.log"), "w")
+        backend_log = open(os.path.join(tmpdir, "backend.log"), "w")
+        fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_glm_server.py")],
+                                env=fake_env, stdout=fake_log, stderr=subprocess.STDOUT)
+        backend = subprocess.Popen([sys.executable, "start.py"], cwd=BACKEND_DIR,
+                                   env=backend_env, stdout=backend_log, stderr=subprocess.STDOUT)
+        try:
+            wait_until_ready(f"{fake_url}/stats", fake)
+            wait_until_ready(f"{base_url}/api/ready", backend)
+
+            print(f"upstream latency {args.latency}s ({args.latency_dist}), thinking +{args.thinking_latency}s, "
+                  f"errors {args.error_rate:.0%}, 429 {args.rate_429:.0%}, backend workers {args.workers}")
+            print(f"{'scenario':<14} {'conc':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+                  f"{'ttfb':>8} {'1st txt':>8} {'errors':>7} {'upstream':>9} {'peak RSS':>9}")
+            results = []
+            offset = 0
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    calls_before = upstream_calls(fake_url)
+                    with RssSampler(backend.pid) as rss:
+                        result = asyncio.run(run_level(base_url, scenario, concurrency, args.requests, offset))
+                    offset += args.requests
+                    result["upstream_calls"] = upstream_calls(fake_url) - calls_before
+                    result["peak_rss_mb"] = round(rss.peak / 1024 / 1024, 1)
+                    results.append(result)
+                    first = f"{result['first_content_p50'] * 1000:7.0f}ms" if result["first_content_p50"] else f"{'-':>9}"
+                    print(f"{scenario:<14} {concurrency:>5} {result['throughput']:>8.1f} "
+                          f"{result['p50'] * 1000:>6.0f}ms {result['p95'] * 1000:>6.0f}ms {result['p99'] * 1000:>6.0f}ms "
+                          f"{result['ttfb_p50'] * 1000:>6.0f}ms{first} {result['errors']:>7} "
+                          f"{result['upstream_calls']:>9} {result['peak_rss_mb']:>7.1f}MB")
+        except Exception:
+            backend_log.flush()
+            with open(backend_log.name) as f:
+                sys.stderr.write(f.read()[-4000:])
+            raise
+        finally:
+            backend.terminate()
+            fake.terminate()
+            backend.wait(timeout=30)
+            fake.wait(timeout=10)
+            fake_log.close()
+            backend_log.close()
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nresults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+回放录制的请求（TRAFFIC_RECORD_FILE），并与保存的基线比较延迟分布
+
+读取一个或多个录制文件（多工作进程时每个进程一个文件），按原始到达间隔开环发送请求，
+--speed 可按倍数加快或放慢到达速率。启动本地模拟 GLM 接口（fake_glm_server.py）和生产模式的后端进程（start.py），
+模拟接口每次调用的延迟从录制中的上游耗时（up_ms / n，视觉请求和纯文字请求分开）随机抽取。
+
+请求内容按录制的特征合成：相同尺寸和格式的图片、相同长度的文字、指令和自定义提示词，以及相同的请求选项；
+key 相同的请求使用相同的内容，使缓存命中情况与录制时一致。合成图片的文字量与原图不同，
+上游延迟只按录制的耗时分布抽取，不随图片内容变化；流式请求以抽取的整次调用耗时作为首个数据块的延迟，结果略偏保守。
+
+输出各接口的延迟分位数、错误数和实际上游调用次数，并列出录制时的延迟作为对照。
+结果可用 --output 保存为 JSON，并通过 --baseline 与保存的结果比较：p95 上升超过 --tolerance
+或错误率上升超过 1 个百分点时以非零状态退出。
+
+用法：
+    python benchmarks/replay_traffic.py data/traffic-*.jsonl [--speed 2] [--limit 2000] [--routes /api/upload /api/refine]
+        [--workers 1] [--env GLM_MAX_IN_FLIGHT=8] [--output replay.json] [--baseline replay-baseline.json --tolerance 0.15]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from load_test import free_port, percentile, upstream_calls, wait_until_ready  # noqa: E402
+
+ROUTES = ("/api/upload", "/api/upload-stream", "/api/refine", "/api/tune")
+FILLER = "这是回放时合成的文字，长度与录制的请求相同，内容与原文无关。The quick brown fox jumps over the lazy dog. "
+
+
+def load_records(paths: List[str], routes: List[str], limit: Optional[int]) -> List[Dict]:
+    """读取并按到达时间合并录制文件（跳过无法解析的行，如写入中断的最后一行）"""
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("r") in routes:
+                    records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records[:limit] if limit else records
+
+
+def latency_samples(records: List[Dict]) -> Dict[str, List[float]]:
+    """由录制的上游耗时生成模拟接口的经验延迟分布（每次上游调用的平均耗时，秒）"""
+    samples: Dict[str, List[float]] = {"image": [], "text": []}
+    for record in records:
+        if record.get("n") and record.get("s") == 200:
+            kind = "image" if "img_w" in record else "text"
+            samples[kind].append(record.get("up_ms", 0) / record["n"] / 1000)
+    return samples
+
+
+def synth_text(length: int, seed: str) -> str:
+    """合成指定长度的文字，每约 300 字分一段，使长文本分段与录制时相近"""
+    body = f"[{seed}] " + FILLER * (length // len(FILLER) + 1)
+    paragraphs = [body[index:index + 300] for index in range(0, length, 300)]
+    return "\n\n".join(paragraphs)[:length] or seed[:1]
+
+
+def synth_image(width: int, height: int, image_format: str, seed: str) -> bytes:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    font_size = max(12, min(width, height) // 20)
+    for y in range(font_size, height - font_size, font_size * 2):
+        draw.text((font_size, y), f"replay {seed} line {y // (font_size * 2)}", fill=(30, 30, 30), font_size=font_size)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format if image_format in ("PNG", "JPEG") else "PNG")
+    return buffer.getvalue()
+
+
+class RequestBuilder:
+    """按录制的特征合成请求，key 相同的请求复用相同的内容"""
+
+    def __init__(self):
+        self._images: Dict[str, bytes] = {}
+        self._texts: Dict[str, str] = {}
+
+    def build(self, index: int, record: Dict) -> Dict:
+        key = record.get("key") or f"unique-{index}"
+        route = record["r"]
+        if route in ("/api/upload", "/api/upload-stream"):
+            image_format = record.get("img_f", "PNG")
+            image = self._images.get(key)
+            if image is None:
+                image = synth_image(record.get("img_w", 800), record.get("img_h", 600), image_format, key)
+                self._images[key] = image
+            data = {}
+            if record.get("prompt"):
+                data["custom_prompt"] = synth_text(record["prompt"], "prompt")
+            for option in ("thinking", "structured", "tiled"):
+                if option in record:
+                    data[option] = str(record[option]).lower()
+            mime = "image/jpeg" if image_format == "JPEG" else "image/png"
+            return {"files": {"file": (f"replay-{index}.{image_format.lower()}", image, mime)}, "data": data}
+
+        text = self._texts.get(key)
+        if text is None:
+            text = synth_text(record.get("text", 100), key)
+            self._texts[key] = text
+        instruction = synth_text(record.get("instr", 10), "instruction")
+        if route == "/api/refine":
+            body = {"original_text": text, "refinement_instruction": instruction}
+            if record.get("thinking"):
+                body["thinking"] = record["thinking"]
+            return {"json": body}
+        data = {"text": text, "instruction": instruction}
+        if record.get("thinking"):
+            data["thinking"] = record["thinking"]
+        return {"data": data}
+
+
+async def send(client, route: str, request: Dict) -> Dict:
+    """发送一个请求，返回延迟和是否成功（流式接口以收到 success 事件为准）"""
+    start = time.perf_counter()
+    try:
+        response = await client.post(route, **request)
+    except Exception:
+        return {"route": route, "latency": time.perf_counter() - start, "ok": False}
+    latency = time.perf_counter() - start
+    if response.status_code != 200:
+        ok = False
+    elif route == "/api/upload-stream":
+        ok = '"type": "success"' in response.text
+    else:
+        ok = response.json().get("success", True) is not False
+    return {"route": route, "latency": latency, "ok": ok}
+
+
+async def replay(base_url: str, records: List[Dict], requests: List[Dict], speed: float) -> List[Dict]:
+    """开环回放：按录制的到达间隔（除以 speed）发送，不等待之前的请求完成"""
+    import httpx
+
+    results: List[Dict] = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as client:
+        async def one(record: Dict, request: Dict, lateness: float) -> None:
+            result = await send(client, record["r"], request)
+            result["lateness"] = lateness
+            results.append(result)
+
+        tasks = []
+        first = records[0]["t"]
+        start = time.perf_counter()
+        for record, request in zip(records, requests):
+            due = (record["t"] - first) / speed
+            delay = due - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # 发送时间晚于计划的程度，持续偏大说明回放端本身成为瓶颈
+            tasks.append(asyncio.ensure_future(one(record, request, max(-delay, 0.0))))
+        await asyncio.gather(*tasks)
+    return results
+
+
+def summarize(route: str, records: List[Dict], results: List[Dict], calls: Optional[int] = None) -> Dict:
+    ok = [result["latency"] for result in results if result["ok"]]
+    recorded = [record["ms"] / 1000 for record in records if record.get("s") == 200 and "ms" in record]
+    summary = {
+        "route": route,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "p50": percentile(ok, 0.50),
+        "p95": percentile(ok, 0.95),
+        "p99": percentile(ok, 0.99),
+        "recorded_p50": percentile(recorded, 0.50),
+        "recorded_p95": percentile(recorded, 0.95),
+        "recorded_upstream_calls": sum(record.get("n", 0) for record in records),
+        "max_lateness": max((result["lateness"] for result in results), default=0.0),
+    }
+    if calls is not None:
+        summary["upstream_calls"] = calls
+    return summary
+
+
+def compare(results: List[Dict], baseline: Dict, tolerance: float) -> bool:
+    """与基线比较，返回是否没有超出容忍度的退化"""
+    previous = {result["route"]: result for result in baseline["results"]}
+    passed = True
+    print(f"\ncompared with baseline ({baseline.get('created', 'unknown')}, tolerance {tolerance:.0%})")
+    for result in results:
+        before = previous.get(result["route"])
+        if before is None or not result["requests"] or not before["requests"]:
+            continue
+        p50_change = result["p50"] / before["p50"] - 1 if before["p50"] else 0.0
+        p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0.0
+        error_change = result["errors"] / result["requests"] - before["errors"] / before["requests"]
+        regressed = p95_change > tolerance or error_change > 0.01
+        passed = passed and not regressed
+        print(f"  {result['route']:<20} p50 {p50_change:+7.1%}  p95 {p95_change:+7.1%}  "
+              f"errors {error_change:+6.1%}  {'REGRESSED' if regressed else 'ok'}")
+    return passed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="录制文件（JSON Lines）")
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=list(ROUTES))
+    parser.add_argument("--speed", type=float, default=1.0, help="到达速率倍数（2 为两倍速率回放）")
+    parser.add_argument("--limit", type=int, help="最多回放的请求数（按到达时间取前 N 个）")
+    parser.add_argument("--seed", type=int, default=1, help="模拟接口的随机种子")
+    parser.add_argument("--workers", type=int, default=1, help="后端工作进程数")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给后端进程的环境变量")
+    parser.add_argument("--output", help="保存结果的 JSON 文件")
+    parser.add_argument("--baseline", help="用于比较的基线 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    records = load_records(args.recordings, args.routes, args.limit)
+    if not records:
+        sys.exit("no recorded requests to replay")
+    duration = records[-1]["t"] - records[0]["t"]
+    builder = RequestBuilder()
+    # 发送前合成全部请求，避免合成耗时推迟发送
+    requests = [builder.build(index, record) for index, record in enumerate(records)]
+
+    fake_port, backend_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    base_url = f"http://127.0.0.1:{backend_port}"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        samples_path = os.path.join(tmpdir, "latency_samples.json")
+        with open(samples_path, "w", encoding="utf-8") as f:
+            json.dump(latency_samples(records), f)
+        fake_env = dict(
+            os.environ,
+            FAKE_GLM_PORT=str(fake_port),
+            FAKE_GLM_LATENCY_DIST="empirical",
+            FAKE_GLM_LATENCY_SAMPLES_FILE=samples_path,
+            # 录制的上游耗时已包含思考时间
+            FAKE_GLM_THINKING_LATENCY="0",
+            FAKE_GLM_SEED=str(args.seed),
+        )
+        backend_env = dict(os.environ)
+        backend_env.update(
+            SERVER_MODE="production",
+            WEB_WORKERS=str(args.workers),
+            HOST="127.0.0.1",
+            PORT=str(backend_port),
+            LOG_LEVEL="warning",
+            LOG_FILE="",
+            ZHIPUAI_BASE_URL=fake_url,
+            ZHIPUAI_API_KEY=os.getenv("ZHIPUAI_API_KEY", "bench-key"),
+            JOB_QUEUE_DB=os.path.join(tmpdir, "jobs.db"),
+            JOB_WORKERS="0",
+            # 缓存和共享状态从空开始，回放时不再录制
+            SHARED_STATE_DIR=tmpdir,
+            TRAFFIC_RECORD_FILE="",
+        )
+        backend_env.update(item.split("=", 1) for item in args.env)
+
+        fake_log = open(os.path.join(tmpdir, "fake.log"), "w")
+        backend_log = open(os.path.join(tmpdir, "backend.log"), "w")
+        fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_glm_server.py")],
+                                env=fake_env, stdout=fake_log, stderr=subprocess.STDOUT)
+        backend = subprocess.Popen([sys.executable, "start.py"], cwd=BACKEND_DIR,
+                                   env=backend_env, stdout=backend_log, stderr=subprocess.STDOUT)
+        try:
+            wait_until_ready(f"{fake_url}/stats", fake)
+            wait_until_ready(f"{base_url}/api/ready", backend)
+            print(f"replaying {len(records)} requests recorded over {duration:.1f}s at {args.speed:g}x "
+                  f"(~{duration / args.speed:.1f}s), backend workers {args.workers}")
+            calls_before = upstream_calls(fake_url)
+            start = time.perf_counter()
+            results = asyncio.run(replay(base_url, records, requests, args.speed))
+            elapsed = time.perf_counter() - start
+            calls = upstream_calls(fake_url) - calls_before
+        except Exception:
+            backend_log.flush()
+            with open(backend_log.name) as f:
+                sys.stderr.write(f.read()[-4000:])
+            raise
+        finally:
+            backend.terminate()
+            fake.terminate()
+            backend.wait(timeout=30)
+            fake.wait(timeout=10)
+            fake_log.close()
+            backend_log.close()
+
+    summaries = []
+    for route in args.routes:
+        route_records = [record for record in records if record["r"] == route]
+        if route_records:
+            summaries.append(summarize(route, route_records, [result for result in results if result["route"] == route]))
+    summaries.append(summarize("all", records, results, calls))
+
+    print(f"{'route':<20} {'req':>6} {'errors':>7} {'p50':>8} {'p95':>8} {'p99':>8} "
+          f"{'rec p50':>8} {'rec p95':>8} {'late max':>9}")
+    for summary in summaries:
+        print(f"{summary['route']:<20} {summary['requests']:>6} {summary['errors']:>7} "
+              f"{summary['p50'] * 1000:>6.0f}ms {summary['p95'] * 1000:>6.0f}ms {summary['p99'] * 1000:>6.0f}ms "
+              f"{summary['recorded_p50'] * 1000:>6.0f}ms {summary['recorded_p95'] * 1000:>6.0f}ms "
+              f"{summary['max_lateness'] * 1000:>7.0f}ms")
+    print(f"elapsed {elapsed:.1f}s, upstream calls {calls} (recorded {summaries[-1]['recorded_upstream_calls']})")
+
+    report = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "recording": {"requests": len(records), "duration": duration},
+        "results": summaries,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nresults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(summaries, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+UnblurAI 异步识别任务工作进程
+
+与 API 进程共享 JOB_QUEUE_DB 数据库文件，独立处理 /api/jobs 提交的任务。
+API 进程设置 JOB_WORKERS=0 时只负责接收任务，识别工作可按需单独扩容。
+
+用法：
+    python job_worker.py [--workers 4]
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+from app.utils.logging_setup import setup_logging
+
+setup_logging(os.getenv("JOB_WORKER_LOG_FILE"))
+
+from app.services.job_queue import create_job_queue
+from app.services.zhipuai_service import ZhipuAIService
+
+
+async def run(workers: int) -> None:
+    service = ZhipuAIService()
+    queue = create_job_queue()
+    queue.start(service.recognize, workers)
+    # 收到 SIGTERM / SIGINT 后停止领取新任务，等待进行中的任务完成
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        print("\nShutting down UnblurAI job worker...")
+        await queue.stop(float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 60)))
+        queue.close()
+        await service.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="UnblurAI job worker")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", 4)))
+    args = parser.parse_args()
+    asyncio.run(run(args.workers))
+
+
+if __name__ == "__main__":
+    main()
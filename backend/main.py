@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -8,48 +9,84 @@ from datetime import datetime
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('logs/app.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from app.utils.logging_setup import RequestLogMiddleware, setup_logging
+
+# 配置日志：经队列由后台线程写入控制台和轮转文件（LOG_FILE 为空时只输出到控制台，目录不存在时自动创建）
+setup_logging(os.getenv("LOG_FILE", "logs/app.log"))
 logger = logging.getLogger(__name__)
 
 from app.api.upload import router as upload_router
 from app.api.health import router as health_router
 from app.api.tune import router as tune_router
-from app.api.stream import router as stream_router
+from app.api.batch import router as batch_router
+from app.api.metrics import router as metrics_router
+from app.api.jobs import router as jobs_router, JOB_WORKERS
+from app.api.refine import router as refine_router
+from app.api.clients import router as clients_router
+from app.services.job_queue import close_job_queue, get_job_queue
+from app.services.zhipuai_service import close_zhipuai_service, get_zhipuai_service
+from app.utils.metrics import MetricsMiddleware
+from app.utils.traffic_recorder import TrafficRecorderMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 导入时不创建任何客户端；启动时创建进程内共享的服务，缺少配置时在此立即报错
+    service = get_zhipuai_service()
+    app.state.draining = False
+    if JOB_WORKERS > 0:
+        # 启动异步识别任务的工作协程
+        get_job_queue().start(service.recognize, JOB_WORKERS)
+    yield
+    # 进入退出流程：/api/ready 返回 503，进行中的任务在宽限期内完成后再关闭连接池
+    app.state.draining = True
+    await close_job_queue(float(os.getenv("SERVER_GRACEFUL_TIMEOUT", 60)))
+    await close_zhipuai_service()
 
 # 创建FastAPI应用实例
 app = FastAPI(
     title="UnblurAI API",
     description="文字去模糊识别系统 API",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# 配置CORS
+# 配置CORS：默认只允许 Vue 开发服务器地址，部署给其他前端或 API 使用方时通过 CORS_ALLOW_ORIGINS（逗号分隔）配置
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["http://localhost:5173", "http://127.0.0.1:5173"],  # Vue开发服务器地址
+    allow_origins=[
+        origin.strip()
+        for origin in os.getenv("CORS_ALLOW_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173").split(",")
+        if origin.strip()
+    ],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+# 记录每个路由的请求数和延迟
+app.add_middleware(MetricsMiddleware)
+
+# 请求录制（TRAFFIC_RECORD_FILE 非空时开启），需读取请求日志中间件设置的阶段耗时
+app.add_middleware(TrafficRecorderMiddleware)
+
+# 请求标识和请求日志（最后添加，位于最外层）
+app.add_middleware(RequestLogMiddleware)
+
 # 注册路由
 app.include_router(upload_router, prefix="/api")
 app.include_router(health_router, prefix="/api")
 app.include_router(tune_router, prefix="/api")
-app.include_router(stream_router, prefix="/api")
+app.include_router(batch_router, prefix="/api")
+app.include_router(metrics_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.include_router(refine_router, prefix="/api")
+app.include_router(clients_router, prefix="/api")
 
 @app.get("/")
 async def root():
     return {"message": "UnblurAI API is running"}
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, log_level="warning")
\ No newline at end of file
+    # 与 start.py 相同，SERVER_MODE=production 时以多工作进程方式运行
+    from start import main as start_server
+    start_server()
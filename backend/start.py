@@ -1,39 +1,91 @@
 #!/usr/bin/env python3
 """
 UnblurAI Backend 启动脚本
+
+SERVER_MODE=development（默认）：单进程 + 热重载
+SERVER_MODE=production：多工作进程、uvloop/httptools、优雅退出
 """
 
 import os
 import sys
+import importlib.util
 import uvicorn
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+
+def optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def production_options() -> dict:
+    """生产模式的 uvicorn 参数"""
+    # 默认每个 CPU 核心一个工作进程（未设置 SHARED_STATE_DIR 时限流器、缓存等按进程独立计算）
+    workers = int(os.getenv("WEB_WORKERS") or os.cpu_count() or 1)
+    # uvloop / httptools 已安装时使用（uvicorn[standard] 自带），否则回退到 asyncio / h11
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    http = "httptools" if importlib.util.find_spec("httptools") else "h11"
+    return {
+        "workers": workers,
+        "loop": loop,
+        "http": http,
+        # 保持连接时间应大于前置负载均衡的空闲超时，避免其复用已被关闭的连接
+        "timeout_keep_alive": int(os.getenv("SERVER_KEEPALIVE_TIMEOUT", 65)),
+        "backlog": int(os.getenv("SERVER_BACKLOG", 2048)),
+        # 每个工作进程的最大并发连接数，超出时直接返回 503
+        "limit_concurrency": optional_int("SERVER_LIMIT_CONCURRENCY"),
+        # 处理指定数量的请求后重启工作进程（可选）
+        "limit_max_requests": optional_int("SERVER_MAX_REQUESTS"),
+        # 收到 SIGTERM 后停止接收新连接，最多等待该时长让进行中的识别和流式响应完成
+        "timeout_graceful_shutdown": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 60)),
+        "proxy_headers": True,
+        "forwarded_allow_ips": os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+        "access_log": os.getenv("SERVER_ACCESS_LOG", "false").lower() == "true",
+    }
+
+
 def main():
     """启动FastAPI应用"""
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", 8000))
     log_level = os.getenv("LOG_LEVEL", "info").lower()
-    
+    mode = os.getenv("SERVER_MODE", "development").lower()
+
+    if mode == "production":
+        options = production_options()
+        # 多工作进程时默认共享识别缓存、GLM 限流状态和微调会话（SHARED_STATE_DIR 设为空可关闭），由各工作进程继承
+        if options["workers"] > 1:
+            os.environ.setdefault("SHARED_STATE_DIR", "data/shared")
+    else:
+        options = {"reload": True}  # 开发模式下启用热重载
+
     print(f"Starting UnblurAI API server...")
+    print(f"Mode: {mode}")
     print(f"Host: {host}")
     print(f"Port: {port}")
     print(f"Log Level: {log_level}")
-    
+    if mode == "production":
+        print(f"Workers: {options['workers']} (loop={options['loop']}, http={options['http']})")
+        print(f"Shared state: {os.getenv('SHARED_STATE_DIR') or 'disabled (per-worker)'}")
+        if options["workers"] > 1 and not os.getenv("SHARED_STATE_DIR"):
+            print("Warning: refine sessions are kept per worker without SHARED_STATE_DIR; "
+                  "route /api/refine/sessions/* with session affinity or set WEB_WORKERS=1")
+
     # 检查必要的环境变量
-    if not os.getenv("ZHIPUAI_API_KEY"):
+    if not any(os.getenv(name) for name in ("ZHIPUAI_API_KEY", "ZHIPUAI_API_KEYS", "GLM_BACKENDS")):
         print("Warning: ZHIPUAI_API_KEY not found in environment variables")
         print("Please set your ZhipuAI API key in .env file")
-    
+
     try:
         uvicorn.run(
             "main:app",
             host=host,
             port=port,
             log_level=log_level,
-            reload=True  # 开发模式下启用热重载
+            **options
         )
     except KeyboardInterrupt:
         print("\nShutting down UnblurAI API server...")
@@ -42,4 +94,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,41 @@
+"""
+客户端识别与配额的测试
+
+用法（在 backend 目录下）：
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.client_quota import ClientPolicy, ClientQuotas, QuotaExceededError  # noqa: E402
+
+
+class IdentifyTest(unittest.TestCase):
+    def setUp(self):
+        self.quotas = ClientQuotas(
+            api_keys={"key-web": ClientPolicy(name="web", qps=100, burst=100)},
+            default_qps=1,
+            default_burst=2,
+        )
+
+    def test_anonymous_client_keyed_by_address(self):
+        """未认证的请求更换 X-Client-ID 不能获得新的配额"""
+        for index in range(2):
+            self.quotas.acquire(self.quotas.identify(None, f"client-{index}", "203.0.113.7"))
+        with self.assertRaises(QuotaExceededError):
+            self.quotas.acquire(self.quotas.identify(None, "client-new", "203.0.113.7"))
+        # 其他来源地址不受影响
+        self.quotas.acquire(self.quotas.identify(None, "client-0", "203.0.113.8"))
+
+    def test_client_id_is_sub_label_under_api_key(self):
+        client = self.quotas.identify("key-web", "alice", "203.0.113.7")
+        self.assertEqual((client.key, client.label, client.name, client.qps), ("key:web", "web", "web/alice", 100))
+        self.assertEqual(self.quotas.identify("key-web", "bob", "198.51.100.1").flow, client.flow)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+分块识别结果合并的测试
+
+用法（在 backend 目录下）：
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from app.models.models import RecognizedLine  # noqa: E402
+from app.services.image_tiling import TilingConfig, merge_grid_lines, merge_tile_texts, split_image  # noqa: E402
+from app.utils.image_validation import ValidatedImage  # noqa: E402
+
+FONT_SIZE = 64
+LINES = [
+    "Quarterly report: the revenue grew by twelve percent while operating costs stayed flat across all regions",
+    "本季度项目整体进度符合预期，关键里程碑均已按时完成，客户反馈集中在导出格式和批量处理速度两个方面，下一阶段需要重点关注识别准确率",
+    "Action items: migrate the billing database, renew the vendor contract, and schedule the regression tests",
+]
+
+
+def render_wide_page(width: int, height: int):
+    """生成每行文字都横跨整个宽度的宽图，返回 (图片数据, [(文字, 每个字符的 x 区间, y 区间)])"""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    layout = []
+    y = 200
+    while y < height - 200:
+        for text in LINES:
+            spans = []
+            x = 40.0
+            for char in text:
+                advance = draw.textlength(char, font_size=FONT_SIZE)
+                spans.append((x, x + advance))
+                x += advance
+            draw.text((40, y), text, fill=(20, 20, 20), font_size=FONT_SIZE)
+            layout.append((text, spans, (y, y + FONT_SIZE)))
+            y += FONT_SIZE * 2
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue(), layout
+
+
+def simulate_tile(box, layout):
+    """模拟对一个分块的逐行结构化识别：只输出完整位于分块内的行中、字符中心落在分块内的部分"""
+    left, top, right, bottom = box
+    lines = []
+    for text, spans, (y1, y2) in layout:
+        if y1 < top or y2 > bottom:
+            continue
+        visible = [(char, span) for char, span in zip(text, spans) if left <= (span[0] + span[1]) / 2 < right]
+        if not visible:
+            continue
+        x1, x2 = visible[0][1][0], visible[-1][1][1]
+        lines.append(RecognizedLine(
+            text="".join(char for char, _ in visible).strip(),
+            box=[
+                round((x1 - left) * 1000 / (right - left)),
+                round((y1 - top) * 1000 / (bottom - top)),
+                round((x2 - left) * 1000 / (right - left)),
+                round((y2 - top) * 1000 / (bottom - top)),
+            ],
+        ))
+    return lines
+
+
+class MergeGridLinesTest(unittest.TestCase):
+    def test_wide_image_lines_spanning_columns(self):
+        """宽图按网格切分后，横跨左右分块的行应按原顺序完整合并，且不重复重叠区的文字"""
+        data, layout = render_wide_page(4200, 2600)
+        boxes, _ = split_image(ValidatedImage.from_bytes(data, max_size=len(data)), TilingConfig(mode="grid", tile_size=1600, overlap=96))
+        self.assertGreater(len(boxes[0]), 1, "宽图应至少切分为两列")
+        self.assertGreater(len(boxes), 1, "应至少切分为两行，以覆盖垂直重叠区的去重")
+        self.assertTrue(all(spans[-1][1] > boxes[0][0][2] for _, spans, _ in layout), "每行文字都应越过第一列的右边界")
+
+        tile_lines = [[simulate_tile(box, layout) for box in row] for row in boxes]
+        merged = merge_grid_lines(boxes, tile_lines)
+        self.assertEqual(merged.split("\n"), [text for text, _, _ in layout])
+
+    def test_lines_without_boxes_keep_tile_order(self):
+        """模型未输出坐标时按分块内的顺序估计位置，仍能得到文字"""
+        boxes = [[(0, 0, 1000, 500), (900, 0, 2000, 500)]]
+        tile_lines = [[[RecognizedLine(text="第一行"), RecognizedLine(text="第二行")], []]]
+        self.assertEqual(merge_grid_lines(boxes, tile_lines), "第一行\n第二行")
+
+
+class MergeTileTextsTest(unittest.TestCase):
+    def test_band_overlap_deduplicated(self):
+        rows = [["第一行\n第二行\n第三行"], ["第三行\n第四行"]]
+        self.assertEqual(merge_tile_texts(rows, [False, True]), "第一行\n第二行\n第三行\n第四行")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+持久化任务队列租约超时的测试
+
+用法（在 backend 目录下）：
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from io import BytesIO
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from app.services.job_queue import JobQueue  # noqa: E402
+from app.utils.image_validation import ValidatedImage  # noqa: E402
+
+
+def small_image() -> ValidatedImage:
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buffer, format="PNG")
+    return ValidatedImage.from_bytes(buffer.getvalue())
+
+
+async def recognize(image, custom_prompt):
+    return SimpleNamespace(text="识别结果", cached=False)
+
+
+class JobLeaseTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def make_queue(self, **options) -> JobQueue:
+        queue = JobQueue(self.path, lease_timeout=0.2, poll_interval=0.05, **options)
+        self.addCleanup(queue.close)
+        return queue
+
+    async def wait_finished(self, queue: JobQueue, job_id: str, timeout: float = 5.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = await queue.get(job_id)
+            if job.finished:
+                return job
+            await asyncio.sleep(0.05)
+        self.fail(f"任务 {job_id} 未在 {timeout}s 内完成")
+
+    async def test_abandoned_job_requeued_by_running_worker(self):
+        """工作进程领取任务后崩溃，已在运行的其他工作进程在租约超时后接手"""
+        crashed = self.make_queue()
+        job = await crashed.submit(small_image())
+        # 模拟领取后崩溃：领取任务后不再更新
+        self.assertEqual((await asyncio.to_thread(crashed._claim))[0], job.job_id)
+
+        # 启动时租约尚未超时，由运行中的定期检查重新入队
+        worker = self.make_queue()
+        worker.start(recognize, workers=1)
+        self.addAsyncCleanup(worker.stop)
+
+        finished = await self.wait_finished(worker, job.job_id)
+        self.assertEqual((finished.status, finished.recognized_text, finished.attempts), ("succeeded", "识别结果", 2))
+        self.assertEqual(worker.stats()["expired"], 1)
+
+    async def test_job_failed_after_max_attempts(self):
+        """每次运行都超时的任务达到尝试上限后标记为失败，不再无限重试"""
+        queue = self.make_queue(max_attempts=2)
+        job = await queue.submit(small_image())
+        for _ in range(2):
+            self.assertEqual((await asyncio.to_thread(queue._claim))[0], job.job_id)
+            await asyncio.sleep(0.25)
+        self.assertIsNone(await asyncio.to_thread(queue._claim))
+
+        failed = await queue.get(job.job_id)
+        self.assertEqual((failed.status, failed.attempts), ("failed", 2))
+        self.assertIn("超时", failed.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+近似重复图片校验的测试
+
+用法（在 backend 目录下）：
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from app.services.perceptual_index import PerceptualIndex, image_fingerprint  # noqa: E402
+from app.utils.image_validation import ValidatedImage  # noqa: E402
+
+ROWS = [("consulting", "247.07"), ("hosting", "6541.08"), ("licenses", "65823.62"), ("support", "5641.47")]
+
+
+def render_invoice(rows, font_size: int) -> Image.Image:
+    line_height = int(font_size * 1.8)
+    image = Image.new("RGB", (font_size * 30, line_height * (len(rows) + 3)), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((font_size, font_size // 2), "INVOICE No. 2024-0815", fill="black", font_size=int(font_size * 1.3))
+    for index, (item, amount) in enumerate(rows):
+        y = line_height * (index + 2)
+        draw.text((font_size, y), item, fill="black", font_size=font_size)
+        draw.text((image.width - font_size * 9, y), amount, fill="black", font_size=font_size)
+    return image
+
+
+def fingerprint(image: Image.Image, fmt: str = "PNG", **options):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **options)
+    data = buffer.getvalue()
+    return image_fingerprint(ValidatedImage.from_bytes(data, max_size=len(data)).grayscale())
+
+
+class PerceptualIndexTest(unittest.TestCase):
+    def test_single_digit_edit_not_reused(self):
+        """只改动一个数字（5641.47 -> 6641.47）的发票即使 dHash 相同也不能复用"""
+        edited = list(ROWS)
+        edited[3] = ("support", "6641.47")
+        for font_size in (22, 16, 12):
+            with self.subTest(font_size=font_size):
+                index = PerceptualIndex()
+                index.add(fingerprint(render_invoice(ROWS, font_size)), "context", "original")
+                self.assertIsNone(index.find(fingerprint(render_invoice(edited, font_size)), "context"))
+                self.assertIsNone(index.find(fingerprint(render_invoice(edited, font_size), "JPEG", quality=75), "context"))
+
+    def test_reencoded_copy_reused(self):
+        """同一张图重新保存为 JPEG 或裁去少量白边后可以复用"""
+        index = PerceptualIndex()
+        image = render_invoice(ROWS, 16)
+        index.add(fingerprint(image), "context", "original")
+        self.assertEqual(index.find(fingerprint(image, "JPEG", quality=75), "context"), "original")
+        self.assertEqual(index.find(fingerprint(image.crop((6, 6, image.width - 6, image.height - 6))), "context"), "original")
+        self.assertIsNone(index.find(fingerprint(image), "other context"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+微调会话存储的测试
+
+用法（在 backend 目录下）：
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.refine_session import RefineSessionStore, SharedRefineSessionStore  # noqa: E402
+
+
+class SharedRefineSessionStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "refine_sessions.db")
+        # 两个存储实例共用同一个数据库，模拟两个工作进程
+        self.first = SharedRefineSessionStore(path)
+        self.second = SharedRefineSessionStore(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_session_visible_to_other_worker(self):
+        session = await self.first.create("第一行\n第二行")
+        other = await self.second.get(session.session_id)
+        self.assertEqual(other.lines, ["第一行", "第二行"])
+
+        self.assertTrue(await self.second.update(other, ["第一行", "第2行"], "改为数字"))
+        latest = await self.first.get(session.session_id)
+        self.assertEqual((latest.lines, latest.instructions, latest.version), (["第一行", "第2行"], ["改为数字"], 1))
+
+    async def test_concurrent_update_from_other_worker_rejected(self):
+        """两个工作进程基于同一版本微调时，后保存的一方失败，不覆盖先保存的结果"""
+        session = await self.first.create("原文")
+        stale = await self.first.get(session.session_id)
+        other = await self.second.get(session.session_id)
+        self.assertTrue(await self.second.update(other, ["第二个进程"], "指令二"))
+        self.assertFalse(await self.first.update(stale, ["第一个进程"], "指令一"))
+        latest = await self.first.get(session.session_id)
+        self.assertEqual((latest.lines, latest.version), (["第二个进程"], 1))
+
+    async def test_delete_and_expiry(self):
+        session = await self.first.create("原文")
+        self.assertTrue(await self.second.delete(session.session_id))
+        self.assertIsNone(await self.first.get(session.session_id))
+
+        self.first.ttl = 0.05
+        session = await self.first.create("原文")
+        await asyncio.sleep(0.1)
+        self.assertIsNone(await self.second.get(session.session_id))
+
+
+class RefineSessionStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_update_after_delete_rejected(self):
+        store = RefineSessionStore()
+        session = await store.create("原文")
+        await store.delete(session.session_id)
+        self.assertFalse(await store.update(session, ["新文本"], "指令"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,8 +10,9 @@ export interface RecognitionResult {
 }
 
 export interface StreamingProgress {
-  type: 'start' | 'progress' | 'success' | 'error'
+  type: 'start' | 'progress' | 'reasoning' | 'delta' | 'success' | 'error'
   message?: string
+  content?: string
   recognized_text?: string
   confidence?: number
   processing_time?: number
@@ -54,6 +55,13 @@ export const useAppStore = defineStore('app', () => {
       case 'progress':
         streamingLogs.value.push(progress.message || '处理中...')
         break
+
+      case 'delta':
+        // 模型输出的识别文字增量，实时追加显示
+        if (recognitionResult.value) {
+          recognitionResult.value.recognized_text += progress.content || ''
+        }
+        break
         
       case 'success':
         isStreaming.value = false